@@ -11,19 +11,25 @@ import bpo.api.job_callback.build_package
 import bpo.api.job_callback.get_depends
 import bpo.api.job_callback.repo_bootstrap
 import bpo.api.job_callback.sign_index
+import bpo.api.public.status
 import bpo.api.public.update_job_status
 import bpo.api.push_hook.gitlab
 import bpo.config.args
 import bpo.config.tokens
 import bpo.db
+import bpo.db.archive
+import bpo.helpers.apk_cache
 import bpo.helpers.job
 import bpo.images.queue
 import bpo.repo
+import bpo.repo.indexer
+import bpo.repo.scheduler
 import bpo.repo.staging
 import bpo.repo.tools
 import bpo.repo.wip
 import bpo.ui
 import bpo.ui.images
+import bpo.ui.renderer
 
 
 def logging_init():
@@ -38,6 +44,7 @@ def init_components():
     bpo.db.init()
     bpo.repo.tools.init()
     bpo.repo.wip.do_keygen()
+    bpo.helpers.apk_cache.init()
     bpo.helpers.job.init()
     bpo.ui.init()
 
@@ -50,27 +57,41 @@ def main(return_app=False, fill_image_queue=True):
                                  don't want to test building images. """
     init_components()
 
-    # Update UI by writing a new log message
-    bpo.ui.log("restart")
+    with bpo.db.scope("restart"):
+        # Update UI by writing a new log message
+        bpo.ui.log("restart")
 
-    # Maintenance tasks (fix repo inconsistencies, remove old images etc.)
-    bpo.repo.status.fix()
-    bpo.images.queue.remove_not_in_config()
-    bpo.images.remove_old()
-    bpo.ui.images.write_index_all()
+        # Maintenance tasks (fix repo inconsistencies, remove old images etc.)
+        bpo.repo.status.fix()
+        bpo.images.queue.remove_not_in_config()
+        bpo.images.remove_old()
+        bpo.ui.images.write_index_all()
+        bpo.db.archive.run()
+        bpo.helpers.apk_cache.prune()
 
-    # Kick off build jobs for queued packages / images
-    if fill_image_queue:
-        bpo.images.queue.timer_iterate(repo_build=False)
-    bpo.repo.build()
+        # Kick off build jobs for queued packages / images
+        if fill_image_queue:
+            bpo.images.queue.timer_iterate(repo_build=False)
+        bpo.repo.build()
 
-    # Fill up queue with packages to build
-    if bpo.config.args.auto_get_depends:
-        for branch in bpo.repo.staging.get_branches_with_staging():
-            bpo.jobs.get_depends.run(branch)
+        # From now on, API callbacks only wake up the scheduler thread instead
+        # of running bpo.repo.build() before answering the request (#49)
+        bpo.repo.scheduler.start()
 
-    # Restart is complete
-    bpo.ui.log("restart_done")
+        # Collapse the html_out updates of multiple log messages
+        bpo.ui.renderer.start()
+
+        # Collapse the WIP APKINDEX updates of multiple build-package
+        # callbacks
+        bpo.repo.indexer.start()
+
+        # Fill up queue with packages to build
+        if bpo.config.args.auto_get_depends:
+            for branch in bpo.repo.staging.get_branches_with_staging():
+                bpo.jobs.get_depends.run(branch)
+
+        # Restart is complete
+        bpo.ui.log("restart_done")
 
     # Initialize flask server
     app = Flask(__name__)
@@ -84,6 +105,9 @@ def main(return_app=False, fill_image_queue=True):
 def stop():
     """ Clean up after running the BPO Server. Used in the testsuite. """
     bpo.images.queue.timer_stop()
+    bpo.repo.scheduler.stop()
+    bpo.repo.indexer.stop()
+    bpo.ui.renderer.stop()
 
 
 if __name__ == "__main__":
@@ -9,6 +9,16 @@ import bpo.repo.staging
 blueprint = flask.Blueprint("bpo_api", __name__)
 
 
+@blueprint.before_app_request
+def before_request():
+    bpo.db.scope_begin(f"{flask.request.method} {flask.request.path}")
+
+
+@blueprint.teardown_app_request
+def teardown_request(exception):
+    bpo.db.scope_end()
+
+
 def get_header(request, key):
     header = "X-BPO-" + key
     if header not in request.headers:
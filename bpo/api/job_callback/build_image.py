@@ -13,6 +13,7 @@ import bpo.api
 import bpo.config.args
 import bpo.db
 import bpo.images
+import bpo.repo.scheduler
 import bpo.ui
 import bpo.ui.images
 
@@ -108,14 +109,20 @@ def upload_finish(session, image, path_temp, dir_name):
 
     # Fill target dir
     count = 0
+    size = 0
     for path_img_temp in glob.glob(f"{path_temp}/*"):
         path_img = os.path.join(path, os.path.basename(path_img_temp))
         logging.info(f"Moving from tempdir: {path_img}")
         shutil.move(path_img_temp, path_img)
         count += 1
+        size += os.path.getsize(path_img)
 
     os.rmdir(path_temp)
 
+    bpo.db.build_attempt_finish(session, "build_image",
+                                bpo.db.BuildAttemptOutcome.success,
+                                image.job_id, size)
+
     # Update database (status, job_id, dir_name, date)
     bpo.db.set_image_status(session, image, bpo.db.ImageStatus.published,
                             image.job_id, dir_name, datetime.datetime.now())
@@ -129,7 +136,7 @@ def upload_finish(session, image, path_temp, dir_name):
     bpo.ui.images.write_index_all()
 
     # Start next build job
-    bpo.repo.build()
+    bpo.repo.scheduler.wakeup()
     return f"image dir created from {count} files, kthxbye"
 
 
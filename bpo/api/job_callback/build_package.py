@@ -9,6 +9,9 @@ from bpo.helpers.headerauth import header_auth
 import bpo.api
 import bpo.config.args
 import bpo.db
+import bpo.helpers.apk_cache
+import bpo.repo.indexer
+import bpo.repo.scheduler
 import bpo.repo.wip
 import bpo.ui
 
@@ -27,13 +30,24 @@ def job_callback_build_package():
     os.makedirs(wip, exist_ok=True)
 
     # Save files to disk
+    size = 0
     for apk in apks:
         path = wip + "/" + apk.filename
         logging.info("Saving " + path)
         apk.save(path)
+        size += os.path.getsize(path)
 
-    # Index and sign WIP APKINDEX
-    bpo.repo.wip.update_apkindex(package.arch, package.branch, package.splitrepo)
+        # Cache the metadata while the apk is likely still in the page cache
+        bpo.helpers.apk_cache.get_metadata(path)
+
+    # Index and sign WIP APKINDEX (in the indexer thread, together with the
+    # apks of other packages that finish around the same time)
+    bpo.repo.indexer.request(package.arch, package.branch, package.splitrepo,
+                             add=[apk.filename for apk in apks])
+
+    bpo.db.build_attempt_finish(session, "build_package",
+                                bpo.db.BuildAttemptOutcome.success,
+                                package.job_id, size)
 
     # Change status to built
     bpo.db.set_package_status(session, package, bpo.db.PackageStatus.built,
@@ -42,5 +56,5 @@ def job_callback_build_package():
     bpo.ui.log_package(package, "api_job_callback_build_package")
 
     # Build next package or publish repo after building all queued packages
-    bpo.repo.build()
+    bpo.repo.scheduler.wakeup()
     return "package received, kthxbye"
@@ -4,15 +4,17 @@
 import collections
 import json
 import logging
+import sqlalchemy
 from flask import request
 from bpo.helpers.headerauth import header_auth
 import bpo.api
 import bpo.config.args
 import bpo.db
-import bpo.helpers.job
 import bpo.helpers.pmb
 import bpo.repo
 import bpo.repo.bootstrap
+import bpo.repo.depgraph
+import bpo.repo.scheduler
 import bpo.repo.staging
 import bpo.repo.wip
 import bpo.ui
@@ -50,60 +52,118 @@ def get_payload(request, arch, branch):
     return ret
 
 
+def get_packages_db(session, arch, branch):
+    """ :returns: dict of (splitrepo, pkgname): row with id, version and
+                  status of all packages of arch/branch, from one query """
+    Package = bpo.db.Package
+    result = session.query(Package.id, Package.splitrepo, Package.pkgname,
+                           Package.version, Package.status)\
+        .filter_by(arch=arch, branch=branch)
+    return {(row.splitrepo, row.pkgname): row for row in result}
+
+
 def update_or_insert_packages(session, payload, arch, branch):
     """ Update/insert packages from payload into the database, with all
         information except for the dependencies. These need to be set later,
         because that needs to happen after each package has an ID assigned.
-        Otherwise we will get duplicates in the database (resulting in errors
-        from the unique pkgname-arch index). """
+
+        The existing packages are loaded with one query, and the changes are
+        written with one executemany per statement, without committing (see
+        job_callback_get_depends()). """
+    packages_db = get_packages_db(session, arch, branch)
+    table = bpo.db.Package.__table__
+
+    inserts = []
+    updates = []
     for package in payload:
         pkgname = package["pkgname"]
         version = package["version"]
         splitrepo = package["repo"]
 
-        # Find existing db entry if possible (update or insert logic)
-        package_db = bpo.db.get_package(session, pkgname, arch, branch, splitrepo)
-        if package_db:
-            if package_db.version != version:
-                bpo.jobs.build_package.abort(package_db)
-                package_db.status = bpo.db.PackageStatus.queued
-                package_db.retry_count = 0
-            package_db.version = version
-        else:
-            package_db = bpo.db.Package(arch, branch, pkgname, version,
-                                        splitrepo=splitrepo)
-        session.merge(package_db)
-    session.commit()
+        row = packages_db.get((splitrepo, pkgname))
+        if not row:
+            inserts.append({"arch": arch,
+                            "branch": branch,
+                            "pkgname": pkgname,
+                            "version": version,
+                            "splitrepo": splitrepo,
+                            "status": bpo.db.PackageStatus.queued,
+                            "retry_count": 0})
+        elif row.version != version:
+            if row.status == bpo.db.PackageStatus.building:
+                bpo.jobs.build_package.abort(session.get(bpo.db.Package,
+                                                         row.id))
+            updates.append({"_id": row.id,
+                            "version": version,
+                            "status": bpo.db.PackageStatus.queued,
+                            "retry_count": 0})
+
+    if inserts:
+        session.execute(table.insert(), inserts)
+    if updates:
+        stmt = table.update()\
+            .where(table.c.id == sqlalchemy.bindparam("_id"))\
+            .values(version=sqlalchemy.bindparam("version"),
+                    status=sqlalchemy.bindparam("status"),
+                    retry_count=sqlalchemy.bindparam("retry_count"))
+        session.execute(stmt, updates)
+
+    logging.debug(f"{branch}/{arch}: update_or_insert_packages:"
+                  f" {len(inserts)} new, {len(updates)} new versions")
 
 
 def update_package_depends(session, payload, arch, branch):
+    """ Set the dependencies of all packages in the payload. Like in
+        update_or_insert_packages(), only the association rows that changed
+        get written with executemany, without committing. """
+    ids = {key: row.id
+           for key, row in get_packages_db(session, arch, branch).items()}
+    assoc = bpo.db.base.metadata.tables["package_dependency"]
+
+    # Current depends of all packages of arch/branch
+    current = set()
+    result = session.query(assoc.c.package_id, assoc.c.dependency_id)\
+        .join(bpo.db.Package, bpo.db.Package.id == assoc.c.package_id)\
+        .filter(bpo.db.Package.arch == arch, bpo.db.Package.branch == branch)
+    for package_id, dependency_id in result:
+        current.add((package_id, dependency_id))
+
+    wanted = set()
     for package in payload:
         splitrepo = package["repo"]
+        package_id = ids[(splitrepo, package["pkgname"])]
 
-        # Build list of dependencies (DB objects)
-        depends = []
         for pkgname in package["depends"]:
-
             # Avoid complexity by only storing postmarketOS dependencies (which
             # are all in the database at this point), and ignoring Alpine
-            # depends.
-            depend = bpo.db.get_package(session, pkgname, arch, branch, splitrepo)
-            if depend:
-                depends.append(depend)
-            elif splitrepo:
-                # For splitrepo packages: check if the dependency exists in the
-                # main pmOS repo
-                depend = bpo.db.get_package(session, pkgname, arch, branch, None)
-                if depend:
-                    depends.append(depend)
-
-        # Write changes
-        package_db = bpo.db.get_package(session, package["pkgname"], arch,
-                                        branch, splitrepo)
-        package_db.depends = depends
-        logging.debug(f"update_package_depends: {package_db}")
-        session.merge(package_db)
-        session.commit()
+            # depends. For splitrepo packages: the dependency may also be in
+            # the main pmOS repo.
+            depend_id = ids.get((splitrepo, pkgname))
+            if not depend_id and splitrepo:
+                depend_id = ids.get((None, pkgname))
+            if depend_id:
+                wanted.add((package_id, depend_id))
+
+    # Only update depends of packages in the payload (deleted packages get
+    # removed in remove_deleted_packages_db())
+    in_payload = set(ids[(package["repo"], package["pkgname"])]
+                     for package in payload)
+    delete = [{"_package_id": package_id, "_dependency_id": dependency_id}
+              for package_id, dependency_id in current - wanted
+              if package_id in in_payload]
+    insert = [{"package_id": package_id, "dependency_id": dependency_id}
+              for package_id, dependency_id in wanted - current]
+
+    if delete:
+        stmt = assoc.delete().where(sqlalchemy.and_(
+            assoc.c.package_id == sqlalchemy.bindparam("_package_id"),
+            assoc.c.dependency_id == sqlalchemy.bindparam("_dependency_id")))
+        session.execute(stmt, delete)
+    if insert:
+        session.execute(assoc.insert(), insert)
+
+    logging.debug(f"{branch}/{arch}: update_package_depends: {len(insert)}"
+                  f" added, {len(delete)} removed")
 
 
 def remove_deleted_packages_db(session, payload, arch, branch, splitrepo):
@@ -112,7 +172,7 @@ def remove_deleted_packages_db(session, payload, arch, branch, splitrepo):
     pmaports.git
 
     :returns: True if packages were deleted, False otherwise """
-    ret = False
+    batch = bpo.db.TransitionBatch(session)
 
     # Sort payload by pkgname for faster lookups
     packages_payload = {}
@@ -128,16 +188,10 @@ def remove_deleted_packages_db(session, payload, arch, branch, splitrepo):
         # Keep entries, that are part of the depends payload
         if package_db.pkgname in packages_payload:
             continue
+        batch.delete(package_db, "package_removed_from_pmaports")
 
-        ret = True
-        bpo.ui.log_package(package_db, "package_removed_from_pmaports")
-
-        # Delete package from db and commit this change, because we might write
-        # to the log in the next iteration. If we don't commit and write to the
-        # log, we get a "database is locked" error.
-        session.delete(package_db)
-        session.commit()
-    return ret
+    # The caller writes a log entry afterwards, which updates the output
+    return batch.commit() > 0
 
 
 @blueprint.route("/api/job-callback/get-depends", methods=["POST"])
@@ -152,12 +206,17 @@ def job_callback_get_depends():
         payloads[arch] = get_payload(request, arch, branch)
 
     # Update packages in DB
-    session = bpo.db.session()
     force_repo_update_branch = None
     for arch, payload in payloads.items():
-        bpo.repo.bootstrap.init(session, payload, arch, branch)
-        update_or_insert_packages(session, payload, arch, branch)
-        update_package_depends(session, payload, arch, branch)
+        # Don't keep half of the packages or depends if writing fails
+        with bpo.db.unit_of_work() as session:
+            bootstrap = bpo.repo.bootstrap.init(session, payload, arch,
+                                                branch)
+            update_or_insert_packages(session, payload, arch, branch)
+            update_package_depends(session, payload, arch, branch)
+        bpo.repo.bootstrap.log_added(arch, branch, bootstrap)
+        # Written without the ORM (see bpo.repo.depgraph)
+        bpo.repo.depgraph.invalidate(arch, branch)
 
         for splitrepo in bpo.config.const.splitrepos:
             if remove_deleted_packages_db(session, payload, arch, branch, splitrepo):
@@ -169,7 +228,5 @@ def job_callback_get_depends():
                job_id=job_id)
 
     # Make sure that we did not miss any job status changes
-    bpo.helpers.job.update_status()
-
-    bpo.repo.build(force_repo_update_branch)
+    bpo.repo.scheduler.wakeup(force_repo_update_branch, update_status=True)
     return "warming up build servers..."
@@ -10,6 +10,7 @@ import bpo.api
 import bpo.config.args
 import bpo.db
 import bpo.repo
+import bpo.repo.scheduler
 import bpo.ui
 
 blueprint = bpo.api.blueprint
@@ -29,6 +30,9 @@ def get_repo_bootstrap(session, request):
 
 
 def fail_callback(session, rb, reason):
+        bpo.db.build_attempt_finish(session, "repo_bootstrap",
+                                    bpo.db.BuildAttemptOutcome.failed,
+                                    rb.job_id)
         bpo.db.set_repo_bootstrap_status(session,
                                          rb,
                                          bpo.db.RepoBootstrapStatus.failed)
@@ -57,10 +61,12 @@ def job_callback_repo_bootstrap():
         True)
 
     # Save files to disk
+    size = 0
     for apk in apks:
         path = f"{wip}/{apk.filename}"
         logging.info(f"Saving: {path}")
         apk.save(path)
+        size += os.path.getsize(path)
 
     # Update DB status for the packages that were uploaded
     removed, updated = bpo.repo.status.fix_disk_vs_db(
@@ -79,10 +85,13 @@ def job_callback_repo_bootstrap():
         logging.warning("WARNING: no packages from repo_bootstrap updated in"
                         " database, previous repo_bootstrap failed half-way?")
 
+    bpo.db.build_attempt_finish(session, "repo_bootstrap",
+                                bpo.db.BuildAttemptOutcome.success,
+                                rb.job_id, size)
     bpo.db.set_repo_bootstrap_status(session,
                                      rb,
                                      bpo.db.RepoBootstrapStatus.built)
 
-    bpo.repo.build()
+    bpo.repo.scheduler.wakeup()
 
     return "repo_bootstrap received, kthxbye"
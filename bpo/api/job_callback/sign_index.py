@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
 import logging
+import os
 from flask import request
 from bpo.helpers.headerauth import header_auth
 import bpo.api
@@ -15,6 +16,7 @@ blueprint = bpo.api.blueprint
 
 
 def save_apkindex(request):
+    """ :returns: size of the saved APKINDEX in bytes """
     # Sanity checks
     files = request.files.getlist("file[]")
     if len(files) != 1:
@@ -30,6 +32,7 @@ def save_apkindex(request):
     path = bpo.repo.symlink.get_path(arch, branch, splitrepo) + "/APKINDEX.tar.gz"
     logging.info("Saving " + path)
     files[0].save(path)
+    return os.path.getsize(path)
 
 
 @blueprint.route("/api/job-callback/sign-index", methods=["POST"])
@@ -40,7 +43,11 @@ def job_callback_sign_index():
     splitrepo = bpo.api.get_splitrepo(request, branch)
 
     # FIXME: check if the index signing was expected
-    save_apkindex(request)
+    size = save_apkindex(request)
+    bpo.db.build_attempt_finish(bpo.db.session(), "sign_index",
+                                bpo.db.BuildAttemptOutcome.success,
+                                size=size, arch=arch, branch=branch,
+                                splitrepo=splitrepo)
 
     bpo.ui.log("api_job_callback_sign_index", arch=arch, branch=branch, splitrepo=splitrepo)
 
@@ -0,0 +1,29 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+import flask
+
+import bpo.api
+import bpo.config.const
+import bpo.ui.snapshot
+
+blueprint = bpo.api.blueprint
+
+
+@blueprint.route("/api/public/status", methods=["GET"])
+def public_status():
+    """ Same data as html_out/status.json, served from the snapshot of the
+        last UI update. Conditional requests (If-None-Match,
+        If-Modified-Since) get answered with 304 if it did not change. This
+        does not touch the database. """
+    export = bpo.ui.snapshot.latest_json
+    if not export:
+        response = flask.Response("status not available yet\n", status=503,
+                                  mimetype="text/plain")
+        response.retry_after = bpo.config.const.ui_render_interval
+        return response
+
+    response = flask.Response(export.data, mimetype="application/json")
+    response.set_etag(export.etag)
+    response.last_modified = export.date
+    response.cache_control.no_cache = True
+    return response.make_conditional(flask.request)
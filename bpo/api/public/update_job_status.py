@@ -1,14 +1,12 @@
 # Copyright 2022 Oliver Smith
 # SPDX-License-Identifier: AGPL-3.0-or-later
 import bpo.api
-import bpo.helpers.job
-import bpo.repo
+import bpo.repo.scheduler
 
 blueprint = bpo.api.blueprint
 
 
 @blueprint.route("/api/public/update-job-status", methods=["POST"])
 def public_update_job_status():
-    bpo.helpers.job.update_status()
-    bpo.repo.build()
+    bpo.repo.scheduler.wakeup(update_status=True)
     return "done"
@@ -84,14 +84,12 @@ def reset_failed_packages(pkgnames_commits, branch):
     def reset_package(package, action, commit, depend_pkgname=None):
         if package.status == bpo.db.PackageStatus.building:
             bpo.jobs.build_package.abort(package)
-        package.status = bpo.db.PackageStatus.queued
-        package.retry_count = 0
-        session.merge(package)
-        session.commit()
-
-        bpo.ui.log_package(package, action, depend_pkgname, commit)
+        batch.set_status(package, bpo.db.PackageStatus.queued, action,
+                         retry_count=0, depend_pkgname=depend_pkgname,
+                         commit=commit)
 
     session = bpo.db.session()
+    batch = bpo.db.TransitionBatch(session)
     failed = session.query(bpo.db.Package).\
         filter_by(status=bpo.db.PackageStatus.failed).\
         filter_by(branch=branch)
@@ -100,7 +98,7 @@ def reset_failed_packages(pkgnames_commits, branch):
         filter_by(branch=branch)
 
     for package_status in [failed, building]:
-        for package in package_status:
+        for package in package_status.all():
             if package.pkgname in pkgnames_commits:
                 commit = pkgnames_commits[package.pkgname]
                 reset_package(package, "api_push_reset_failed", commit)
@@ -113,6 +111,8 @@ def reset_failed_packages(pkgnames_commits, branch):
                                   commit, depend_pkgname=pkg_depend.pkgname)
                     break
 
+    bpo.ui.commit_batch(batch)
+
 
 @blueprint.route("/api/push-hook/gitlab", methods=["POST"])
 @header_auth("X-Gitlab-Token", "push_hook_gitlab")
@@ -42,6 +42,9 @@ def init():
                         help="path to tokens file, where hashes of generated"
                              " auth tokens are stored")
     parser.add_argument("-d", "--db-path", help="path to sqlite3 database")
+    parser.add_argument("--db-url", help="sqlalchemy database URL, e.g."
+                        " postgresql://bpo@localhost/bpo (overrides"
+                        " --db-path)")
     parser.add_argument("-m", "--mirror", help="the final repository location,"
                         " where published and properly signed packages can be"
                         " found")
@@ -58,6 +61,13 @@ def init():
     parser.add_argument("-o", "--html-out", help="directory, to which the html"
                         " status pages will be written while the bpo server"
                         " is running")
+    parser.add_argument("--log-archive-path",
+                        help="where log entries older than the retention"
+                             " window get archived to (one compressed file"
+                             " per month)")
+    parser.add_argument("--apk-cache-path",
+                        help="sqlite3 file, where the metadata of apks in the"
+                             " WIP and final repos gets cached")
     parser.add_argument("--temp-path",
                         help="used for various things, like extracting"
                              " APKINDEX tools and for running local jobs (will"
@@ -16,6 +16,15 @@ repo_wip_keys = top_dir + "/_repo_wip_keys"
 # Right now BPO assumes it runs on x86_64
 native_arch = "x86_64"
 
+# Native packages that must be published before packages of a foreign arch
+# can be built (fnmatch, {arch} is replaced with the foreign arch). Besides
+# these, a foreign package waits for the native packages with the same names
+# as its depends. See bpo/repo/depgraph.py.
+cross_native_packages = ["binutils-{arch}",
+                         "busybox-static-{arch}",
+                         "gcc*-{arch}",
+                         "musl-{arch}"]
+
 # Which pmaports.git branches will be built (e.g. "main", "v20.05", ...).
 # The order of branches/arches is the order in which packages will be built.
 # The native arch of the builders must come first.
@@ -24,11 +33,14 @@ native_arch = "x86_64"
 #     "arches": [...],
 #     "ignore_errors": False | True,    (default: False)
 #     "pmb_branch": PMBOOTSTRAP_BRANCH, (default: "2.3.x")
+#     "weight": WEIGHT,                 (default: 1)
 #   }
 # ignore_errors: WIP branches that are building for the first time should be
 #                listed here, so they are ignored for the big overall status
 #                badge. We don't want errors from these to overshadow errors
 #                from branches that are used in production.
+# weight: share of the build slots, relative to other branches, when using
+#         slots_policy = "fair_share" (see below).
 branches = collections.OrderedDict()
 
 branches["v25.12"] = {
@@ -72,10 +84,61 @@ no_build_strict = ["gcc*-*"]
 # How many build jobs can run in parallel (across all arches)
 max_parallel_build_jobs = 1
 
+# Additional limits on top of max_parallel_build_jobs (see bpo/repo/slots.py).
+# Job types are "build_package" (including repo_bootstrap) and "build_image".
+# sign_index jobs don't use a slot and are never limited. Example:
+#   max_parallel_jobs_type = {"build_package": 3}  # leave a slot for images
+#   max_parallel_jobs_arch = {"riscv64": 1}
+#   max_parallel_jobs_branch = {"main": 2}
+max_parallel_jobs_type = {}
+max_parallel_jobs_arch = {}
+max_parallel_jobs_branch = {}
+
+# How free slots get shared between branches:
+#   "ordered": in the order of the branches above, so a busy branch can use
+#              all slots before the next branch gets one.
+#   "fair_share": each branch with jobs to start gets a share of the slots,
+#                 proportional to its weight. Slots that a branch can't use
+#                 right now (e.g. packages left depend on running builds) go
+#                 to the other branches.
+slots_policy = "ordered"
+
+# Order in which packages of the same arch/branch get built, once their
+# depends are built (see bpo/repo/depgraph.py):
+#   "critical_path": packages with the longest chain of unbuilt packages
+#                    depending on them first, so a long chain (toolchain ->
+#                    kernel -> device packages) does not wait behind leaf
+#                    packages. Nothing gets published before the whole WIP
+#                    repo is built, so this makes the WIP repo complete faster.
+#   "database": failed packages with retries left first, then in the order in
+#               which packages were added to the database.
+build_order = "critical_path"
+
 # Automatically retry build (sometimes builds fail due to network errors, so
 # just retry a few times to make it more robust) (#58)
 retry_count_max = 2
 
+# Weight of the latest successful build when updating the average build
+# duration of a package (bpo.db.BuildStats). Higher values follow changes in
+# build time faster, lower values smooth out slow or fast build machines.
+build_stats_factor = 0.3
+
+# Render html_out at most once per this many seconds (bpo/ui/renderer.py)
+ui_render_interval = 2
+
+# Collect changes to WIP repos for this many seconds, before writing their
+# APKINDEX once (bpo/repo/indexer.py)
+wip_index_delay = 2
+
+# Log entries are kept in the database for this many days, or up to this many
+# entries. Older entries get moved to --log-archive-path (bpo.db.archive).
+log_retention_days = 90
+log_retention_max = 100000
+
+# Log payloads (push hook, get-depends) at least this many bytes long get
+# stored compressed
+log_payload_compress_min = 512
+
 # UID that is used for building packages with pmbootstrap (same as
 # chroot_user_id in pmb/config/__init__.py)
 pmbootstrap_chroot_uid_user = "12345"
@@ -11,6 +11,7 @@ tokens = bpo.config.const.top_dir + "/.tokens.cfg"
 host = "127.0.0.1"
 port = 5000
 db_path = bpo.config.const.top_dir + "/bpo.db"
+db_url = None
 job_service = "local"
 mirror = "https://mirror.postmarketos.org/postmarketos"
 temp_path = bpo.config.const.top_dir + "/_temp"
@@ -18,6 +19,8 @@ repo_final_path = bpo.config.const.top_dir + "/_repo_final"
 repo_wip_path = bpo.config.const.top_dir + "/_repo_wip"
 images_path = bpo.config.const.top_dir + "/_images"
 html_out = bpo.config.const.top_dir + "/_html_out"
+log_archive_path = bpo.config.const.top_dir + "/_log_archive"
+apk_cache_path = bpo.config.const.top_dir + "/_apk_cache.db"
 auto_get_depends = False
 url_api = "https://build.postmarketos.org"
 url_repo_wip = "https://build.postmarketos.org/wip"
@@ -10,32 +10,56 @@ Usage example:
     log = bpo.db.Log(action="db_init", details="hello world")
     session.add(logled)
     session.commit()
+
+API requests, scheduler passes and timer iterations run in a scope (see
+scope_begin()), where bpo.db.session() always returns the same session.
 """
 
+import base64
+import collections
+import contextlib
 import datetime
 import enum
 import sys
 import json
 import logging
+import threading
+import zlib
 
 import sqlalchemy
+import sqlalchemy.event
 import sqlalchemy.orm
-import sqlalchemy.ext.declarative
+import sqlalchemy.pool
 import sqlalchemy.sql
 from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, \
     Table, Index, Enum
 from sqlalchemy.orm import relationship
 
 import bpo.config.args
+import bpo.config.const
 import bpo.db.migrate
+import bpo.repo.depgraph
 import bpo.repo.staging
 
 
-base = sqlalchemy.ext.declarative.declarative_base()
-session = None
+base = sqlalchemy.orm.declarative_base()
+
+# Prefix of compressed Log.payload values (encode_payload())
+payload_prefix_zlib = "zlib:"
+
+session_factory = None
 engine = None
 init_relationships_complete = False
 
+# Scope of the current thread, see scope_begin()
+scope_local = threading.local()
+
+# Amount of sessions and commits, for the tests and for the debug log of
+# scope_end(). Only count with counters_lock held.
+count_sessions = 0
+count_commits = 0
+counters_lock = threading.Lock()
+
 
 class PackageStatus(enum.Enum):
     queued = 0
@@ -76,6 +100,10 @@ class Package(base):
     # [v01]: Index("arch-branch", Package.arch, Package.branch)
     # [v03]: Index("status", Package.status)
     # [v10]: Index("arch-branch-splitrepo", Package.arch, Package.branch, Package.splitrepo)
+    # [v12]: drop "pkgname-arch-branch-splitrepo", "arch-branch-splitrepo",
+    #        "arch-branch", "status" (covered by the new indexes)
+    # [v12]: Index("branch-arch-splitrepo-pkgname", Package.branch, Package.arch, Package.splitrepo, Package.pkgname, unique=True)
+    # [v12]: Index("status-branch-arch", Package.status, Package.branch, Package.arch)
     # === END OF DATABASE LAYOUT ===
 
     def __init__(self, arch, branch, pkgname, version,
@@ -135,6 +163,8 @@ class Log(base):
     depend_pkgname = Column(String, system=True)  # [v7]
     count = Column(Integer, default=0, system=True)  # [v8]
     splitrepo = Column(String, system=True)  # [v11]
+
+    # [v12]: Index("log:date", Log.date)
     # === END OF DATABASE LAYOUT ===
 
     def __init__(self, action, payload=None, arch=None, branch=None,
@@ -142,7 +172,7 @@ class Log(base):
                  device=None, ui=None, dir_name=None, depend_pkgname=None,
                  commit=None, count=None, splitrepo=None):
         self.action = action
-        self.payload = json.dumps(payload, indent=4) if payload else None
+        self.payload = encode_payload(payload)
         self.arch = arch
         self.branch = branch
         self.pkgname = pkgname
@@ -183,6 +213,10 @@ class Log(base):
             ret += f", depend_pkgname: {self.depend_pkgname}"
         return ret
 
+    def get_payload(self):
+        """ :returns: the payload that was passed to __init__(), decoded """
+        return decode_payload(self.payload)
+
 
 class ImageStatus(enum.Enum):
     # Same as PackageStatus, except that "built" is missing. Unlike packages,
@@ -272,6 +306,121 @@ class RepoBootstrap(base):
                 f" job_id={self.job_id}")
 
 
+class BuildAttemptOutcome(enum.Enum):
+    running = 0
+    success = 1
+    failed = 2
+
+
+class BuildAttempt(base):
+    """ One run of a build_package, build_image, repo_bootstrap or sign_index
+        job. Unlike the other tables, this keeps the history. """
+    __tablename__ = "build_attempt"
+
+    # === DATABASE LAYOUT, DO NOT CHANGE! (read docs/db.md) ===
+    id = Column(Integer, primary_key=True)
+    job_name = Column(String)
+    job_id = Column(Integer)
+    arch = Column(String)
+    branch = Column(String)
+    splitrepo = Column(String)
+    pkgname = Column(String)
+    version = Column(String)
+    device = Column(String)
+    ui = Column(String)
+    dir_name = Column(String)
+    retry_count = Column(Integer, default=0)
+    started = Column(DateTime)  # UTC
+    finished = Column(DateTime)  # UTC
+    duration = Column(Integer)  # seconds
+    outcome = Column(Enum(BuildAttemptOutcome))
+    size = Column(Integer)  # bytes of uploaded artifacts
+
+    Index("build_attempt:job_name-job_id", job_name, job_id)
+    Index("build_attempt:outcome", outcome)
+    # === END OF DATABASE LAYOUT ===
+
+    # Jobs that get recorded
+    job_names = ["build_package", "build_image", "repo_bootstrap",
+                 "sign_index"]
+
+    def __init__(self, job_name, job_id, arch=None, branch=None,
+                 splitrepo=None, pkgname=None, version=None, device=None,
+                 ui=None, dir_name=None, retry_count=0):
+        self.job_name = job_name
+        self.job_id = job_id
+        self.arch = arch
+        self.branch = branch
+        self.splitrepo = splitrepo
+        self.pkgname = pkgname
+        self.version = version
+        self.device = device
+        self.ui = ui
+        self.dir_name = dir_name
+        self.retry_count = retry_count
+        self.started = utcnow()
+        self.outcome = BuildAttemptOutcome.running
+
+    def __repr__(self):
+        return (f"build_attempt: {self.job_name} ({self.stats_name()},"
+                f" job_id={self.job_id}, retry_count={self.retry_count},"
+                f" outcome={self.outcome.name})")
+
+    def stats_name(self):
+        """ :returns: name under which the duration gets stored in
+                      BuildStats """
+        if self.job_name == "build_image":
+            return f"{self.device}:{self.ui}"
+        if self.job_name == "repo_bootstrap":
+            return self.dir_name or ""
+        if self.job_name == "sign_index":
+            return self.splitrepo or ""
+        return self.pkgname
+
+
+class BuildStats(base):
+    """ Rolling duration statistics of successful build attempts, per job
+        name, arch and package (see BuildAttempt.stats_name()). """
+    __tablename__ = "build_stats"
+
+    # === DATABASE LAYOUT, DO NOT CHANGE! (read docs/db.md) ===
+    id = Column(Integer, primary_key=True)
+    last_update = Column(DateTime(timezone=True),
+                         server_default=sqlalchemy.sql.func.now(),
+                         onupdate=sqlalchemy.sql.func.now())
+    job_name = Column(String)
+    arch = Column(String)
+    name = Column(String)
+    count = Column(Integer, default=0)
+    duration_avg = Column(Integer)  # seconds
+    duration_last = Column(Integer)  # seconds
+    size_last = Column(Integer)  # bytes
+
+    Index("build_stats:job_name-arch-name", job_name, arch, name,
+          unique=True)
+    # === END OF DATABASE LAYOUT ===
+
+    def __init__(self, job_name, arch, name):
+        self.job_name = job_name
+        self.arch = arch
+        self.name = name
+        self.count = 0
+
+    def __repr__(self):
+        return (f"build_stats: {self.job_name} {self.arch}/{self.name}"
+                f" (count={self.count}, duration_avg={self.duration_avg})")
+
+
+class SchemaVersion(base):
+    """ Layout version of the database, see bpo/db/migrate.py. """
+    __tablename__ = "schema_version"
+
+    # === DATABASE LAYOUT, DO NOT CHANGE! (read docs/db.md) ===
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer)
+    # === END OF DATABASE LAYOUT ===
+
+
 def init_relationships():
     # Only run this once!
     self = sys.modules[__name__]
@@ -298,28 +447,161 @@ def init_relationships():
     # === END OF DATABASE LAYOUT ===
 
 
+def get_url():
+    """ :returns: the --db-url argument, or the URL of the sqlite database in
+                  --db-path """
+    return bpo.config.args.db_url or "sqlite:///" + bpo.config.args.db_path
+
+
 def init():
     """ Initialize db """
-    # Disable check_same_thread, so pysqlite does not print ProgrammingError
-    # junk when running the tests with pytest. SQLAlchemy uses pooling to make
-    # sure that a single connection is not used in more than one thread, so we
-    # can safely disable this check.
-    # https://docs.sqlalchemy.org/en/latest/dialects/sqlite.html
-    connect_args = {"check_same_thread": False}
-
     self = sys.modules[__name__]
-    url = "sqlite:///" + bpo.config.args.db_path
+
+    # Session of the previous engine
+    scope = getattr(scope_local, "scope", None)
+    if scope and scope.session:
+        scope.session.close()
+        scope.session = None
+    url = sqlalchemy.engine.make_url(get_url())
+    kwargs = {"future": True}
+    is_memory = False
+
+    if url.get_backend_name() == "sqlite":
+        # Disable check_same_thread, so pysqlite does not print
+        # ProgrammingError junk when running the tests with pytest. SQLAlchemy
+        # uses pooling to make sure that a single connection is not used in
+        # more than one thread, so we can safely disable this check.
+        # https://docs.sqlalchemy.org/en/latest/dialects/sqlite.html
+        kwargs["connect_args"] = {"check_same_thread": False}
+
+        # Each connection to an in-memory database would get its own empty
+        # database, so share one connection and never close it
+        if url.database in [None, "", ":memory:"]:
+            kwargs["poolclass"] = sqlalchemy.pool.StaticPool
+            is_memory = True
 
     # Open database, upgrade, close, open again
     for before_upgrade in [True, False]:
-        self.engine = sqlalchemy.create_engine(url, connect_args=connect_args)
+        self.engine = sqlalchemy.create_engine(url, **kwargs)
         init_relationships()
         self.base.metadata.create_all(engine)
-        self.session = sqlalchemy.orm.sessionmaker(bind=engine)
+        self.session_factory = sqlalchemy.orm.sessionmaker(bind=engine,
+                                                           future=True)
+        sqlalchemy.event.listen(self.session_factory, "after_commit",
+                                count_commit)
         if before_upgrade:
             bpo.db.migrate.upgrade()
+            if is_memory:
+                break
             self.engine.dispose()
 
+    # Graphs loaded from a previous database are outdated
+    bpo.repo.depgraph.invalidate()
+
+
+class Scope:
+    """ One logical operation (API request, scheduler pass, timer iteration),
+        that shares one session in its thread. """
+
+    def __init__(self, name):
+        self.name = name
+        self.session = None
+        self.depth = 0
+        self.count_sessions = 0
+        self.count_commits = 0
+
+
+def scope_begin(name):
+    """ Let all bpo.db.session() calls of this thread return the same session,
+        until scope_end() gets called. Nested calls are counted, only the
+        outermost scope_end() closes the session. """
+    scope = getattr(scope_local, "scope", None)
+    if not scope:
+        scope = Scope(name)
+        scope_local.scope = scope
+    scope.depth += 1
+
+
+def scope_end():
+    """ Close the session of the scope. Changes that were not committed get
+        rolled back. """
+    scope = scope_local.scope
+    scope.depth -= 1
+    if scope.depth:
+        return
+
+    scope_local.scope = None
+    if scope.session:
+        scope.session.close()
+    logging.debug(f"{scope.name}: {scope.count_sessions} session(s),"
+                  f" {scope.count_commits} commit(s)")
+
+
+@contextlib.contextmanager
+def scope(name):
+    """ Context manager for scope_begin() and scope_end(). """
+    scope_begin(name)
+    try:
+        yield
+    finally:
+        scope_end()
+
+
+def session():
+    """ :returns: the session of the current scope, or a new session if this
+                  thread is not in a scope (see scope_begin()) """
+    global count_sessions
+
+    scope = getattr(scope_local, "scope", None)
+    if scope and scope.session:
+        return scope.session
+
+    ret = session_factory()
+    with counters_lock:
+        count_sessions += 1
+    if scope:
+        scope.session = ret
+        scope.count_sessions += 1
+    return ret
+
+
+def count_commit(session):
+    global count_commits
+
+    with counters_lock:
+        count_commits += 1
+    scope = getattr(scope_local, "scope", None)
+    if scope and scope.session is session:
+        scope.count_commits += 1
+
+
+@contextlib.contextmanager
+def unit_of_work():
+    """ Run the changes in the block with the session of the current scope,
+        and commit them at the end. Roll them back if an exception gets
+        raised. Nothing in the block may commit the session, so
+        bpo.ui.log() refuses to run inside of it.
+
+        with bpo.db.unit_of_work() as session:
+            package.status = bpo.db.PackageStatus.queued
+            session.add(bpo.db.Log("reset", pkgname=package.pkgname))
+    """
+    ret = session()
+    scope_local.units_of_work = getattr(scope_local, "units_of_work", 0) + 1
+    try:
+        yield ret
+        ret.commit()
+    except Exception:
+        ret.rollback()
+        raise
+    finally:
+        scope_local.units_of_work -= 1
+
+
+def in_unit_of_work():
+    """ :returns: True if this thread is inside of unit_of_work() """
+    return getattr(scope_local, "units_of_work", 0) > 0
+
 
 def validate_job_id(db_result, job_id):
     """ :param db_result: either None or a db object with job_id param
@@ -372,103 +654,142 @@ def get_repo_bootstrap(session, arch, branch, dir_name="/", job_id=None):
     return result[0] if len(result) else None
 
 
+# Lightweight rows for the read side of the UI (get_recent_*(),
+# bpo.ui.log_entries_by_day()). They get loaded with Core selects instead of
+# building ORM objects, which would be tracked by the session and could
+# trigger lazy loads (e.g. Package.depends in Package.__repr__).
+PackageRow = collections.namedtuple("PackageRow", [
+    "id", "branch", "arch", "splitrepo", "pkgname", "version", "job_id",
+    "retry_count", "depends_missing"])
+
+ImageRow = collections.namedtuple("ImageRow", [
+    "id", "branch", "device", "ui", "dir_name", "job_id", "retry_count",
+    "date"])
+
+# Without the payload, as it is not displayed
+LogRow = collections.namedtuple("LogRow", [
+    "id", "date", "action", "arch", "branch", "splitrepo", "pkgname",
+    "version", "job_id", "commit", "retry_count", "device", "ui", "dir_name",
+    "depend_pkgname", "count"])
+
+
+def get_depends_missing(session, status):
+    """ :param status: bpo.db.PackageStatus of the packages
+        :returns: {package_id: (pkgname, ...)} with the dependencies of all
+                  packages with status, that are not built or published yet
+    """
+    Depend = sqlalchemy.orm.aliased(Package)
+    assoc = base.metadata.tables["package_dependency"]
+    stmt = sqlalchemy.select(assoc.c.package_id, Depend.pkgname).\
+        join(Package, Package.id == assoc.c.package_id).\
+        join(Depend, Depend.id == assoc.c.dependency_id).\
+        where(Package.status == status).\
+        where(Depend.status.notin_([PackageStatus.built,
+                                    PackageStatus.published])).\
+        order_by(Depend.id)
+
+    ret = {}
+    for package_id, pkgname in session.execute(stmt):
+        ret[package_id] = ret.get(package_id, ()) + (pkgname,)
+    return ret
+
+
 def get_recent_packages_by_status(session):
-    """ :returns: a dict like this (pkglist is a list of bpo.db.Package objects):
+    """ :returns: a dict like this (pkglist is a list of bpo.db.PackageRow):
 
-    {"queued": pkglist1, "building": pkglist2,
-        "built": pkglist3, "published": pkglist4, "failed": pkglist5, "built_synced": {"main_staging_test": {"x86_64": 5, "aarch64": 3}},
+    {"queued": pkglist1, "building": pkglist2, "failed": pkglist3,
+        "built": 8, "published": 11,
+        "built_by_bpo": {"main_staging_test": {"x86_64": 3}},
+        "built_synced": {"main_staging_test": {"x86_64": 5, "aarch64": 3}},
+        "published_by_bpo": {...},  # same format as built_by_bpo
         "published_synced": {...}}  # same format as built_synced
 
+    Built and published packages are only counted (total, per branch/arch
+    built by bpo and per branch/arch synced from the original repository),
+    as these are most packages in the database. Only queued packages have
+    depends_missing filled, the UI does not show them for the others.
     """
     all_branches = bpo.repo.staging.get_branches_with_staging().keys()
+    status_counted = [PackageStatus.built, PackageStatus.published]
 
-    # Add package list for each status
+    # Add package list for each status with few packages
     ret = {}
     for status in bpo.db.PackageStatus:
-        ret[status.name] = session.query(bpo.db.Package).\
-            filter_by(status=status).\
-            filter(bpo.db.Package.branch.in_(all_branches)).\
-            order_by(bpo.db.Package.branch,
-                     bpo.db.Package.arch,
-                     bpo.db.Package.pkgname).all()
-
-    # Add synced counts
-    for status in ["built", "published"]:
-        sync_str = f"{status}_synced"
-        if sync_str in ret:
-            raise RuntimeError(f"{sync_str} must not be in {ret}")
-
-        ret[sync_str] = {}
-        for pkg in ret[status]:
-            if pkg.job_id:
-                continue
-            arch = pkg.arch
-            branch = pkg.branch
-            if branch not in ret[sync_str]:
-                ret[sync_str][branch] = {}
-            if arch in ret[sync_str][branch]:
-                ret[sync_str][branch][arch] += 1
-            else:
-                ret[sync_str][branch][arch] = 1
+        if status in status_counted:
+            continue
+        depends_missing = {}
+        if status == PackageStatus.queued:
+            depends_missing = get_depends_missing(session, status)
+
+        stmt = sqlalchemy.select(Package.id, Package.branch, Package.arch,
+                                 Package.splitrepo, Package.pkgname,
+                                 Package.version, Package.job_id,
+                                 Package.retry_count).\
+            where(Package.status == status).\
+            where(Package.branch.in_(all_branches)).\
+            order_by(Package.branch, Package.arch, Package.pkgname)
+        ret[status.name] = [PackageRow(*row, depends_missing.get(row.id, ()))
+                            for row in session.execute(stmt)]
+
+    # Add counts for the other statuses
+    for status in status_counted:
+        ret[status.name] = 0
+        ret[f"{status.name}_by_bpo"] = {}
+        ret[f"{status.name}_synced"] = {}
+
+    synced = Package.job_id.is_(None)
+    stmt = sqlalchemy.select(Package.status, Package.branch, Package.arch,
+                             synced, sqlalchemy.func.count(Package.id)).\
+        where(Package.status.in_(status_counted)).\
+        where(Package.branch.in_(all_branches)).\
+        group_by(Package.status, Package.branch, Package.arch, synced).\
+        order_by(Package.status, Package.branch, Package.arch)
+    for status, branch, arch, is_synced, count in session.execute(stmt):
+        ret[status.name] += count
+        key = f"{status.name}_synced" if is_synced else f"{status.name}_by_bpo"
+        ret[key].setdefault(branch, {})[arch] = count
 
     # For repo_bootstrap. before it is in built state, bpo can't display which
     # packages are part of the repo_bootstrap. Add a fake package for it to the
     # UI.
-    rb_all = session.query(RepoBootstrap).\
-             filter(RepoBootstrap.status != RepoBootstrapStatus.published).\
-             filter(RepoBootstrap.status != RepoBootstrapStatus.built).\
-             filter(RepoBootstrap.branch.in_(all_branches)).\
-             order_by(RepoBootstrap.branch,
-                      RepoBootstrap.arch)
-    for rb in rb_all:
-        status = rb.status.name
-        if status not in ret:
-            ret[status] = []
-        fake_pkg = Package(rb.arch, rb.branch, "[repo_bootstrap]", "")
-        fake_pkg.retry_count = rb.retry_count
-        fake_pkg.job_id = rb.job_id
-        fake_pkg.splitrepo = rb.dir_name
-        ret[status] += [fake_pkg]
+    stmt = sqlalchemy.select(RepoBootstrap.status, RepoBootstrap.branch,
+                             RepoBootstrap.arch, RepoBootstrap.dir_name,
+                             RepoBootstrap.job_id,
+                             RepoBootstrap.retry_count).\
+        where(RepoBootstrap.status != RepoBootstrapStatus.published).\
+        where(RepoBootstrap.status != RepoBootstrapStatus.built).\
+        where(RepoBootstrap.branch.in_(all_branches)).\
+        order_by(RepoBootstrap.branch, RepoBootstrap.arch)
+    for status, branch, arch, dir_name, job_id, retry_count \
+            in session.execute(stmt):
+        ret.setdefault(status.name, [])
+        ret[status.name] += [PackageRow(None, branch, arch, dir_name,
+                                        "[repo_bootstrap]", "", job_id,
+                                        retry_count, ())]
 
     return ret
 
 
 def get_recent_images_by_status(session):
-    """ :returns: {"failed": imglist1, "building": imglist2, ...}, imglist is a list of bpo.db.Image objects
+    """ :returns: {"failed": imglist1, "building": imglist2, ...}, imglist is a list of bpo.db.ImageRow
 
     """
-    ret = {}
+    ret = {status.name: [] for status in bpo.db.ImageStatus}
 
     # Don't list images older than 10 weeks
     date_min = datetime.datetime.now() - datetime.timedelta(weeks=10)
 
-    for status in bpo.db.ImageStatus:
-        ret[status.name] = session.query(bpo.db.Image).\
-            filter_by(status=status).\
-            filter(bpo.db.Image.date >= date_min).\
-            filter(bpo.db.Image.branch.in_(bpo.config.const.branches.keys())).\
-            order_by(bpo.db.Image.date.desc())
+    stmt = sqlalchemy.select(Image.status, Image.id, Image.branch,
+                             Image.device, Image.ui, Image.dir_name,
+                             Image.job_id, Image.retry_count, Image.date).\
+        where(Image.date >= date_min).\
+        where(Image.branch.in_(bpo.config.const.branches.keys())).\
+        order_by(Image.date.desc())
+    for status, *row in session.execute(stmt):
+        ret[status.name] += [ImageRow(*row)]
     return ret
 
 
-def get_failed_packages_count_relevant(session):
-    """ :returns: count of failed packages, without the branches where ignore_errors is set
-
-    (it's always set for staging branches,
-    and usually for branches we build for the first time as we prepare a new release).
-
-
-    """
-    relevant = []
-    for branch, branch_data in bpo.config.const.branches.items():
-        if not branch_data.get("ignore_errors"):
-            relevant += [branch]
-
-    return session.query(bpo.db.Package).\
-        filter_by(status=bpo.db.PackageStatus.failed).\
-        filter(bpo.db.Package.branch.in_(relevant)).count()
-
-
 def set_package_status(session, package, status, job_id=None):
     """ :param package: bpo.db.Package object
         :param status: bpo.db.PackageStatus value
@@ -481,6 +802,76 @@ def set_package_status(session, package, status, job_id=None):
     session.commit()
 
 
+class TransitionBatch:
+    """ Collect package status changes, package deletions and log entries, to
+        apply them in one transaction with commit(). Use this instead of
+        set_package_status() and bpo.ui.log_package() when changing many
+        packages at once, and bpo.ui.commit_batch() to update the html output
+        only once afterwards.
+
+        The packages must belong to the session of the batch. """
+
+    def __init__(self, session):
+        self.session = session
+        self.logs = []
+
+    def __len__(self):
+        return len(self.logs)
+
+    def log(self, action, **kwargs):
+        """ Add a log entry, see Log.__init__() for the parameters. """
+        self.logs.append(Log(action, **kwargs))
+
+    def log_package(self, package, action, depend_pkgname=None, commit=None):
+        """ Add a log entry for a package, like bpo.ui.log_package(). """
+        self.log(action,
+                 arch=package.arch,
+                 branch=package.branch,
+                 splitrepo=package.splitrepo,
+                 pkgname=package.pkgname,
+                 version=package.version,
+                 job_id=package.job_id,
+                 retry_count=package.retry_count,
+                 depend_pkgname=depend_pkgname,
+                 commit=commit)
+
+    def set_status(self, package, status, action, job_id=None,
+                   retry_count=None, depend_pkgname=None, commit=None):
+        """ Change the status of a package and add a log entry for it.
+
+            :param package: bpo.db.Package object
+            :param status: bpo.db.PackageStatus value
+            :param action: for the log entry
+            :param retry_count: set the retry_count of the package as well """
+        package.status = status
+        if job_id:
+            package.job_id = job_id
+        if retry_count is not None:
+            package.retry_count = retry_count
+        self.session.merge(package)
+        self.log_package(package, action, depend_pkgname, commit)
+
+    def delete(self, package, action):
+        """ Delete a package and add a log entry for it. """
+        self.log_package(package, action)
+        self.session.delete(package)
+
+    def commit(self):
+        """ Write the log entries with one statement and commit everything.
+
+            :returns: amount of log entries that were written """
+        ret = len(self.logs)
+        if self.logs:
+            columns = [column.name for column in Log.__table__.columns
+                       if column.name not in ["id", "date"]]
+            rows = [{column: getattr(log, column) for column in columns}
+                    for log in self.logs]
+            self.session.execute(Log.__table__.insert(), rows)
+        self.session.commit()
+        self.logs = []
+        return ret
+
+
 def set_image_status(session, image, status, job_id=None, dir_name=None,
                      date=None):
     """ :param image: bpo.db.Image object
@@ -518,3 +909,145 @@ def package_has_version(session, pkgname, arch, branch, splitrepo, version):
                                                     pkgname=pkgname,
                                                     version=version).count()
     return True if count else False
+
+
+def get_package_versions(session, arch, branch, splitrepo):
+    """ :returns: {pkgname: version, ...} of all packages of one repo """
+    stmt = sqlalchemy.select(Package.pkgname, Package.version).\
+        where(Package.arch == arch).\
+        where(Package.branch == branch).\
+        where(Package.splitrepo == splitrepo)
+    return {row.pkgname: row.version for row in session.execute(stmt)}
+
+
+def utcnow():
+    """ :returns: current UTC time without timezone, as it gets stored in the
+                  BuildAttempt table """
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def encode_payload(payload):
+    """ Serialize a log payload as compact json. Large payloads get compressed
+        and stored with payload_prefix_zlib, so they still fit into a Text
+        column. Use Log.get_payload() to read them. """
+    if not payload:
+        return None
+    ret = json.dumps(payload, separators=(",", ":"))
+    if len(ret) < bpo.config.const.log_payload_compress_min:
+        return ret
+    compressed = base64.b64encode(zlib.compress(ret.encode("utf-8")))
+    return payload_prefix_zlib + compressed.decode("ascii")
+
+
+def decode_payload(payload):
+    """ Reverse encode_payload(). Also works for payloads that were stored
+        with indent=4 by older versions of bpo. """
+    if payload is None:
+        return None
+    if payload.startswith(payload_prefix_zlib):
+        compressed = base64.b64decode(payload[len(payload_prefix_zlib):])
+        payload = zlib.decompress(compressed).decode("utf-8")
+    return json.loads(payload)
+
+
+def get_log_hot_window_start():
+    """ :returns: date (UTC, without timezone) of the oldest log entries that
+                  are kept in the log table, see bpo.db.archive """
+    days = bpo.config.const.log_retention_days
+    return utcnow() - datetime.timedelta(days=days)
+
+
+def build_attempt_start(session, job_name, job_id, arch=None, branch=None,
+                        splitrepo=None, pkgname=None, version=None,
+                        device=None, ui=None, dir_name=None):
+    """ Record that a job has been started. Previous attempts for the same
+        package/image/... that are still running get marked as failed, as a
+        new job only gets started after the previous one did not succeed.
+
+        :returns: the new bpo.db.BuildAttempt """
+    key = {"job_name": job_name, "arch": arch, "branch": branch,
+           "splitrepo": splitrepo, "pkgname": pkgname, "version": version,
+           "device": device, "ui": ui, "dir_name": dir_name}
+    previous = session.query(BuildAttempt).filter_by(**key)\
+        .order_by(BuildAttempt.id.desc())\
+        .limit(bpo.config.const.retry_count_max + 1).all()
+
+    retry_count = 0
+    for attempt in previous:
+        if attempt.outcome == BuildAttemptOutcome.success:
+            break
+        if attempt.outcome == BuildAttemptOutcome.running:
+            attempt.outcome = BuildAttemptOutcome.failed
+            attempt.finished = utcnow()
+        retry_count += 1
+
+    ret = BuildAttempt(job_name, job_id, retry_count=retry_count, **{
+        k: v for k, v in key.items() if k != "job_name"})
+    session.add(ret)
+    session.commit()
+    return ret
+
+
+def build_attempt_finish(session, job_name, outcome, job_id=None, size=None,
+                         arch=None, branch=None, splitrepo=None):
+    """ Record that a job has finished. If it was successful, update the
+        duration statistics. Attempts that are not running anymore are
+        ignored, so it is fine to call this for the same job from both the
+        job callback and bpo.helpers.job.update_status().
+
+        :param outcome: bpo.db.BuildAttemptOutcome value
+        :param job_id: of the job, or None to use the latest attempt for
+                       job_name, arch, branch and splitrepo (sign_index)
+        :param size: bytes of artifacts the job uploaded
+        :returns: the bpo.db.BuildAttempt, or None if no running attempt was
+                  found """
+    query = session.query(BuildAttempt).filter_by(
+        job_name=job_name, outcome=BuildAttemptOutcome.running)
+    if job_id is not None:
+        query = query.filter_by(job_id=job_id)
+    else:
+        query = query.filter_by(arch=arch, branch=branch, splitrepo=splitrepo)
+    attempt = query.order_by(BuildAttempt.id.desc()).first()
+    if not attempt:
+        logging.debug(f"build_attempt_finish: no running {job_name} attempt"
+                      f" found (job_id={job_id})")
+        return None
+
+    attempt.finished = utcnow()
+    attempt.duration = int((attempt.finished -
+                            attempt.started).total_seconds())
+    attempt.outcome = outcome
+    attempt.size = size
+
+    if outcome == BuildAttemptOutcome.success:
+        name = attempt.stats_name()
+        stats = session.query(BuildStats).filter_by(job_name=job_name,
+                                                    arch=attempt.arch,
+                                                    name=name).first()
+        if not stats:
+            stats = BuildStats(job_name, attempt.arch, name)
+            session.add(stats)
+
+        # Exponential moving average, so a package that got faster or slower
+        # to build takes effect after a few builds
+        if stats.count:
+            factor = bpo.config.const.build_stats_factor
+            stats.duration_avg = int(round(
+                factor * attempt.duration +
+                (1 - factor) * stats.duration_avg))
+        else:
+            stats.duration_avg = attempt.duration
+        stats.count += 1
+        stats.duration_last = attempt.duration
+        stats.size_last = size
+
+    session.commit()
+    return attempt
+
+
+def get_build_durations(session, job_name, arch):
+    """ :returns: dict of name: average duration in seconds, from the
+                  BuildStats table """
+    result = session.query(BuildStats.name, BuildStats.duration_avg)\
+        .filter_by(job_name=job_name, arch=arch)
+    return {name: duration for name, duration in result}
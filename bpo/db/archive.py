@@ -0,0 +1,113 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Keep the log table small: entries that are older than
+    log_retention_days, or that are beyond the newest log_retention_max
+    entries, get moved to one gzip compressed json-lines file per month in
+    --log-archive-path (e.g. log-2026-01.jsonl.gz). Everything that reads the
+    log table at runtime (the web UI, job_check_rate_limit()) only looks at
+    the entries that are still in there.
+
+    Read the archive with:
+    $ zcat _log_archive/log-2026-01.jsonl.gz | jq . """
+
+import datetime
+import gzip
+import json
+import logging
+import os
+
+import bpo.config.args
+import bpo.config.const
+import bpo.db
+
+# Amount of log entries that get moved per transaction
+batch_size = 1000
+
+
+def get_path(date):
+    """ :param date: datetime of a log entry
+        :returns: path to the archive file for the month of date """
+    return os.path.join(bpo.config.args.log_archive_path,
+                        f"log-{date.strftime('%Y-%m')}.jsonl.gz")
+
+
+def get_cutoff_id(session):
+    """ :returns: highest log id that should be archived, or None """
+    Log = bpo.db.Log
+    ret = session.query(Log.id)\
+        .filter(Log.date < bpo.db.get_log_hot_window_start())\
+        .order_by(Log.id.desc()).limit(1).scalar()
+
+    beyond_max = session.query(Log.id).order_by(Log.id.desc())\
+        .offset(bpo.config.const.log_retention_max).limit(1).scalar()
+
+    if ret is None or (beyond_max is not None and beyond_max > ret):
+        return beyond_max
+    return ret
+
+
+def to_dict(entry):
+    """ :param entry: bpo.db.Log object
+        :returns: dict with all columns of entry, the payload decoded """
+    ret = {}
+    for column in bpo.db.Log.__table__.columns:
+        value = getattr(entry, column.name)
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        ret[column.name] = value
+    ret["payload"] = entry.get_payload()
+    return ret
+
+
+def write(entries):
+    """ Append log entries to the archive files of their months. """
+    by_path = {}
+    for entry in entries:
+        by_path.setdefault(get_path(entry.date), []).append(entry)
+
+    os.makedirs(bpo.config.args.log_archive_path, exist_ok=True)
+    for path, entries_month in by_path.items():
+        # Appending creates a new gzip member, gzip/zcat read them as one
+        with gzip.open(path, "at", encoding="utf-8") as handle:
+            for entry in entries_month:
+                handle.write(json.dumps(to_dict(entry),
+                                        separators=(",", ":")) + "\n")
+
+
+def run():
+    """ Move old log entries from the database to the archive files.
+
+        :returns: amount of archived log entries """
+    session = bpo.db.session()
+    cutoff_id = get_cutoff_id(session)
+    if cutoff_id is None:
+        return 0
+
+    ret = 0
+    Log = bpo.db.Log
+    while True:
+        entries = session.query(Log).filter(Log.id <= cutoff_id)\
+            .order_by(Log.id).limit(batch_size).all()
+        if not entries:
+            break
+
+        # Write the files before deleting from the db, so an interrupted run
+        # can only lead to duplicates in the archive and never to lost entries
+        write(entries)
+        session.query(Log).filter(Log.id <= entries[-1].id)\
+            .delete(synchronize_session=False)
+        session.commit()
+        ret += len(entries)
+
+    logging.info(f"Archived {ret} log entries to"
+                 f" {bpo.config.args.log_archive_path}")
+    return ret
+
+
+def read(path):
+    """ :returns: list of the log entries (as dicts) in an archive file """
+    ret = []
+    with gzip.open(path, "rt", encoding="utf-8") as handle:
+        for line in handle:
+            ret.append(json.loads(line))
+    return ret
@@ -7,103 +7,155 @@
     changed. This means we can only migrate forward, but that's fine for our
     use case. Whenever a new database file is created, it starts with the
     layout 0 defined in bpo/db/__init__.py and then applies all upgrades from
-    here. """
+    here.
+
+    The upgrades only use the helper functions below and no raw SQL, so they
+    work with any database that sqlalchemy supports (see --db-url). The
+    version is stored in the schema_version table. """
 
 import logging
+
+import sqlalchemy
+from sqlalchemy import Column, Integer, String
+
 import bpo.db
 
 
-def version_get():
-    result = bpo.db.engine.execute("PRAGMA user_version")
-    version = [row[0] for row in result][0]
-    return version
+def version_get(conn):
+    """ :returns: layout version of the database """
+    ret = conn.execute(sqlalchemy.select(bpo.db.SchemaVersion.version))\
+        .scalar()
+    if ret is not None:
+        return ret
+
+    # SQLite databases from before the schema_version table existed
+    if conn.dialect.name == "sqlite":
+        return conn.exec_driver_sql("PRAGMA user_version").scalar()
+    return 0
 
 
-def version_set(version):
-    bpo.db.engine.execute("PRAGMA user_version=" + str(version))
+def version_set(conn, version):
+    table = bpo.db.SchemaVersion.__table__
+    if not conn.execute(table.update().values(version=version)).rowcount:
+        conn.execute(table.insert().values(version=version))
     logging.info("Database layout upgraded to v" + str(version))
 
 
+def add_column(conn, table, column):
+    """ :param table: table name, e.g. "log"
+        :param column: sqlalchemy.Column of the new column """
+    sqlalchemy.Table(table, sqlalchemy.MetaData(), column)
+    spec = sqlalchemy.schema.CreateColumn(column).compile(dialect=conn.dialect)
+    table = conn.dialect.identifier_preparer.quote(table)
+    conn.execute(sqlalchemy.text(f"ALTER TABLE {table} ADD COLUMN {spec}"))
+
+
+def get_index(table, name, columns, unique=False):
+    """ :param table: table name, e.g. "package"
+        :param columns: list of column names
+        :returns: sqlalchemy.Index """
+    table = sqlalchemy.Table(table, sqlalchemy.MetaData(),
+                             *[Column(column) for column in columns])
+    return sqlalchemy.Index(name, *[table.c[column] for column in columns],
+                            unique=unique)
+
+
+def create_index(conn, table, name, columns, unique=False):
+    get_index(table, name, columns, unique).create(conn)
+
+
+def drop_index(conn, table, name, columns):
+    """ :param columns: columns of the index (MySQL needs the table name to
+                        drop an index, sqlalchemy gets it from the columns) """
+    get_index(table, name, columns).drop(conn)
+
+
 def upgrade():
-    engine = bpo.db.engine
+    with bpo.db.engine.begin() as conn:
+        upgrade_conn(conn)
+
 
+def upgrade_conn(conn):
     # Package: add index "arch-branch"
-    if version_get() == 0:
-        engine.execute("CREATE INDEX 'arch-branch'"
-                       "ON 'package' (`arch`, `branch`)")
-        version_set(1)
+    if version_get(conn) == 0:
+        create_index(conn, "package", "arch-branch", ["arch", "branch"])
+        version_set(conn, 1)
 
     # Log: add column "commit"
-    if version_get() == 1:
-        engine.execute("ALTER TABLE 'log' ADD COLUMN 'commit' VARCHAR")
-        version_set(2)
+    if version_get(conn) == 1:
+        add_column(conn, "log", Column("commit", String))
+        version_set(conn, 2)
 
     # Package: add index "status"
-    if version_get() == 2:
-        engine.execute("CREATE INDEX 'status'"
-                       "ON 'package' (`status`)")
-        version_set(3)
+    if version_get(conn) == 2:
+        create_index(conn, "package", "status", ["status"])
+        version_set(conn, 3)
 
     # Package: add column "retry_count"
-    if version_get() == 3:
-        engine.execute("ALTER TABLE 'package'"
-                       " ADD COLUMN 'retry_count'"
-                       " INT DEFAULT(0)")
-        version_set(4)
+    if version_get(conn) == 3:
+        add_column(conn, "package", Column("retry_count", Integer,
+                                           server_default=sqlalchemy.text("0")))
+        version_set(conn, 4)
 
     # Log: add column "retry_count"
-    if version_get() == 4:
-        engine.execute("ALTER TABLE 'log'"
-                       " ADD COLUMN 'retry_count'"
-                       " INT DEFAULT(0)")
-        version_set(5)
+    if version_get(conn) == 4:
+        add_column(conn, "log", Column("retry_count", Integer,
+                                       server_default=sqlalchemy.text("0")))
+        version_set(conn, 5)
 
     # Log: add columns "device", "ui", "dir_name"
-    if version_get() == 5:
-        engine.execute("ALTER TABLE 'log'"
-                       " ADD COLUMN 'device'"
-                       " VARCHAR")
-        engine.execute("ALTER TABLE 'log'"
-                       " ADD COLUMN 'ui'"
-                       " VARCHAR")
-        engine.execute("ALTER TABLE 'log'"
-                       " ADD COLUMN 'dir_name'"
-                       " VARCHAR")
-        version_set(6)
+    if version_get(conn) == 5:
+        add_column(conn, "log", Column("device", String))
+        add_column(conn, "log", Column("ui", String))
+        add_column(conn, "log", Column("dir_name", String))
+        version_set(conn, 6)
 
     # Log: add column "depend_pkgname"
-    if version_get() == 6:
-        engine.execute("ALTER TABLE 'log'"
-                       " ADD COLUMN 'depend_pkgname'"
-                       " VARCHAR")
-        version_set(7)
+    if version_get(conn) == 6:
+        add_column(conn, "log", Column("depend_pkgname", String))
+        version_set(conn, 7)
 
     # Log: add column "count"
-    if version_get() == 7:
-        engine.execute("ALTER TABLE 'log'"
-                       " ADD COLUMN 'count'"
-                       " INT DEFAULT(0)")
-        version_set(8)
+    if version_get(conn) == 7:
+        add_column(conn, "log", Column("count", Integer,
+                                       server_default=sqlalchemy.text("0")))
+        version_set(conn, 8)
 
     # Package: add column "splitrepo"
-    if version_get() == 8:
-        engine.execute("ALTER TABLE 'package'"
-                       " ADD COLUMN 'splitrepo'"
-                       " VARCHAR")
-        version_set(9)
+    if version_get(conn) == 8:
+        add_column(conn, "package", Column("splitrepo", String))
+        version_set(conn, 9)
 
     # Package: update indexes for splitrepo
-    if version_get() == 9:
-        engine.execute("DROP INDEX 'pkgname-arch-branch'")
-        engine.execute("CREATE INDEX 'pkgname-arch-branch-splitrepo'"
-                       " ON 'package' (`pkgname`, `arch`, `branch`, `splitrepo`)")
-        engine.execute("CREATE INDEX 'arch-branch-splitrepo'"
-                       " ON 'package' (`arch`, `branch`, `splitrepo`)")
-        version_set(10)
+    if version_get(conn) == 9:
+        drop_index(conn, "package", "pkgname-arch-branch",
+                   ["pkgname", "arch", "branch"])
+        create_index(conn, "package", "pkgname-arch-branch-splitrepo",
+                     ["pkgname", "arch", "branch", "splitrepo"])
+        create_index(conn, "package", "arch-branch-splitrepo",
+                     ["arch", "branch", "splitrepo"])
+        version_set(conn, 10)
 
     # Log: add column "splitrepo"
-    if version_get() == 10:
-        engine.execute("ALTER TABLE 'log'"
-                       " ADD COLUMN 'splitrepo'"
-                       " VARCHAR")
-        version_set(11)
+    if version_get(conn) == 10:
+        add_column(conn, "log", Column("splitrepo", String))
+        version_set(conn, 11)
+
+    # Package: replace the indexes for looking up packages with one unique
+    # index, that also covers the arch/branch(/splitrepo) queries. Add index
+    # for the status queries. (The unique constraint doesn't apply to
+    # packages without splitrepo, as NULL values are distinct in SQLite.)
+    # Log: add index for the date
+    if version_get(conn) == 11:
+        drop_index(conn, "package", "pkgname-arch-branch-splitrepo",
+                   ["pkgname", "arch", "branch", "splitrepo"])
+        drop_index(conn, "package", "arch-branch-splitrepo",
+                   ["arch", "branch", "splitrepo"])
+        drop_index(conn, "package", "arch-branch", ["arch", "branch"])
+        drop_index(conn, "package", "status", ["status"])
+        create_index(conn, "package", "branch-arch-splitrepo-pkgname",
+                     ["branch", "arch", "splitrepo", "pkgname"], unique=True)
+        create_index(conn, "package", "status-branch-arch",
+                     ["status", "branch", "arch"])
+        create_index(conn, "log", "log:date", ["date"])
+        version_set(conn, 12)
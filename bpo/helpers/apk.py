@@ -2,20 +2,196 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
 import collections
+import hashlib
+import io
 import os
-import tarfile
+import re
+import zlib
+
+# Amount of compressed bytes read from the apk at once
+read_size = 16384
+
+
+def iter_gzip_streams(handle, streams_max):
+    """ Decompress concatenated gzip streams.
+
+        :param handle: file opened in binary mode
+        :param streams_max: stop after this many gzip streams
+        :returns: generator of (stream, compressed, decompressed, end) tuples,
+                  with the number of the gzip stream (starting at 0), a chunk
+                  of its compressed data, the decompressed data of that chunk
+                  and True if it was the last chunk of the stream """
+    stream = 0
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    while True:
+        chunk = handle.read(read_size)
+        if not chunk:
+            return
+        while chunk:
+            data = decompressor.decompress(chunk)
+            if not decompressor.eof:
+                yield stream, chunk, data, False
+                break
+            unused = decompressor.unused_data
+            yield stream, chunk[:len(chunk) - len(unused)], data, True
+            if stream + 1 == streams_max:
+                return
+            stream += 1
+            chunk = unused
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+
+def parse_pax_path(content):
+    """ :param content: data of a pax extended header member
+        :returns: value of the path record, or None """
+    while content:
+        length, rest = content.split(b" ", 1)
+        record = rest[:int(length) - len(length) - 2]
+        content = content[int(length):]
+        if record.startswith(b"path="):
+            return record[len(b"path="):]
+    return None
+
+
+def iter_tar_members(read, path):
+    """ Parse a tar archive, without the overhead of tarfile.
+
+        :param read: function that returns the next size bytes of the tar
+                     archive (fewer at the end of the data)
+        :param path: file the tar archive is read from, for error messages
+        :returns: generator of (name, content) tuples of the members as bytes,
+                  with GNU and pax long names applied """
+    name_next = None
+    while True:
+        header = read(512)
+        if len(header) < 512:
+            return
+        if header == bytes(512):
+            continue
+        try:
+            size = int(header[124:136].strip(b" \0") or b"0", 8)
+        except ValueError:
+            raise RuntimeError("This file is not a valid tar archive: " +
+                               path)
+        content = read(size)
+        read(-size % 512)
+
+        typeflag = header[156:157]
+        if typeflag == b"L":  # GNU long name of the next member
+            name_next = content.rstrip(b"\0")
+            continue
+        if typeflag == b"x":  # pax extended header of the next member
+            name_next = parse_pax_path(content)
+            continue
+
+        name = header[0:100].split(b"\0", 1)[0]
+        prefix = header[345:500].split(b"\0", 1)[0]
+        if header[257:262] == b"ustar" and prefix:
+            name = prefix + b"/" + name
+        if name_next:
+            name = name_next
+            name_next = None
+
+        yield name, content
+
+
+def read_pkginfo(apk):
+    """ Read .PKGINFO from an apk without decompressing the whole file.
+
+        An apk (v2) consists of three concatenated gzip streams, that form
+        one tar archive when decompressed: the signature (missing in unsigned
+        apks), the control segment starting with .PKGINFO and the data. This
+        only decompresses until .PKGINFO has been read, and never more than
+        the first two streams, so the data segment of big packages (kernels,
+        firmware) does not get decompressed.
+
+        :param apk: path to the apk file
+        :returns: content of .PKGINFO as bytes """
+    with open(apk, "rb") as handle:
+        if handle.read(2) != b"\x1f\x8b":
+            raise RuntimeError("This apk is not a valid tar archive: " + apk)
+        handle.seek(0)
+
+        data = iter_gzip_streams(handle, 2)
+        buf = bytearray()
+
+        def read(size):
+            while len(buf) < size:
+                try:
+                    item = next(data, None)
+                except zlib.error:
+                    raise RuntimeError("This apk is not a valid gzip"
+                                       " file: " + apk)
+                if item is None:
+                    raise RuntimeError("No .PKGINFO found in the control"
+                                       " segment of apk: " + apk)
+                buf.extend(item[2])
+            ret = bytes(buf[:size])
+            del buf[:size]
+            return ret
+
+        for name, content in iter_tar_members(read, apk):
+            if name in [b".PKGINFO", b"./.PKGINFO"]:
+                return content
+
+
+def read_control(apk):
+    """ Read .PKGINFO and the checksum of an apk, as needed for its APKINDEX
+        entry (see bpo.repo.apkindex). Like read_pkginfo(), this does not
+        decompress the data segment.
+
+        The checksum is the sha1 of the compressed control segment. Like
+        apk-tools does it, the data segment is included if .PKGINFO has no
+        datahash (apks that were not built by abuild).
+
+        :param apk: path to the apk file
+        :returns: (content of .PKGINFO as bytes, checksum as bytes) """
+    with open(apk, "rb") as handle:
+        if handle.read(2) != b"\x1f\x8b":
+            raise RuntimeError("This apk is not a valid tar archive: " + apk)
+        handle.seek(0)
+
+        offset = 0
+        size = 0
+        sha1 = hashlib.sha1()
+        data = bytearray()
+        try:
+            for _, compressed, chunk, end in iter_gzip_streams(handle, 2):
+                size += len(compressed)
+                sha1.update(compressed)
+                data.extend(chunk)
+                if not end:
+                    continue
+
+                for name, content in iter_tar_members(io.BytesIO(data).read,
+                                                      apk):
+                    if name not in [b".PKGINFO", b"./.PKGINFO"]:
+                        continue
+                    if not re.search(b"^datahash = ", content, re.MULTILINE):
+                        handle.seek(offset)
+                        sha1 = hashlib.sha1()
+                        for block in iter(lambda: handle.read(read_size),
+                                          b""):
+                            sha1.update(block)
+                    return content, sha1.digest()
+
+                # Signature segment, continue with the next one
+                offset += size
+                size = 0
+                sha1 = hashlib.sha1()
+                data = bytearray()
+        except zlib.error:
+            raise RuntimeError("This apk is not a valid gzip file: " + apk)
+
+    raise RuntimeError("No .PKGINFO found in the control segment of apk: " +
+                       apk)
 
 
 def get_pkginfo_lines(apk):
     if not os.path.exists(apk):
         raise RuntimeError("File does not exist: " + apk)
 
-    if not tarfile.is_tarfile(apk):
-        raise RuntimeError("This apk is not a valid tar archive: " + apk)
-
-    with tarfile.open(apk, "r:gz") as tar:
-        with tar.extractfile(".PKGINFO") as handle:
-            return handle.readlines()
+    return read_pkginfo(apk).splitlines(keepends=True)
 
 
 def get_abuild_version(lines):
@@ -0,0 +1,166 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Persistent cache for bpo.helpers.apk.get_metadata(), so the apks in the
+    WIP and final repos don't need to be decompressed again every time bpo
+    needs their origin and version (creating symlink repos, cleaning WIP
+    repos, syncing staging repos, bpo.repo.status.fix()). The APKINDEX
+    entries from bpo.repo.apkindex.read_entry() are cached the same way.
+
+    Entries are keyed by the path of the apk and become invalid as soon as
+    its inode, size or mtime changes. The cache is stored in a separate
+    sqlite3 file (--apk-cache-path) next to the repositories it describes,
+    not in the bpo database: it only makes sense on the host with the apk
+    files, and it can be deleted at any time. """
+
+import collections
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+
+import bpo.config.args
+import bpo.helpers.apk
+import bpo.repo.apkindex
+
+conn = None
+lock = threading.Lock()
+
+# For the tests and to see how well the cache works in the log
+count_hits = 0
+count_misses = 0
+count_index_hits = 0
+count_index_misses = 0
+
+tables = ["apk_metadata", "apk_index_entry"]
+
+
+def init():
+    global conn
+
+    path = bpo.config.args.apk_cache_path
+    with lock:
+        if conn:
+            conn.close()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        # Losing the latest entries on power loss is fine for a cache
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        for table in tables:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ("
+                         " path TEXT PRIMARY KEY,"
+                         " inode INTEGER,"
+                         " size INTEGER,"
+                         " mtime INTEGER,"
+                         " metadata TEXT)")
+        conn.commit()
+
+
+def get_key(path):
+    """ :returns: (inode, size, mtime) of the file at path """
+    st = os.stat(path)
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def put(path, key, metadata, table="apk_metadata"):
+    """ Store metadata of the apk at path, with key from get_key(). """
+    with lock:
+        conn.execute(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?, ?)",
+                     (path, *key, json.dumps(metadata)))
+        conn.commit()
+
+
+def read(apk, table):
+    """ :returns: the value to cache in table, read from the apk """
+    if table == "apk_index_entry":
+        return bpo.repo.apkindex.read_entry(apk)
+    return bpo.helpers.apk.get_metadata(apk)
+
+
+def get(apk, table):
+    """ :param apk: path to apk file
+        :param table: one of tables
+        :returns: (cached value or the value from reading the apk, True if it
+                   was cached) """
+    if not conn:
+        return read(apk, table), False
+
+    path = os.path.abspath(apk)
+    if not os.path.exists(path):
+        raise RuntimeError("File does not exist: " + apk)
+    key = get_key(path)
+
+    with lock:
+        row = conn.execute(f"SELECT inode, size, mtime, metadata FROM {table}"
+                           " WHERE path = ?", (path,)).fetchone()
+    if row and tuple(row[:3]) == key:
+        return json.loads(row[3],
+                          object_pairs_hook=collections.OrderedDict), True
+
+    value = read(path, table)
+    put(path, key, value, table)
+    return value, False
+
+
+def get_metadata(apk):
+    """ Same as bpo.helpers.apk.get_metadata(), but only read the apk if it
+        is not in the cache or if it changed since it was cached.
+
+        :param apk: path to apk file """
+    global count_hits
+    global count_misses
+
+    ret, cached = get(apk, "apk_metadata")
+    if cached:
+        count_hits += 1
+    else:
+        count_misses += 1
+    return ret
+
+
+def get_index_entry(apk):
+    """ Same as bpo.repo.apkindex.read_entry(), but only read the apk if it is
+        not in the cache or if it changed since it was cached.
+
+        :param apk: path to apk file """
+    global count_index_hits
+    global count_index_misses
+
+    ret, cached = get(apk, "apk_index_entry")
+    if cached:
+        count_index_hits += 1
+    else:
+        count_index_misses += 1
+    return [tuple(field) for field in ret]
+
+
+def copy(src, dst):
+    """ Copy an apk with shutil.copy() and add the copy to the cache, with
+        the metadata of src. """
+    metadata = get_metadata(src)
+    shutil.copy(src, dst)
+    if conn:
+        path = os.path.abspath(dst)
+        put(path, get_key(path), metadata)
+
+
+def prune():
+    """ Remove entries of apks that don't exist anymore.
+
+        :returns: amount of removed entries """
+    ret = 0
+    for table in tables:
+        with lock:
+            paths = [row[0] for row in
+                     conn.execute(f"SELECT path FROM {table}")]
+            missing = [(path,) for path in paths
+                       if not os.path.exists(path)]
+            conn.executemany(f"DELETE FROM {table} WHERE path = ?", missing)
+            conn.commit()
+
+        logging.info(f"APK cache ({table}): {len(paths) - len(missing)}"
+                     f" entries, removed {len(missing)}")
+        ret += len(missing)
+    return ret
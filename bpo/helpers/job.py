@@ -2,7 +2,6 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
 import collections
-import datetime
 import importlib
 import logging
 
@@ -53,22 +52,19 @@ def job_check_rate_limit(action, arch, branch, splitrepo, pkgname, version, devi
     """ Check if there is a bug and we keep running the same job (bpo#141).
         If that is the case, shutdown bpo. """
     session = bpo.db.session()
-    entries = session.query(bpo.db.Log).order_by(bpo.db.Log.id.desc()
-                                                 ).limit(10).all()
+
+    # Only look at today's entries (UTC, like Log.date). This is always
+    # within the hot window of the log table (bpo.db.archive).
+    today = bpo.db.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    entries = session.query(bpo.db.Log)\
+        .filter(bpo.db.Log.date >= today)\
+        .order_by(bpo.db.Log.id.desc()).limit(10).all()
 
     if len(entries) < 10:
-        logging.debug("job_check_rate_limit: less than 10 log entries")
+        logging.debug("job_check_rate_limit: less than 10 log entries today")
         return
 
-    now = datetime.datetime.now(datetime.timezone.utc)
-
     for entry in entries:
-        date = entry.date.date()
-        if date.year != now.year \
-                and date.month != now.month \
-                and date.day != now.day:
-            logging.debug(f"job_check_rate_limit: job_id={entry.job_id} wasn't today")
-            return
         if entry.action != action \
                 or entry.arch != arch \
                 or entry.branch != branch \
@@ -128,9 +124,23 @@ def run(name, note, tasks, branch=None, arch=None, splitrepo=None, pkgname=None,
                ui=ui,
                dir_name=dir_name)
 
+    if name in bpo.db.BuildAttempt.job_names:
+        bpo.db.build_attempt_start(bpo.db.session(), name, job_id, arch,
+                                   branch, splitrepo, pkgname, version, device,
+                                   ui, dir_name)
+
     return job_id
 
 
+def get_outcome(status_new, success):
+    """ :param status_new: new status of a package, image or repo_bootstrap
+        :param success: the status it gets when the job was successful
+        :returns: bpo.db.BuildAttemptOutcome for the build attempt """
+    if status_new == success:
+        return bpo.db.BuildAttemptOutcome.success
+    return bpo.db.BuildAttemptOutcome.failed
+
+
 def get_status_package(package):
     result = get_job_service().get_status(package.job_id)
     status = bpo.job_services.base.JobStatus
@@ -157,6 +167,10 @@ def update_status_package():
         status_new = get_status_package(package)
         if status_new == building:
             continue
+        bpo.db.build_attempt_finish(session, "build_package",
+                                    get_outcome(status_new,
+                                                bpo.db.PackageStatus.built),
+                                    package.job_id)
         bpo.db.set_package_status(session, package, status_new)
         action = "job_update_package_status_" + status_new.name
         bpo.ui.log_package(package, action)
@@ -189,6 +203,10 @@ def update_status_image():
         status_new = get_status_image(image)
         if status_new == building:
             continue
+        bpo.db.build_attempt_finish(session, "build_image",
+                                    get_outcome(status_new,
+                                                bpo.db.ImageStatus.published),
+                                    image.job_id)
         bpo.db.set_image_status(session, image, status_new)
         action = f"job_update_image_status_{status_new.name}"
         bpo.ui.log_image(image, action)
@@ -222,6 +240,10 @@ def update_status_repo_bootstrap():
         status_new = get_status_repo_bootstrap(rb)
         if status_new == building:
             continue
+        bpo.db.build_attempt_finish(session, "repo_bootstrap",
+                                    get_outcome(status_new,
+                                                bpo.db.RepoBootstrapStatus.built),
+                                    rb.job_id)
         bpo.db.set_repo_bootstrap_status(session, rb, status_new)
         action = f"job_update_repo_bootstrap_status_{status_new.name}"
         bpo.ui.log_repo_bootstrap(rb, action)
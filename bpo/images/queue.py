@@ -4,6 +4,7 @@ import threading
 import logging
 
 import bpo.db
+import bpo.db.archive
 import bpo.images.config
 import bpo.repo
 
@@ -84,7 +85,8 @@ def timer_stop():
 
 
 def timer_iterate(next_interval=3600, repo_build=True):
-    """ Run fill() and schedule a timer to do it again.
+    """ Run fill(), archive old log entries and schedule a timer to do it
+        again.
 
         All functions called in this thread need to be thread safe, or else we
         have bugs like #79!
@@ -97,10 +99,12 @@ def timer_iterate(next_interval=3600, repo_build=True):
     global timer
     global timer_cond
 
-    fill()
+    with bpo.db.scope("image timer"):
+        fill()
+        bpo.db.archive.run()
 
-    if repo_build:
-        bpo.repo.build(no_repo_update=True)
+        if repo_build:
+            bpo.repo.build(no_repo_update=True)
 
     if not timer_cond.acquire(False):
         # timer_stop() is running
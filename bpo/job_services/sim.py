@@ -0,0 +1,345 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Simulated job service, for measuring the scheduler without running real
+    pmbootstrap builds (see helpers/bpo_sim.py).
+
+    Jobs don't run anything. They finish after a synthetic (or given)
+    duration on a virtual clock, and then submit the same API callback that
+    helpers/submit.py would send from a real job, with fake apks. The
+    callbacks run through the real code in bpo/api, which runs the real
+    bpo.repo._build() passes through bpo.repo.scheduler.wakeup().
+
+    Simulation.run() replays a get-depends payload this way until no job is
+    running anymore, and returns the makespan (virtual seconds until the last
+    job finished), how well the build slots were used, and how much CPU time
+    and how many SQL statements each scheduling pass needed. The virtual
+    times only depend on the payload, the durations and the seed, so two
+    scheduler versions can be compared with the same input. """
+
+import heapq
+import io
+import json
+import logging
+import random
+import shlex
+import tarfile
+import time
+
+import flask
+import sqlalchemy
+import sqlalchemy.event
+
+import bpo.api
+import bpo.api.job_callback.build_package
+import bpo.api.job_callback.get_depends
+import bpo.api.job_callback.sign_index
+import bpo.api.public.update_job_status
+import bpo.config.const
+import bpo.db
+import bpo.helpers.job
+import bpo.repo
+import bpo.repo.tools
+import bpo.repo.wip
+from bpo.job_services.base import JobService, JobStatus
+
+# Jobs that take up a build slot (see bpo.repo.slots)
+jobs_with_slot = ["build_package", "build_image", "repo_bootstrap"]
+
+# Duration of jobs that don't build packages, in seconds
+duration_other = 60
+
+
+def get_submit_env(tasks):
+    """ :returns: dict of the BPO_* variables that the tasks export for
+                  helpers/submit.py """
+    ret = {}
+    for script in tasks.values():
+        for line in script.split("\n"):
+            line = line.strip()
+            if not line.startswith("export BPO_"):
+                continue
+            key, value = line[len("export "):].split("=", 1)
+            try:
+                ret[key] = "".join(shlex.split(value))
+            except ValueError:
+                ret[key] = value
+    return ret
+
+
+def fake_apk(pkgname, version, arch):
+    """ :returns: bytes of an apk, that only has a .PKGINFO """
+    pkginfo = ("# Generated by abuild 3.14.1-r0\n"
+               f"pkgname = {pkgname}\n"
+               f"pkgver = {version}\n"
+               f"arch = {arch}\n"
+               f"origin = {pkgname}\n").encode()
+    ret = io.BytesIO()
+    with tarfile.open(fileobj=ret, mode="w:gz") as tar:
+        info = tarfile.TarInfo(".PKGINFO")
+        info.size = len(pkginfo)
+        tar.addfile(info, io.BytesIO(pkginfo))
+    return ret.getvalue()
+
+
+def generate_payload(count, seed=0, depends_max=3):
+    """ Generate a get-depends payload with a random dependency graph.
+        :param count: amount of packages
+        :param depends_max: maximum amount of depends per package
+        :returns: list in the format of test/testdata/depends.x86_64.json """
+    rng = random.Random(seed)
+    ret = []
+    for i in range(count):
+        depends = []
+        if i:
+            amount = rng.randint(0, min(i, depends_max))
+            depends = sorted(set(f"sim-{rng.randrange(i):05}"
+                                 for j in range(amount)))
+        ret += [{"pkgname": f"sim-{i:05}",
+                 "repo": None,
+                 "version": "1-r0",
+                 "depends": depends}]
+    return ret
+
+
+class SimJobService(JobService):
+    def __init__(self, durations=None, seed=0, duration_median=300):
+        """ :param durations: dict of pkgname: seconds, to replay durations
+                              of real builds (e.g. from bpo.db.BuildStats).
+                              Other packages get a synthetic duration.
+            :param seed: for the synthetic durations
+            :param duration_median: of the synthetic durations """
+        self.durations = durations or {}
+        self.seed = seed
+        self.duration_median = duration_median
+        self.now = 0
+        self.job_id = 0
+        self.jobs = {}
+        self.running = []  # heap of (finish, job_id)
+
+    def duration(self, name, env):
+        if name != "build_package":
+            return duration_other
+        pkgname = env.get("BPO_PKGNAME")
+        if pkgname in self.durations:
+            return self.durations[pkgname]
+        rng = random.Random(f"{self.seed}:{env.get('BPO_ARCH')}:{pkgname}")
+        return max(10, round(self.duration_median *
+                             rng.lognormvariate(0, 1)))
+
+    def run_job(self, name, note, tasks, branch, splitrepo):
+        self.job_id += 1
+        env = get_submit_env(tasks)
+        finish = self.now + self.duration(name, env)
+        self.jobs[self.job_id] = {"name": name,
+                                  "env": env,
+                                  "start": self.now,
+                                  "finish": finish,
+                                  "status": JobStatus.running}
+        heapq.heappush(self.running, (finish, self.job_id))
+        logging.info(f"[sim] {self.now}s: job {self.job_id} started: {note}"
+                     f" (finishes at {finish}s)")
+        return self.job_id
+
+    def get_status(self, job_id):
+        return self.jobs[job_id]["status"]
+
+    def get_link(self, job_id):
+        return f"sim://{job_id}"
+
+    def count_running_with_slot(self):
+        return len([job_id for finish, job_id in self.running
+                    if self.jobs[job_id]["name"] in jobs_with_slot])
+
+    def next_finish(self):
+        """ :returns: virtual time when the next job finishes, or None """
+        return self.running[0][0] if self.running else None
+
+    def pop_finished(self):
+        """ Advance the clock to the next job that finishes.
+            :returns: (job_id, job) """
+        finish, job_id = heapq.heappop(self.running)
+        self.now = finish
+        job = self.jobs[job_id]
+        job["status"] = JobStatus.success
+        return job_id, job
+
+
+class Simulation:
+    def __init__(self, payloads, branch="main", job_service=None):
+        """ :param payloads: dict of arch: get-depends payload
+            :param job_service: SimJobService (default: synthetic durations)
+        """
+        self.payloads = payloads
+        self.branch = branch
+        self.js = job_service or SimJobService()
+        self.app = flask.Flask(__name__)
+        self.app.register_blueprint(bpo.api.blueprint)
+        self.client = self.app.test_client()
+        self.token = bpo.config.const.test_tokens["job_callback"]
+        self.patched = []
+
+        self.passes = []  # list of (cpu seconds, sql statements)
+        self.in_pass = False
+        self.sql_count = 0
+        self.busy = 0  # slot-seconds with a running job
+        self.idle_waiting = 0  # free slot-seconds while packages were queued
+
+    def patch(self, obj, attr, value):
+        self.patched.append((obj, attr, getattr(obj, attr)))
+        setattr(obj, attr, value)
+
+    def unpatch(self):
+        for obj, attr, value in reversed(self.patched):
+            setattr(obj, attr, value)
+        self.patched = []
+
+    def build_measured(self, *args, **kwargs):
+        """ Wrapper around bpo.repo._build(), that measures each pass. """
+        self.in_pass = True
+        self.sql_count = 0
+        cpu = time.process_time()
+        try:
+            return self.build_orig(*args, **kwargs)
+        finally:
+            self.passes.append((time.process_time() - cpu, self.sql_count))
+            self.in_pass = False
+
+    def count_sql(self, *args, **kwargs):
+        if self.in_pass:
+            self.sql_count += 1
+
+    def index(self, arch, branch, repo_name, cwd, add=None, remove=None):
+        """ Replacement for bpo.repo.tools.index(), the fake apks can't be
+            indexed with apk.static. """
+        with open(f"{cwd}/APKINDEX.tar.gz", "wb") as handle:
+            handle.write(b"")
+
+    def post(self, endpoint, env, files):
+        headers = {"X-BPO-Token": self.token}
+        for key in ["Arch", "Branch", "Job-Id", "Pkgname", "Splitrepo",
+                    "Version"]:
+            env_key = "BPO_" + key.upper().replace("-", "_")
+            if env_key in env:
+                headers["X-BPO-" + key] = env[env_key]
+
+        data = {"file[]": [(io.BytesIO(content), name)
+                           for name, content in files]}
+        ret = self.client.post(f"/api/{endpoint}", headers=headers, data=data)
+        if ret.status_code != 200:
+            raise RuntimeError(f"[sim] {endpoint} failed: {ret.status_code}"
+                               f" {ret.get_data(as_text=True)}")
+
+    def callback(self, job_id, job):
+        """ Send the API callback of a finished job, like helpers/submit.py
+            would do at the end of the job. """
+        env = dict(job["env"], BPO_JOB_ID=str(job_id))
+        endpoint = env.get("BPO_API_ENDPOINT")
+
+        if endpoint == "build-package":
+            apk = fake_apk(env["BPO_PKGNAME"], env["BPO_VERSION"],
+                           env["BPO_ARCH"])
+            name = f"{env['BPO_PKGNAME']}-{env['BPO_VERSION']}.apk"
+            self.post("job-callback/build-package", env, [(name, apk)])
+        elif endpoint == "sign-index":
+            self.post("job-callback/sign-index", env,
+                      [("APKINDEX.tar.gz", b"")])
+        else:
+            # Not simulated (repo_bootstrap, build_image): let bpo find out
+            # that the job failed
+            logging.warning(f"[sim] can't simulate job {job_id}"
+                            f" ({job['name']}), marking it as failed")
+            job["status"] = JobStatus.failed
+            ret = self.client.post("/api/public/update-job-status")
+            if ret.status_code != 200:
+                raise RuntimeError("[sim] update-job-status failed")
+
+    def count_queued(self, session):
+        return session.query(sqlalchemy.func.count(bpo.db.Package.id))\
+            .filter_by(status=bpo.db.PackageStatus.queued).scalar()
+
+    def account(self, session, until):
+        """ Add the time until the next event to the slot statistics. """
+        duration = until - self.js.now
+        running = self.js.count_running_with_slot()
+        self.busy += running * duration
+        if self.count_queued(session):
+            free = bpo.config.const.max_parallel_build_jobs - running
+            self.idle_waiting += max(0, free) * duration
+
+    def get_depends(self):
+        files = [(f"depends.{arch}.json", json.dumps(payload).encode())
+                 for arch, payload in self.payloads.items()]
+        env = {"BPO_BRANCH": self.branch, "BPO_JOB_ID": "0",
+               "BPO_SPLITREPO": ""}
+        self.post("job-callback/get-depends", env, files)
+
+    def run(self):
+        """ :returns: report dict, see format_report() """
+        branch_data = {"arches": list(self.payloads.keys()),
+                       "pmb_branch": "main"}
+        self.build_orig = bpo.repo._build
+        self.patch(bpo.config.const, "branches", {self.branch: branch_data})
+        self.patch(bpo.helpers.job, "jobservice", self.js)
+        self.patch(bpo.repo, "_build", self.build_measured)
+        self.patch(bpo.repo.tools, "index", self.index)
+        self.patch(bpo.repo.wip, "sign", lambda *args: None)
+        sqlalchemy.event.listen(bpo.db.engine, "before_cursor_execute",
+                                self.count_sql)
+        try:
+            self.get_depends()
+            session = bpo.db.session()
+            while self.js.running:
+                self.account(session, self.js.next_finish())
+                session.close()
+                self.callback(*self.js.pop_finished())
+            return self.report(session)
+        finally:
+            sqlalchemy.event.remove(bpo.db.engine, "before_cursor_execute",
+                                    self.count_sql)
+            self.unpatch()
+
+    def report(self, session):
+        makespan = self.js.now
+        slots = bpo.config.const.max_parallel_build_jobs
+        jobs = {}
+        for job in self.js.jobs.values():
+            jobs[job["name"]] = jobs.get(job["name"], 0) + 1
+
+        not_published = session.query(bpo.db.Package)\
+            .filter(bpo.db.Package.status != bpo.db.PackageStatus.published)\
+            .count()
+        cpu = [cpu for cpu, sql in self.passes]
+        sql = [sql for cpu, sql in self.passes]
+        return {"makespan": makespan,
+                "slots": slots,
+                "jobs": jobs,
+                "not_published": not_published,
+                "utilisation": self.busy / (slots * makespan)
+                if makespan else 0,
+                "idle_waiting": self.idle_waiting,
+                "passes": len(self.passes),
+                "pass_cpu_total": sum(cpu),
+                "pass_cpu_max": max(cpu, default=0),
+                "pass_sql_total": sum(sql),
+                "pass_sql_max": max(sql, default=0)}
+
+
+def format_report(report):
+    """ :param report: return value of Simulation.run()
+        :returns: human readable report """
+    passes = report["passes"] or 1
+    jobs = ", ".join(f"{count}x {name}"
+                     for name, count in sorted(report["jobs"].items()))
+    return (f"makespan:            {report['makespan']}s\n"
+            f"jobs:                {jobs}\n"
+            f"not published:       {report['not_published']} packages\n"
+            f"slot utilisation:    {report['utilisation'] * 100:.1f}%"
+            f" of {report['slots']} slots\n"
+            f"idle while queued:   {report['idle_waiting']} slot-seconds\n"
+            f"scheduling passes:   {report['passes']}\n"
+            f"pass CPU time:       {report['pass_cpu_total'] * 1000:.1f}ms"
+            f" total, {report['pass_cpu_total'] * 1000 / passes:.2f}ms avg,"
+            f" {report['pass_cpu_max'] * 1000:.2f}ms max\n"
+            f"pass SQL statements: {report['pass_sql_total']} total,"
+            f" {report['pass_sql_total'] / passes:.1f} avg,"
+            f" {report['pass_sql_max']} max\n")
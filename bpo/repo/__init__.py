@@ -8,15 +8,19 @@ import threading
 
 import bpo.config.const
 import bpo.db
-import bpo.helpers.apk
+import bpo.helpers.apk_cache
 import bpo.jobs.build_image
 import bpo.jobs.build_package
 import bpo.jobs.repo_bootstrap
 import bpo.jobs.sign_index
+import bpo.repo.depgraph
+import bpo.repo.indexer
+import bpo.repo.slots
 import bpo.repo.symlink
 import bpo.repo.tools
 import bpo.repo.staging
 import bpo.repo.wip
+import bpo.ui
 
 
 # Let bpo.repo.build() only run from one thread at once (#79)
@@ -25,37 +29,18 @@ build_cond = threading.Condition()
 
 def next_package_to_build(session, arch, branch, splitrepo):
     """ :returns: pkgname """
-
-    # Get all packages for arch where status = failed and retries left
-    failed = bpo.db.PackageStatus.failed
-    retry_count_max = bpo.config.const.retry_count_max
-    result = session.query(bpo.db.Package)\
-                    .filter_by(arch=arch,
-                               branch=branch,
-                               splitrepo=splitrepo,
-                               status=failed)\
-                    .filter(bpo.db.Package.retry_count < retry_count_max)\
-                    .all()
-
-    # Get all packages for arch where status = queued
-    queued = bpo.db.PackageStatus.queued
-    result += session.query(bpo.db.Package)\
-                     .filter_by(arch=arch,
-                                branch=branch,
-                                splitrepo=splitrepo,
-                                status=queued)\
-                     .all()
-
-    if not len(result):
+    if is_stuck(session, arch, branch, splitrepo):
         return None
 
-    for package in result:
-        if package.depends_built():
-            return package.pkgname
+    pkgname = bpo.repo.depgraph.next_package(session, arch, branch, splitrepo)
+    if pkgname:
+        return pkgname
 
     # Can't resolve (this is expected, if we only have packages left that
     # depend on packages that are currently building.)
-    logging.debug("can't resolve remaining packages: " + str(result))
+    unresolved = bpo.repo.depgraph.unresolved(session, arch, branch, splitrepo)
+    if unresolved:
+        logging.debug(f"can't resolve remaining packages: {unresolved}")
     return None
 
 
@@ -100,26 +85,6 @@ def repo_bootstrap_attempt(session, rb):
     return True
 
 
-def count_running_builds_packages(session):
-    building = bpo.db.PackageStatus.building
-    return session.query(bpo.db.Package).filter_by(status=building).count()
-
-
-def count_running_builds_images(session):
-    building = bpo.db.ImageStatus.building
-    return session.query(bpo.db.Image).filter_by(status=building).count()
-
-def count_running_builds_repo_bootstrap(session):
-    building = bpo.db.RepoBootstrapStatus.building
-    return session.query(bpo.db.RepoBootstrap).filter_by(status=building).count()
-
-
-def count_running_builds(session):
-    return (count_running_builds_packages(session) +
-            count_running_builds_images(session) +
-            count_running_builds_repo_bootstrap(session))
-
-
 def count_unpublished_packages(session, branch, arch=None, splitrepo=None):
     q = session.query(bpo.db.Package)
     q = q.filter_by(branch=branch)
@@ -150,6 +115,14 @@ def set_stuck(arch, branch):
     logging.info(branch + "/" + arch + ": repo is stuck")
 
 
+def is_stuck(session, arch, branch, splitrepo):
+    """ :returns: True if the repo was found to be stuck in a previous pass,
+                  and no package status changed since then that could make
+                  it build again """
+    roots = bpo.repo.depgraph.get_stuck(session, arch, branch, splitrepo)
+    return roots is not None
+
+
 def build_arch_branch(session, slots_available, arch, branch, splitrepo,
                       force_repo_update=False, no_repo_update=False):
     """ :returns: amount of jobs that were started
@@ -160,9 +133,15 @@ def build_arch_branch(session, slots_available, arch, branch, splitrepo,
         :param no_repo_update: never update symlink and final repo (used from
                                the images timer thread, see #98) """
     fmt_ = fmt(arch, branch, splitrepo)
+
+    # Staging repos may get unstuck by syncing with the orig repo below
+    is_staging = "_staging_" in branch
+    if not is_staging and is_stuck(session, arch, branch, splitrepo):
+        return 0
+
     logging.info(f"[{fmt_}] starting new package build job(s)")
 
-    if "_staging_" in branch:
+    if is_staging:
         branch_orig, branch_staging = bpo.repo.staging.branch_split(branch)
         if count_unpublished_packages(session, branch_orig, splitrepo):
             # As long as the original branch has unpublished packages, don't
@@ -174,21 +153,24 @@ def build_arch_branch(session, slots_available, arch, branch, splitrepo,
                          f" {branch_orig} has unpublished packages")
             return 0
         bpo.repo.staging.sync_with_orig_repo(branch, arch, splitrepo)
+        if is_stuck(session, arch, branch, splitrepo):
+            return 0
 
     started = 0
 
     # Do repo_bootstrap first if needed
     rb = bpo.db.get_repo_bootstrap(session, arch, branch, splitrepo)
     if rb and rb.status != bpo.db.RepoBootstrapStatus.published:
-        if slots_available > 0:
+        if rb.status == bpo.db.RepoBootstrapStatus.built:
+            # Publishing only starts a sign_index job, which doesn't use a
+            # slot (see bpo/repo/slots.py)
+            logging.info(f"{rb}: publishing")
+            bpo.repo.symlink.create(arch, branch, splitrepo, True)
+        elif slots_available > 0:
+            bpo.repo.indexer.flush([(arch, branch, splitrepo)])
             if repo_bootstrap_attempt(session, rb):
                 started += 1
                 slots_available -= 1
-            elif rb.status == bpo.db.RepoBootstrapStatus.built:
-                logging.info(f"{rb}: publishing")
-                bpo.repo.symlink.create(arch, branch, splitrepo, True)
-                started += 1
-                slots_available -= 1
         else:
             logging.info(f"{rb}: no more slots available")
 
@@ -199,8 +181,29 @@ def build_arch_branch(session, slots_available, arch, branch, splitrepo,
         pkgname = next_package_to_build(session, arch, branch, splitrepo)
         if not pkgname:
             if not started:
-                if has_unfinished_builds(session, arch, branch, splitrepo):
+                blocked = bpo.repo.depgraph.blocked_by_native(session, arch,
+                                                              branch,
+                                                              splitrepo)
+                if blocked:
+                    # Packages of foreign arches wait for the native packages
+                    # they need (e.g. cross compilers) to get published
+                    logging.info(f"[{fmt_}] waiting for native packages to"
+                                 f" get published: {blocked}")
+                elif has_unfinished_builds(session, arch, branch, splitrepo):
+                    roots, changed = bpo.repo.depgraph.set_stuck(
+                        session, arch, branch, splitrepo)
+                    if roots and changed:
+                        bpo.ui.log("build_repo_stuck", arch=arch,
+                                   branch=branch, splitrepo=splitrepo,
+                                   payload=roots, count=len(roots))
                     set_stuck(arch, branch)
+                elif splitrepo and count_unpublished_packages(session, branch,
+                                                              arch):
+                    # Packages of splitrepos may depend on packages of the
+                    # main repo, don't publish them before these
+                    logging.info(f"[{fmt_}] WIP repo complete, waiting for"
+                                 f" {fmt(arch, branch, None)} to get"
+                                 " published")
                 else:
                     logging.info(f"[{fmt_}] WIP repo complete")
                     if no_repo_update:
@@ -213,6 +216,10 @@ def build_arch_branch(session, slots_available, arch, branch, splitrepo,
             break
 
         if slots_available > 0:
+            # Jobs download the WIP APKINDEX, write the apks of packages that
+            # finished since the last pass once before starting jobs
+            if not started:
+                bpo.repo.indexer.flush([(arch, branch, splitrepo)])
             if bpo.jobs.build_package.run(arch, pkgname, branch, splitrepo):
                 started += 1
                 slots_available -= 1
@@ -238,6 +245,37 @@ def build_images_branch(session, slots_available, branch):
     return started
 
 
+def build_branches(session, slots, branches, force_repo_update_branch=None,
+                   no_repo_update=False, only=None):
+    """ Iterate over all branch-arch combinations, to give them a chance to
+        start new jobs or to proceed with rolling out their fully built WIP
+        repo.
+
+        :param slots: bpo.repo.slots.Slots object
+        :param branches: dict of branch: branch_data
+        :param only: list of (arch, branch, splitrepo) combinations to visit
+                     (default: all)
+        :returns: list of (arch, branch, splitrepo) combinations, which used
+                  all slots they got and have more packages ready to build """
+    ret = []
+    for branch, branch_data in branches.items():
+        for arch in branch_data["arches"]:
+            for splitrepo in bpo.config.const.splitrepos:
+                if only is not None and (arch, branch, splitrepo) not in only:
+                    continue
+                force_repo_update = (force_repo_update_branch == branch)
+                available = slots.available("build_package", branch, arch)
+                started = build_arch_branch(session, available, arch, branch,
+                                            splitrepo, force_repo_update,
+                                            no_repo_update)
+                slots.take("build_package", branch, arch, started)
+                if started >= available and \
+                        next_package_to_build(session, arch, branch,
+                                              splitrepo):
+                    ret += [(arch, branch, splitrepo)]
+    return ret
+
+
 def _build(force_repo_update_branch=None, no_repo_update=False):
     """ Start as many parallel build jobs, as configured. When all packages are
         built, publish the packages. (Images get published right after they
@@ -255,51 +293,38 @@ def _build(force_repo_update_branch=None, no_repo_update=False):
         :param no_repo_update: never update symlink and final repo (used from
                                the images timer thread, see #98) """
     session = bpo.db.session()
-    running = count_running_builds(session)
-    slots_available = bpo.config.const.max_parallel_build_jobs - running
-
-    # Iterate over all branch-arch combinations, to give them a chance to start
-    # a new job or to proceed with rolling out their fully built WIP repo
+    slots = bpo.repo.slots.Slots(session)
     branches_with_staging = bpo.repo.staging.get_branches_with_staging()
-    for branch, branch_data in branches_with_staging.items():
-        arch_is_first = True
-        for arch in branch_data["arches"]:
-            for splitrepo in bpo.config.const.splitrepos:
-                force_repo_update = (force_repo_update_branch == branch)
-                slots_available -= build_arch_branch(session, slots_available,
-                                                     arch, branch,
-                                                     splitrepo,
-                                                     force_repo_update,
-                                                     no_repo_update)
-                if count_unpublished_packages(session, branch, arch, splitrepo):
-                    fmt_ = bpo.repo.fmt(arch, branch, splitrepo)
-                    logging.info(f"[{fmt_}] has unpublished packages,"
-                                 " not building packages for other splitrepos")
-                    break
-
-            # Don't build packages in other architectures unless building the
-            # first architecture (the native arch) is complete. Otherwise cross
-            # compilers may be missing, etc.
-            if arch_is_first:
-                if count_unpublished_packages(session, branch, arch):
-                    logging.info(f"[{branch}/{arch}] has unpublished packages,"
-                                 " not building packages for other arches")
-                    break
-                arch_is_first = False
-
-    if slots_available <= 0:
-        return
+
+    if bpo.config.const.slots_policy == "fair_share":
+        pending = bpo.repo.slots.get_branches_pending(session,
+                                                      branches_with_staging)
+        slots.set_fair_share(pending)
+
+    ready = build_branches(session, slots, branches_with_staging,
+                           force_repo_update_branch, no_repo_update)
+
+    # Let other branches use the slots that a branch could not use for its
+    # fair share (e.g. because its remaining packages depend on running builds)
+    if slots.quota is not None:
+        slots.clear_quota()
+        if ready and slots.available("build_package", None):
+            build_branches(session, slots, branches_with_staging,
+                           force_repo_update_branch, no_repo_update,
+                           only=ready)
 
     # Iterate over branches and build images
     for branch in bpo.config.const.branches:
+        available = slots.available("build_image", branch)
+        if available <= 0:
+            continue
+
         # Only build images on branches where all packages are published
         if count_unpublished_packages(session, branch):
             continue
 
-        slots_available -= build_images_branch(session, slots_available,
-                                               branch)
-        if slots_available <= 0:
-            break
+        slots.take("build_image", branch, None,
+                   build_images_branch(session, available, branch))
 
 
 def build(force_repo_update_branch=None, no_repo_update=False):
@@ -331,7 +356,7 @@ def is_apk_origin_in_db(session, arch, branch, splitrepo, apk_path):
         :returns: origin pkgname if the origin is in db and has same version,
                   False otherwise """
 
-    metadata = bpo.helpers.apk.get_metadata(apk_path)
+    metadata = bpo.helpers.apk_cache.get_metadata(apk_path)
     pkgname = metadata["origin"]
     version = metadata["pkgver"]  # yes, this is actually the full version
     if bpo.db.package_has_version(session, pkgname, arch, branch, splitrepo, version):
@@ -0,0 +1,294 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Read and write APKINDEX.tar.gz without running apk.static.
+
+    The entries of apks that did not change since the last APKINDEX was
+    written are taken from that APKINDEX, all other entries are built from
+    .PKGINFO and the checksum of the control segment (both cached in
+    bpo.helpers.apk_cache). The output has the same format as the one of
+    "apk.static index" (apk-tools 2.10): one gzip stream with a tar archive
+    of DESCRIPTION and APKINDEX, with the entries in apk's hash table order.
+    abuild-sign.noinclude prepends the signature to it as usual. """
+
+import base64
+import logging
+import os
+import struct
+import time
+import zlib
+
+import bpo.helpers.apk
+import bpo.helpers.apk_cache
+import bpo.repo
+
+# apk-tools puts the packages in a hash table of this size, keyed by the
+# control checksum, and writes the APKINDEX in the order of the buckets
+hash_buckets = 10000
+
+
+def parse_pkginfo(pkginfo):
+    """ :param pkginfo: content of .PKGINFO as bytes
+        :returns: {key: [value, ...], ...} """
+    ret = {}
+    for line in pkginfo.decode("utf-8").splitlines():
+        if line.startswith("#") or " = " not in line:
+            continue
+        key, value = line.split(" = ", 1)
+        ret.setdefault(key, []).append(value)
+    return ret
+
+
+def read_entry(apk):
+    """ Build the APKINDEX entry of an apk, like apk-tools does it.
+
+        :param apk: path to the apk file
+        :returns: entry as list of (field, value) tuples """
+    pkginfo, checksum = bpo.helpers.apk.read_control(apk)
+    info = parse_pkginfo(pkginfo)
+
+    def get(key, default=""):
+        return info[key][-1] if key in info else default
+
+    ret = [("C", "Q1" + base64.b64encode(checksum).decode("ascii")),
+           ("P", get("pkgname")),
+           ("V", get("pkgver")),
+           ("A", get("arch")),
+           ("S", str(os.path.getsize(apk))),
+           ("I", str(int(get("size", "0")))),
+           ("T", get("pkgdesc")),
+           ("U", get("url")),
+           ("L", get("license"))]
+    if "origin" in info:
+        ret += [("o", get("origin"))]
+    if "maintainer" in info:
+        ret += [("m", get("maintainer"))]
+    if int(get("builddate", "0")):
+        ret += [("t", str(int(get("builddate"))))]
+    if "commit" in info:
+        ret += [("c", get("commit"))]
+    if int(get("provider_priority", "0")):
+        ret += [("k", str(int(get("provider_priority"))))]
+    for key, field in [("depend", "D"), ("provides", "p"),
+                       ("install_if", "i")]:
+        value = " ".join(" ".join(info.get(key, [])).split())
+        if value:
+            ret += [(field, value)]
+    return ret
+
+
+def get_value(entry, field):
+    """ :returns: value of field in entry, or None """
+    for key, value in entry:
+        if key == field:
+            return value
+    return None
+
+
+def get_apk(entry):
+    """ :returns: file name of the apk of the entry """
+    return f"{get_value(entry, 'P')}-{get_value(entry, 'V')}.apk"
+
+
+def get_bucket(entry):
+    """ :returns: bucket of the entry in apk's hash table """
+    checksum = base64.b64decode(get_value(entry, "C")[2:])
+    return struct.unpack("<Q", checksum[:8])[0] % hash_buckets
+
+
+def sort(entries):
+    """ :returns: entries in the order apk writes them, when the apks are
+                  passed in alphabetical order like bpo.repo.get_apks()
+                  returns them: by hash bucket, and within a bucket the last
+                  added entry comes first """
+    entries = sorted(entries, key=get_apk, reverse=True)
+    return sorted(entries, key=get_bucket)
+
+
+def format_entry(entry, arch=None):
+    """ :param arch: replace the arch of the entry (apk's --rewrite-arch)
+        :returns: entry as it appears in the APKINDEX """
+    ret = ""
+    for field, value in entry:
+        if field == "A" and arch:
+            value = arch
+        ret += f"{field}:{value}\n"
+    return ret + "\n"
+
+
+def parse_entries(content):
+    """ :param content: the APKINDEX file inside APKINDEX.tar.gz as bytes
+        :returns: list of entries """
+    ret = []
+    for block in content.decode("utf-8").split("\n\n"):
+        entry = [tuple(line.split(":", 1)) for line in block.split("\n")
+                 if line]
+        if entry:
+            ret += [entry]
+    return ret
+
+
+def parse(path):
+    """ Read an APKINDEX.tar.gz, signed or not.
+
+        :param path: path to the APKINDEX.tar.gz
+        :returns: (description, entries) """
+    description = None
+    entries = None
+    with open(path, "rb") as handle:
+        data = bytearray()
+        try:
+            for item in bpo.helpers.apk.iter_gzip_streams(handle, 2):
+                data.extend(item[2])
+        except zlib.error:
+            raise RuntimeError("This APKINDEX is not a valid gzip file: " +
+                               path)
+
+    # Signature and index are separate gzip streams, but the signature is
+    # a tar archive without end of archive blocks, so both can be parsed as
+    # one tar archive
+    pos = 0
+
+    def read(size):
+        nonlocal pos
+        pos += size
+        return bytes(data[pos - size:pos])
+
+    for name, content in bpo.helpers.apk.iter_tar_members(read, path):
+        if name == b"DESCRIPTION":
+            description = content.decode("utf-8")
+        elif name == b"APKINDEX":
+            entries = parse_entries(content)
+
+    if entries is None:
+        raise RuntimeError("No APKINDEX found in: " + path)
+    return description, entries
+
+
+def tar_header(name, size, mtime):
+    """ :returns: tar header as written by apk-tools (GNU format, regular
+                  file owned by root with mode 0644) """
+    header = bytearray(512)
+    header[0:len(name)] = name.encode("utf-8")
+    header[100:108] = b"0000644\0"
+    header[108:116] = b"0000000\0"
+    header[116:124] = b"0000000\0"
+    header[124:136] = b"%011o\0" % size
+    header[136:148] = b"%011o\0" % mtime
+    header[148:156] = b" " * 8
+    header[156:157] = b"0"
+    header[257:265] = b"ustar  \0"
+    header[265:269] = b"root"
+    header[297:301] = b"root"
+    header[148:156] = b"%06o\0 " % sum(header)
+    return bytes(header)
+
+
+def tar_member(name, content, mtime):
+    return (tar_header(name, len(content), mtime) + content +
+            bytes(-len(content) % 512))
+
+
+def write(path, entries, description, arch=None, mtime=None):
+    """ Write an unsigned APKINDEX.tar.gz (atomically).
+
+        :param path: output file
+        :param entries: list of entries, in the order they should appear
+        :param description: content of the DESCRIPTION file
+        :param arch: replace the arch of all entries (apk's --rewrite-arch)
+        :param mtime: of the files in the tar archive, default: now """
+    if mtime is None:
+        mtime = int(time.time())
+
+    index = "".join(format_entry(entry, arch) for entry in entries)
+    tar = (tar_member("DESCRIPTION", description.encode("utf-8"), mtime) +
+           tar_member("APKINDEX", index.encode("utf-8"), mtime) +
+           bytes(1024))
+
+    # gzip stream like the one of apk-tools: no file name, no mtime, maximum
+    # compression, unix
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = (b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\x03" +
+            compressor.compress(tar) + compressor.flush() +
+            struct.pack("<II", zlib.crc32(tar), len(tar) & 0xffffffff))
+
+    path_temp = path + ".tmp"
+    with open(path_temp, "wb") as handle:
+        handle.write(data)
+    os.replace(path_temp, path)
+
+
+def get_entries_old(path):
+    """ :param path: path to the repository
+        :returns: {apk: entry} of the existing APKINDEX.tar.gz, for apks that
+                  were not modified after it was written """
+    index = path + "/APKINDEX.tar.gz"
+    if not os.path.exists(index):
+        return {}
+
+    try:
+        entries = parse(index)[1]
+    except (RuntimeError, UnicodeDecodeError, ValueError) as e:
+        logging.warning(f"Failed to parse {index}, not reusing its entries:"
+                        f" {e}")
+        return {}
+
+    mtime_index = os.stat(index).st_mtime_ns
+    ret = {}
+    for entry in entries:
+        apk = get_apk(entry)
+        try:
+            st = os.stat(path + "/" + apk)
+        except FileNotFoundError:
+            continue
+        if st.st_mtime_ns < mtime_index and \
+                str(st.st_size) == get_value(entry, "S"):
+            ret[apk] = entry
+    return ret
+
+
+def index(path, arch, description):
+    """ Write the APKINDEX.tar.gz of a repository. Like "apk.static index
+        --index APKINDEX.tar.gz", entries of apks that are older than the
+        existing APKINDEX and have the same size get reused.
+
+        :param path: path to the repository
+        :param arch: written to all entries (apk's --rewrite-arch)
+        :param description: content of the DESCRIPTION file """
+    entries_old = get_entries_old(path)
+    entries = []
+    for apk in bpo.repo.get_apks(path):
+        if apk in entries_old:
+            entries += [entries_old[apk]]
+        else:
+            entries += [bpo.helpers.apk_cache.get_index_entry(path + "/" +
+                                                              apk)]
+
+    write(path + "/APKINDEX.tar.gz", sort(entries), description, arch)
+
+
+def update(path, arch, description, add, remove):
+    """ Only update the entries of apks that were added or removed, without
+        looking at the other apks of the repository. If there is no existing
+        APKINDEX.tar.gz that can be parsed, index the repository instead.
+
+        :param path: path to the repository
+        :param arch: written to all entries (apk's --rewrite-arch)
+        :param description: content of the DESCRIPTION file
+        :param add: file names of apks that were added or replaced
+        :param remove: file names of apks that were removed """
+    index_path = path + "/APKINDEX.tar.gz"
+    try:
+        entries = parse(index_path)[1]
+    except (OSError, RuntimeError, UnicodeDecodeError, ValueError) as e:
+        logging.info(f"Can't update {index_path} ({e}), indexing the whole"
+                     " repository instead")
+        return index(path, arch, description)
+
+    changed = set(add) | set(remove)
+    entries = [entry for entry in entries if get_apk(entry) not in changed]
+    for apk in add:
+        if os.path.exists(path + "/" + apk):
+            entries += [bpo.helpers.apk_cache.get_index_entry(path + "/" +
+                                                              apk)]
+
+    write(index_path, sort(entries), description, arch)
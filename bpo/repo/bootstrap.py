@@ -4,6 +4,7 @@ import logging
 
 import bpo.jobs.get_depends
 import bpo.repo
+import bpo.repo.scheduler
 
 
 def get_splitrepos_where_bootstrap_is_needed(payload):
@@ -34,17 +35,19 @@ def get_splitrepos_where_bootstrap_is_needed(payload):
 def init(session, payload, arch, branch):
     """
     Add a new entry to the repo_bootstrap table, if it is needed for the
-    current branch, and if there is no entry yet.
+    current branch, and if there is no entry yet. The caller commits it and
+    writes the "repo_bootstrap_add" log message (see log_added()).
 
     :param payload: from the get_depends api call
         e.g.: [ { "pkgname": "hello-world",
         "repo": None or "systemd",  # splitrepo dir
         "version": "1-r4",
         "depends": []}, … ]
-    :returns: True if a new entry was added to the table, False otherwise
+    :returns: list of splitrepos for which an entry was added, e.g. [] or
+              ["systemd"]
 
     """
-    ret = False
+    ret = []
     for splitrepo in get_splitrepos_where_bootstrap_is_needed(payload):
         repo_bootstrap = bpo.db.get_repo_bootstrap(session, arch, branch, splitrepo)
         if repo_bootstrap:
@@ -53,14 +56,20 @@ def init(session, payload, arch, branch):
 
         repo_bootstrap = bpo.db.RepoBootstrap(arch, branch, splitrepo)
         session.merge(repo_bootstrap)
-        session.commit()
+        ret += [splitrepo]
+
+    return ret
+
 
+def log_added(arch, branch, splitrepos):
+    """ Write the log messages for the entries that init() added, after they
+        were committed.
+
+        :param splitrepos: return value of init() """
+    for splitrepo in splitrepos:
         bpo.ui.log("repo_bootstrap_add", arch=arch, branch=branch,
                    pkgname="[repo_bootstrap]", dir_name=splitrepo,
                    splitrepo=splitrepo)
-        ret = True
-
-    return ret
 
 
 def update_to_published(arch, branch, dir_name):
@@ -84,5 +93,5 @@ def update_to_published(arch, branch, dir_name):
                pkgname="[repo_bootstrap]", dir_name=dir_name,
                splitrepo=dir_name)
 
-    bpo.repo.build()
+    bpo.repo.scheduler.wakeup()
     return True
@@ -0,0 +1,581 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" In-memory dependency graph of all packages of one arch/branch, so
+    bpo.repo.next_package_to_build() does not need to query the database and
+    lazily load Package.depends for every free build slot.
+
+    A graph gets loaded with two queries the first time it is needed, and then
+    gets updated from the package changes that are committed to the database
+    (see after_flush() below). Status changes are applied incrementally. All
+    other changes to packages (added, removed, depends changed, ...) drop the
+    cached graph, so it gets loaded again on the next use.
+
+    The order in which ready packages get picked is configured with
+    bpo.config.const.build_order. For "critical_path", each package gets a
+    weight when the graph is loaded: its own cost (build duration from
+    bpo.db.BuildStats), plus the weight of the heaviest package that depends
+    on it and is not built yet. The package with
+    the highest weight starts the longest remaining chain of builds. When
+    build durations get committed to BuildStats, the weights of the graphs
+    of that arch are computed again (see Graph.set_durations()).
+
+    Packages of foreign arches are additionally gated by the native arch
+    (bpo.config.const.native_arch) of the same branch: a foreign package only
+    gets picked once the native packages it needs are published. These are
+    the native packages with the same pkgnames as its depends, and the cross
+    compilers for its arch (bpo.config.const.cross_native_packages). Ready
+    packages that are blocked this way wait in Graph.waiting, until the native
+    graph changes. If such a native package failed without retries left (or
+    depends on one), the foreign package does not wait, it is stuck.
+
+    When no package of a splitrepo can be built, but some are not built yet,
+    the splitrepo is stuck. The failed packages without retries left that
+    block it (native ones prefixed with the native arch, e.g.
+    "x86_64/gcc-aarch64") get stored in Graph.stuck, so
+    bpo.repo.build_arch_branch() can skip it until a status in the graph or
+    in the native graph changes.
+
+    Code that writes to the package or package_dependency tables without the
+    ORM (e.g. with executemany) must call invalidate() afterwards. """
+
+import fnmatch
+
+import heapq
+import logging
+import threading
+
+import sqlalchemy
+import sqlalchemy.event
+import sqlalchemy.orm
+
+import bpo.config.const
+import bpo.db
+
+# graphs[(arch, branch)] = Graph
+graphs = {}
+graphs_lock = threading.RLock()
+
+# native_changes[branch] = counter that increases whenever the status of a
+# native package changes, or the native graph gets loaded or dropped. Foreign
+# graphs compare it with Graph.native_seen, to know when to check their
+# waiting packages again.
+native_changes = {}
+
+# Package attributes that change the structure of the graph
+attrs_structure = ["arch", "branch", "splitrepo", "pkgname", "depends"]
+
+
+class Node:
+    __slots__ = ["id", "pkgname", "splitrepo", "status", "retry_count",
+                 "depends", "required_by", "missing", "heap_key", "weight"]
+
+    def __init__(self, id, pkgname, splitrepo, status, retry_count):
+        self.id = id
+        self.pkgname = pkgname
+        self.splitrepo = splitrepo
+        self.status = status
+        self.retry_count = retry_count or 0
+        self.depends = []
+        self.required_by = []
+        self.missing = 0  # count of depends that are not built yet
+        self.heap_key = None  # key of this node in Graph.ready, if any
+        self.weight = None  # see compute_weights()
+
+
+def is_built(status):
+    return status in [bpo.db.PackageStatus.built,
+                      bpo.db.PackageStatus.published]
+
+
+class Graph:
+    def __init__(self, arch, branch):
+        self.arch = arch
+        self.branch = branch
+        self.nodes = {}
+        # ready[splitrepo] = heap of (key, id) of nodes without missing
+        # depends. Entries that became outdated are skipped in next_package().
+        self.ready = {}
+        # by_pkgname[pkgname] = list of nodes (one per splitrepo)
+        self.by_pkgname = {}
+        # Foreign arch only: ready nodes blocked by native packages, and the
+        # native_changes counter from when they were checked
+        self.waiting = []
+        self.native_seen = None
+        # Native arch only: cross[arch] = nodes of cross compilers for arch
+        self.cross = {}
+        # stuck[splitrepo] = (failed root pkgnames, native_changes counter)
+        self.stuck = {}
+        # stuck_last[splitrepo] = failed root pkgnames that were found last
+        # time (not cleared on status changes, to report new roots only once)
+        self.stuck_last = {}
+        # durations[pkgname] = average build duration in seconds, see cost()
+        self.durations = {}
+        self.duration_default = 1
+
+    def load(self, session):
+        Package = bpo.db.Package
+        result = session.query(Package.id,
+                               Package.pkgname,
+                               Package.splitrepo,
+                               Package.status,
+                               Package.retry_count)\
+            .filter_by(arch=self.arch, branch=self.branch)\
+            .order_by(Package.id)
+        for row in result:
+            node = Node(*row)
+            self.nodes[row.id] = node
+            self.by_pkgname.setdefault(node.pkgname, []).append(node)
+
+        assoc = bpo.db.base.metadata.tables["package_dependency"]
+        result = session.query(assoc.c.package_id, assoc.c.dependency_id)\
+            .join(Package, Package.id == assoc.c.package_id)\
+            .filter(Package.arch == self.arch, Package.branch == self.branch)
+        for package_id, dependency_id in result:
+            node = self.nodes.get(package_id)
+            depend = self.nodes.get(dependency_id)
+            if not node or not depend:
+                continue
+            node.depends.append(depend)
+            depend.required_by.append(node)
+            if not is_built(depend.status):
+                node.missing += 1
+
+        self.durations = bpo.db.get_build_durations(session, "build_package",
+                                                    self.arch)
+        if self.durations:
+            self.duration_default = max(1, round(
+                sum(self.durations.values()) / len(self.durations)))
+
+        self.compute_weights()
+        for node in self.nodes.values():
+            self.push(node)
+
+        logging.debug(f"{self.branch}/{self.arch}: loaded dependency graph"
+                      f" with {len(self.nodes)} packages")
+
+    def cost(self, node):
+        """ :returns: how expensive it is to build the package: the average
+                      duration of its previous builds in seconds. Packages
+                      that were not built yet get the average of all
+                      packages, or 1 if nothing was built for this arch. """
+        return max(1, self.durations.get(node.pkgname, self.duration_default))
+
+    def compute_weights(self):
+        """ Set the weight of each node to its own cost plus the weight of the
+            heaviest unbuilt package that depends on it. This is done
+            iteratively instead of recursively, as chains in pmaports can be
+            longer than the recursion limit. Dependency cycles (which can't be
+            built anyway) are cut at the node where they are found. """
+        visiting = set()
+        for start in self.nodes.values():
+            if start.weight is not None:
+                continue
+            stack = [(start, False)]
+            while stack:
+                node, expanded = stack.pop()
+                if expanded:
+                    heaviest = 0
+                    for required_by in node.required_by:
+                        if required_by.weight and \
+                                not is_built(required_by.status):
+                            heaviest = max(heaviest, required_by.weight)
+                    node.weight = self.cost(node) + heaviest
+                    visiting.discard(node.id)
+                    continue
+                if node.weight is not None or node.id in visiting:
+                    continue
+                visiting.add(node.id)
+                stack.append((node, True))
+                for required_by in node.required_by:
+                    if required_by.weight is None and \
+                            required_by.id not in visiting:
+                        stack.append((required_by, False))
+
+    def set_durations(self, durations):
+        """ Apply new average build durations and compute the weights again.
+            duration_default stays the same until the graph gets loaded
+            again.
+
+            :param durations: dict of pkgname: duration in seconds """
+        self.durations.update(durations)
+        for node in self.nodes.values():
+            node.weight = None
+        self.compute_weights()
+
+        # Ready nodes get pushed with their new key, the entries with the old
+        # key get skipped in next_package(). Waiting nodes get pushed again
+        # in check_waiting().
+        waiting = set(node.id for node in self.waiting)
+        for node in self.nodes.values():
+            if node.id not in waiting:
+                self.push(node)
+
+    def is_candidate(self, node):
+        """ :returns: True if the package should be built once its depends
+                      are built (queued, or failed with retries left) """
+        if node.status == bpo.db.PackageStatus.queued:
+            return True
+        if node.status == bpo.db.PackageStatus.failed:
+            return node.retry_count < bpo.config.const.retry_count_max
+        return False
+
+    def key(self, node):
+        failed_first = 0 if node.status == bpo.db.PackageStatus.failed else 1
+        if bpo.config.const.build_order == "critical_path":
+            return (-node.weight, failed_first, node.id)
+        return (failed_first, node.id)
+
+    def is_ready(self, node):
+        return node.missing == 0 and self.is_candidate(node)
+
+    def push(self, node):
+        if not self.is_ready(node):
+            return
+        key = self.key(node)
+        if node.heap_key == key:
+            return
+        node.heap_key = key
+        heapq.heappush(self.ready.setdefault(node.splitrepo, []),
+                       (key, node.id))
+
+    def set_status(self, id, status, retry_count):
+        # Packages may depend on packages of other splitrepos
+        self.stuck.clear()
+        node = self.nodes[id]
+        built_before = is_built(node.status)
+        node.status = status
+        node.retry_count = retry_count or 0
+
+        if built_before != is_built(status):
+            for required_by in node.required_by:
+                required_by.missing += -1 if is_built(status) else 1
+                self.push(required_by)
+        self.push(node)
+
+    def get_cross(self, arch):
+        """ Native graph only.
+            :returns: list of nodes of the cross compilers for arch """
+        if arch not in self.cross:
+            patterns = [pattern.format(arch=arch) for pattern in
+                        bpo.config.const.cross_native_packages]
+            self.cross[arch] = [node for node in self.nodes.values()
+                                if any(fnmatch.fnmatch(node.pkgname, pattern)
+                                       for pattern in patterns)]
+        return self.cross[arch]
+
+    def native_blockers(self, node, native):
+        """ :param native: Graph of the native arch, or None if this is the
+                           native graph
+            :returns: generator of native nodes that must be published before
+                      node can be built """
+        if not native:
+            return
+        published = bpo.db.PackageStatus.published
+        for cross in native.get_cross(self.arch):
+            if cross.status != published:
+                yield cross
+        for depend in node.depends:
+            for native_node in native.by_pkgname.get(depend.pkgname, []):
+                if native_node.status != published:
+                    yield native_node
+
+    def native_blocker(self, node, native):
+        """ :param native: Graph of the native arch, or None if this is the
+                           native graph
+            :returns: pkgname of a native package that must be published
+                      before node can be built, or None """
+        for native_node in self.native_blockers(node, native):
+            return native_node.pkgname
+        return None
+
+    def check_waiting(self):
+        """ Push the waiting nodes again, if the native graph changed since
+            they were checked. """
+        if self.native_seen == native_changes.get(self.branch, 0):
+            return
+        self.native_seen = native_changes.get(self.branch, 0)
+        waiting = self.waiting
+        self.waiting = []
+        for node in waiting:
+            node.heap_key = None
+            self.push(node)
+
+    def next_package(self, splitrepo, native=None):
+        """ :param native: Graph of the native arch, or None if this is the
+                           native graph
+            :returns: the node of the next package to build, or None """
+        if native:
+            self.check_waiting()
+        heap = self.ready.get(splitrepo)
+        while heap:
+            key, id = heap[0]
+            node = self.nodes[id]
+            if node.heap_key == key and self.is_ready(node):
+                if not self.native_blocker(node, native):
+                    return node
+                # Keep heap_key, so the node doesn't get pushed again until
+                # check_waiting() found that the native graph changed
+                self.waiting.append(node)
+                heapq.heappop(heap)
+                continue
+            heapq.heappop(heap)
+            if node.heap_key == key:
+                node.heap_key = None
+        return None
+
+    def blocked_by_native(self, splitrepo, native):
+        """ :returns: dict of pkgname: native pkgname, for ready packages that
+                      are waiting for native packages to get published.
+                      Packages blocked by native packages that can't get
+                      published (see failed_roots()) are not waiting, but
+                      stuck. """
+        ret = {}
+        for node in self.waiting:
+            if node.splitrepo != splitrepo or not self.is_ready(node):
+                continue
+            blockers = list(self.native_blockers(node, native))
+            if blockers and not native.failed_roots(blockers):
+                ret[node.pkgname] = blockers[0].pkgname
+        return ret
+
+    def failed_roots(self, nodes):
+        """ :param nodes: nodes of this graph
+            :returns: set of pkgnames of failed packages without retries
+                      left, that the unbuilt nodes are (or depend on) """
+        failed = bpo.db.PackageStatus.failed
+        roots = set()
+        visited = set()
+        stack = [node for node in nodes if not is_built(node.status)]
+        while stack:
+            node = stack.pop()
+            if node.id in visited:
+                continue
+            visited.add(node.id)
+            if node.status == failed and not self.is_candidate(node):
+                roots.add(node.pkgname)
+                continue
+            for depend in node.depends:
+                if not is_built(depend.status):
+                    stack.append(depend)
+        return roots
+
+    def find_stuck_roots(self, splitrepo, native=None):
+        """ :param native: Graph of the native arch, or None if this is the
+                           native graph
+            :returns: sorted list of pkgnames of failed packages without
+                      retries left, that the unbuilt packages of splitrepo
+                      are (or depend on), including the native packages they
+                      wait for """
+        nodes = [node for node in self.nodes.values()
+                 if node.splitrepo == splitrepo and not is_built(node.status)]
+        roots = self.failed_roots(nodes)
+        if native:
+            blockers = {}
+            for node in nodes:
+                for native_node in self.native_blockers(node, native):
+                    blockers[native_node.id] = native_node
+            roots |= {f"{native.arch}/{pkgname}" for pkgname
+                      in native.failed_roots(blockers.values())}
+        return sorted(roots)
+
+    def unresolved(self, splitrepo):
+        """ :returns: list of candidate pkgnames, that can't be built right
+                      now because of missing depends """
+        return [node.pkgname for node in self.nodes.values()
+                if node.splitrepo == splitrepo and self.is_candidate(node)]
+
+
+def native_changed(branch):
+    native_changes[branch] = native_changes.get(branch, 0) + 1
+
+
+def get(session, arch, branch):
+    """ :returns: the cached Graph for arch/branch, loaded if necessary """
+    with graphs_lock:
+        graph = graphs.get((arch, branch))
+        if not graph:
+            graph = Graph(arch, branch)
+            graph.load(session)
+            graphs[(arch, branch)] = graph
+            if arch == bpo.config.const.native_arch:
+                native_changed(branch)
+        return graph
+
+
+def get_native(session, arch, branch):
+    """ :returns: the Graph of the native arch, or None if arch is the native
+                  arch """
+    if arch == bpo.config.const.native_arch:
+        return None
+    return get(session, bpo.config.const.native_arch, branch)
+
+
+def next_package(session, arch, branch, splitrepo):
+    """ :returns: pkgname of the next package to build, or None """
+    with graphs_lock:
+        native = get_native(session, arch, branch)
+        node = get(session, arch, branch).next_package(splitrepo, native)
+        return node.pkgname if node else None
+
+
+def blocked_by_native(session, arch, branch, splitrepo):
+    """ :returns: dict of pkgname: native pkgname, for packages that could be
+                  built if the native package was published """
+    with graphs_lock:
+        native = get_native(session, arch, branch)
+        if not native:
+            return {}
+        graph = get(session, arch, branch)
+        graph.next_package(splitrepo, native)
+        return graph.blocked_by_native(splitrepo, native)
+
+
+def get_stuck(session, arch, branch, splitrepo):
+    """ :returns: list of failed root pkgnames if the splitrepo was found to
+                  be stuck and nothing relevant changed since then (can be
+                  empty if it only waits for running builds), None
+                  otherwise """
+    with graphs_lock:
+        stuck = get(session, arch, branch).stuck.get(splitrepo)
+        if not stuck:
+            return None
+        roots, native_seen = stuck
+        if native_seen != native_changes.get(branch, 0):
+            return None
+        return roots
+
+
+def set_stuck(session, arch, branch, splitrepo):
+    """ Remember that no package of the splitrepo can be built right now.
+        :returns: (roots, changed): list of failed root pkgnames, and True if
+                  they are different from the last time the splitrepo was
+                  stuck """
+    with graphs_lock:
+        native = get_native(session, arch, branch)
+        graph = get(session, arch, branch)
+        roots = graph.find_stuck_roots(splitrepo, native)
+        graph.stuck[splitrepo] = (roots, native_changes.get(branch, 0))
+        changed = roots != graph.stuck_last.get(splitrepo)
+        graph.stuck_last[splitrepo] = roots
+        return roots, changed
+
+
+def get_stuck_all():
+    """ :returns: list of (arch, branch, splitrepo, roots) of all stuck
+                  splitrepos that are blocked by failed packages, for the UI
+                  (only looks at graphs that are loaded already) """
+    ret = []
+    with graphs_lock:
+        for (arch, branch), graph in graphs.items():
+            for splitrepo, (roots, native_seen) in graph.stuck.items():
+                if roots and native_seen == native_changes.get(branch, 0):
+                    ret += [(arch, branch, splitrepo, roots)]
+    return sorted(ret, key=lambda entry: (entry[1], entry[0],
+                                          entry[2] or ""))
+
+
+def unresolved(session, arch, branch, splitrepo):
+    with graphs_lock:
+        return get(session, arch, branch).unresolved(splitrepo)
+
+
+def invalidate(arch=None, branch=None):
+    """ Drop cached graphs, so they get loaded from the database again.
+        :param arch: only drop graphs for this arch (default: all)
+        :param branch: only drop graphs for this branch (default: all) """
+    with graphs_lock:
+        for key in list(graphs.keys()):
+            if arch and key[0] != arch:
+                continue
+            if branch and key[1] != branch:
+                continue
+            drop(key)
+
+
+def drop(key):
+    del graphs[key]
+    if key[0] == bpo.config.const.native_arch:
+        native_changed(key[1])
+
+
+def apply_changes(changes):
+    """ :param changes: list of changes collected in after_flush() """
+    with graphs_lock:
+        for key, change in changes:
+            if key is None:
+                invalidate()
+                continue
+
+            graph = graphs.get(key)
+            if not graph:
+                continue
+
+            if change is None or change[0] not in graph.nodes:
+                drop(key)
+                continue
+
+            graph.set_status(*change)
+            if key[0] == bpo.config.const.native_arch:
+                native_changed(key[1])
+
+
+def apply_durations(durations):
+    """ :param durations: dict of arch: {pkgname: duration}, collected in
+                          after_flush() """
+    with graphs_lock:
+        for (arch, branch), graph in graphs.items():
+            if arch in durations:
+                graph.set_durations(durations[arch])
+
+
+def after_flush(session, flush_context):
+    """ Remember which packages and build durations were changed, and apply
+        the changes to the cached graphs after they have been committed. """
+    changes = session.info.setdefault("depgraph_changes", [])
+
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, bpo.db.BuildStats) or \
+                obj.job_name != "build_package":
+            continue
+        if obj in session.dirty and not \
+                sqlalchemy.inspect(obj).attrs.duration_avg.history\
+                .has_changes():
+            continue
+        durations = session.info.setdefault("depgraph_durations", {})
+        durations.setdefault(obj.arch, {})[obj.name] = obj.duration_avg
+
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, bpo.db.Package):
+            changes.append(((obj.arch, obj.branch), None))
+
+    for obj in session.dirty:
+        if not isinstance(obj, bpo.db.Package):
+            continue
+        attrs = sqlalchemy.inspect(obj).attrs
+        if any(attrs[attr].history.has_changes() for attr in attrs_structure):
+            # Might have moved to a different arch/branch: drop all graphs
+            changes.append((None, None))
+        elif attrs.status.history.has_changes() or \
+                attrs.retry_count.history.has_changes():
+            changes.append(((obj.arch, obj.branch),
+                            (obj.id, obj.status, obj.retry_count)))
+
+
+def after_commit(session):
+    changes = session.info.pop("depgraph_changes", None)
+    if changes:
+        apply_changes(changes)
+    durations = session.info.pop("depgraph_durations", None)
+    if durations:
+        apply_durations(durations)
+
+
+def after_rollback(session):
+    session.info.pop("depgraph_changes", None)
+    session.info.pop("depgraph_durations", None)
+
+
+sqlalchemy.event.listen(sqlalchemy.orm.Session, "after_flush", after_flush)
+sqlalchemy.event.listen(sqlalchemy.orm.Session, "after_commit", after_commit)
+sqlalchemy.event.listen(sqlalchemy.orm.Session, "after_rollback",
+                        after_rollback)
@@ -0,0 +1,125 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Estimate how long it takes until the WIP repo of an arch/branch is
+    complete, from the build durations in bpo.db.BuildStats (through the
+    costs of bpo.repo.depgraph.Graph).
+
+    The estimate is the longer one of: the heaviest chain of packages that
+    still need to be built (they can't run in parallel), and the remaining
+    build time of all packages spread over the build slots of the arch.
+    Packages that can't be built because a dependency failed without retries
+    left are not counted. Waiting for native packages of foreign arches and
+    the time until a build slot is free are not taken into account. """
+
+import sqlalchemy
+
+import bpo.config.const
+import bpo.db
+import bpo.repo.depgraph
+
+
+def get_parallel(arch, branch):
+    """ :returns: how many packages of arch/branch can be built at once """
+    ret = bpo.config.const.max_parallel_build_jobs
+    limits = [(bpo.config.const.max_parallel_jobs_type, "build_package"),
+              (bpo.config.const.max_parallel_jobs_arch, arch),
+              (bpo.config.const.max_parallel_jobs_branch, branch)]
+    for limit, key in limits:
+        if key in limit:
+            ret = min(ret, limit[key])
+    return max(1, ret)
+
+
+def get_started(session, arch, branch):
+    """ :returns: dict of pkgname: start time of the running build_package
+                  attempts """
+    BuildAttempt = bpo.db.BuildAttempt
+    result = session.query(BuildAttempt.pkgname, BuildAttempt.started)\
+        .filter_by(job_name="build_package", arch=arch, branch=branch,
+                   outcome=bpo.db.BuildAttemptOutcome.running)
+    return {pkgname: started for pkgname, started in result}
+
+
+def get_remaining(graph, started, now):
+    """ :param started: return value of get_started()
+        :returns: dict of node id: seconds until the package is built, for
+                  packages that are building or will be built """
+    ret = {}
+    for node in graph.nodes.values():
+        if node.status == bpo.db.PackageStatus.building:
+            cost = graph.cost(node)
+            if node.pkgname in started:
+                elapsed = (now - started[node.pkgname]).total_seconds()
+                cost = max(0, cost - elapsed)
+            ret[node.id] = cost
+        elif graph.is_candidate(node):
+            ret[node.id] = graph.cost(node)
+    return ret
+
+
+def get(session, arch, branch, now=None):
+    """ :returns: estimated seconds until all packages of arch/branch are
+                  built, or None if nothing can be built """
+    now = now or bpo.db.utcnow()
+    started = get_started(session, arch, branch)
+
+    with bpo.repo.depgraph.graphs_lock:
+        graph = bpo.repo.depgraph.get(session, arch, branch)
+        remaining = get_remaining(graph, started, now)
+
+        # Walk the remaining packages in build order (Kahn's algorithm).
+        # Packages with a dependency that will not be built never get
+        # visited, and neither do packages in dependency cycles.
+        missing = {}
+        queue = []
+        for node_id in remaining:
+            node = graph.nodes[node_id]
+            missing[node_id] = 0
+            for depend in node.depends:
+                if depend.id in remaining:
+                    missing[node_id] += 1
+                elif not bpo.repo.depgraph.is_built(depend.status):
+                    missing[node_id] = None
+                    break
+            if missing[node_id] == 0:
+                queue.append(node)
+
+        finish = {}
+        while queue:
+            node = queue.pop()
+            before = [finish[depend.id] for depend in node.depends
+                      if depend.id in finish]
+            finish[node.id] = remaining[node.id] + max(before, default=0)
+            for required_by in node.required_by:
+                if missing.get(required_by.id) is None:
+                    continue
+                missing[required_by.id] -= 1
+                if missing[required_by.id] == 0:
+                    queue.append(required_by)
+
+    if not finish:
+        return None
+
+    total = sum(remaining[node_id] for node_id in finish)
+    return round(max(max(finish.values()),
+                     total / get_parallel(arch, branch)))
+
+
+def get_all(session):
+    """ :returns: dict of (branch, arch): estimated seconds, for all WIP
+                  repos that have packages left to build """
+    Package = bpo.db.Package
+    result = session.query(Package.branch, Package.arch).distinct()\
+        .filter(sqlalchemy.or_(
+            Package.status == bpo.db.PackageStatus.queued,
+            Package.status == bpo.db.PackageStatus.building,
+            sqlalchemy.and_(
+                Package.status == bpo.db.PackageStatus.failed,
+                Package.retry_count < bpo.config.const.retry_count_max)))
+
+    ret = {}
+    for branch, arch in result:
+        eta = get(session, arch, branch)
+        if eta is not None:
+            ret[(branch, arch)] = eta
+    return ret
@@ -6,7 +6,9 @@ import os
 import shutil
 
 import bpo.config.const
+import bpo.helpers.apk_cache
 import bpo.repo
+import bpo.repo.scheduler
 import bpo.repo.staging
 import bpo.repo.status
 
@@ -51,7 +53,15 @@ def copy_new_apks(arch, branch, splitrepo):
             logging.debug(apk + ": symlink points to final repo, not copying")
             continue
         logging.debug(apk + ": copying to final repo")
-        shutil.copy(src, dst)
+        bpo.helpers.apk_cache.copy(src, dst)
+
+        # Point the symlink to the copy, as bpo.repo.wip.clean() will delete
+        # the apk from the WIP repo. The symlink repo is kept for the next
+        # bpo.repo.symlink.create(), which expects that all symlinks to apks
+        # that are not in the WIP repo point to the final repo.
+        link = repo_symlink_path + "/" + apk
+        os.unlink(link)
+        os.symlink(dst, link)
 
 
 def copy_new_apkindex(arch, branch, splitrepo):
@@ -87,4 +97,4 @@ def update_from_symlink_repo(arch, branch, splitrepo):
 
 
 def publish(arch, branch):
-    bpo.repo.build()
+    bpo.repo.scheduler.wakeup()
@@ -0,0 +1,156 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Update the APKINDEX of WIP repositories in a dedicated thread, so the
+    build-package callback doesn't need to wait for it, and packages that
+    finish at about the same time result in one APKINDEX write per repo.
+
+    Callbacks call request() with the apks that were added or removed, which
+    only records the change and returns. The thread waits wip_index_delay
+    seconds to collect more changes, then updates only the entries of those
+    apks (bpo.repo.apkindex.update()) and signs the APKINDEX once. Jobs
+    download the WIP APKINDEX, so bpo.repo.build_arch_branch() flushes the
+    repo once per scheduler pass before it starts jobs for it. As long as the thread is not running (e.g. before
+    bpo.main() started it, and in most tests), request() writes directly
+    instead. """
+
+import logging
+import threading
+
+import bpo.config.const
+import bpo.repo.wip
+
+thread = None
+thread_stop = None  # threading.Event of the running thread
+cond = threading.Condition()
+
+# Held while writing the APKINDEX of a WIP repo, so the thread and full
+# updates with bpo.repo.wip.update_apkindex() don't write at the same time
+lock = threading.RLock()
+
+# {(arch, branch, splitrepo): (add, remove), ...}, with sets of apk file
+# names that were added (or replaced) and removed since the last write
+pending = {}
+
+# Amount of request() calls and of APKINDEX writes that ran for them, for the
+# tests and for seeing how well requests get collapsed in the log
+count_requests = 0
+count_writes = 0
+
+
+def write(arch, branch, splitrepo, add, remove):
+    global count_writes
+
+    count_writes += 1
+    logging.debug(f"indexer: write {count_writes} (requests:"
+                  f" {count_requests})")
+    bpo.repo.wip.update_apkindex(arch, branch, splitrepo, sorted(add),
+                                 sorted(remove))
+
+
+def merge(key, add, remove):
+    """ Add changes to the pending changes of a repo. Must be called with cond
+        held.
+
+        :param key: (arch, branch, splitrepo) """
+    add_pending, remove_pending = pending.setdefault(key, (set(), set()))
+    add_pending.update(add)
+    add_pending.difference_update(remove)
+    remove_pending.update(remove)
+    remove_pending.difference_update(add)
+
+
+def request(arch, branch, splitrepo, add=None, remove=None):
+    """ Request updating the APKINDEX of a WIP repo.
+
+        :param add: file names of apks that were added or replaced
+        :param remove: file names of apks that were removed """
+    global count_requests
+
+    add = add or []
+    remove = remove or []
+    with cond:
+        count_requests += 1
+        if thread:
+            merge((arch, branch, splitrepo), add, remove)
+            cond.notify_all()
+            return
+
+    write(arch, branch, splitrepo, add, remove)
+
+
+def discard(arch, branch, splitrepo):
+    """ Drop the pending changes of a repo, because the whole repo gets
+        indexed now. Must be called with lock held. """
+    with cond:
+        pending.pop((arch, branch, splitrepo), None)
+
+
+def flush(only=None):
+    """ Write pending changes right now and return afterwards. If writing
+        fails, the changes stay pending and get written with the next flush.
+
+        :param only: list of (arch, branch, splitrepo) combinations to write
+                     (default: all) """
+    with lock:
+        with cond:
+            keys = list(pending.keys()) if only is None else only
+            changes = {key: pending.pop(key) for key in keys
+                       if key in pending}
+
+        for key, (add, remove) in changes.items():
+            try:
+                write(*key, add, remove)
+            except Exception:
+                logging.exception(f"indexer: writing APKINDEX failed: {key},"
+                                  " keeping the changes pending")
+                with cond:
+                    # Changes requested in the meantime are newer
+                    newer = pending.pop(key, None)
+                    merge(key, add, remove)
+                    if newer:
+                        merge(key, *newer)
+
+
+def run(stop_event):
+    """ Main loop of the indexer thread. """
+    while True:
+        with cond:
+            while not pending and not stop_event.is_set():
+                cond.wait()
+            if stop_event.is_set():
+                return
+
+        # Collect more changes, e.g. from other packages that finished
+        if stop_event.wait(bpo.config.const.wip_index_delay):
+            return
+
+        flush()
+
+
+def start():
+    global thread
+    global thread_stop
+
+    stop()
+    with cond:
+        thread_stop = threading.Event()
+        thread = threading.Thread(target=run, args=[thread_stop],
+                                  name="IndexerThread", daemon=True)
+        thread.start()
+
+
+def stop():
+    """ Stop the thread and write the pending changes. """
+    global thread
+
+    with cond:
+        if not thread:
+            return
+        thread_stop.set()
+        cond.notify_all()
+        thread_old = thread
+        thread = None
+
+    if thread_old is not threading.current_thread():
+        thread_old.join()
+    flush()
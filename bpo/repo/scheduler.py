@@ -0,0 +1,160 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Run bpo.repo.build() in a dedicated thread, so the API callbacks don't
+    need to wait for a whole scheduling pass before they can answer (#49).
+
+    Callbacks call wakeup(), which only marks that a pass is needed and
+    returns. Wakeups that arrive while the thread is busy get collapsed into
+    one pass. As long as the thread is not running (e.g. before bpo.main()
+    started it), wakeup() runs bpo.repo.build() directly instead. """
+
+import logging
+import threading
+
+import bpo.db
+import bpo.helpers.job
+import bpo.repo
+
+thread = None
+thread_stop = None  # threading.Event of the running thread
+cond = threading.Condition()
+
+# A pass was requested, but did not start yet
+pending = False
+
+# force_repo_update_branch values of the pending wakeups, in order
+pending_branches = []
+
+# Run bpo.helpers.job.update_status() before the pending pass
+pending_update_status = False
+
+# The thread is running a pass right now
+busy = False
+
+# Amount of wakeup() calls and of passes that ran for them, for the tests and
+# for seeing how well wakeups get collapsed in the log
+count_wakeups = 0
+count_passes = 0
+
+
+def wakeup(force_repo_update_branch=None, update_status=False):
+    """ Request a bpo.repo.build() pass. See bpo.repo._build() for the
+        force_repo_update_branch description.
+
+        :param update_status: check the job service for jobs that finished or
+                              failed before the pass. This is done in the
+                              scheduler thread, so it does not race with a
+                              pass that is starting jobs. """
+    global count_wakeups
+    global pending
+    global pending_update_status
+
+    with cond:
+        count_wakeups += 1
+        if thread:
+            pending = True
+            pending_update_status |= update_status
+            if force_repo_update_branch and \
+                    force_repo_update_branch not in pending_branches:
+                pending_branches.append(force_repo_update_branch)
+            cond.notify_all()
+            return
+
+    if update_status:
+        bpo.helpers.job.update_status()
+    bpo.repo.build(force_repo_update_branch)
+
+
+def run_pass(stop_event):
+    """ Run one pass for all wakeups that are pending right now. """
+    global count_passes
+    global pending
+    global pending_branches
+    global pending_update_status
+
+    with cond:
+        # One pass per branch that needs a forced repo update, otherwise
+        # one pass for all wakeups
+        branches = pending_branches or [None]
+        update_status = pending_update_status
+        pending = False
+        pending_branches = []
+        pending_update_status = False
+
+    with bpo.db.scope("scheduler pass"):
+        if update_status:
+            bpo.helpers.job.update_status()
+
+        for branch in branches:
+            if stop_event.is_set():
+                return
+            count_passes += 1
+            logging.debug(f"scheduler: pass {count_passes} (wakeups:"
+                          f" {count_wakeups})")
+            bpo.repo.build(branch)
+
+
+def run(stop_event):
+    """ Main loop of the scheduler thread. """
+    global busy
+
+    while True:
+        with cond:
+            while not pending and not stop_event.is_set():
+                cond.wait()
+            if stop_event.is_set():
+                return
+            busy = True
+
+        try:
+            run_pass(stop_event)
+        except Exception:
+            logging.exception("scheduler: pass failed")
+        finally:
+            with cond:
+                busy = False
+                cond.notify_all()
+
+
+def wait_idle():
+    """ Wait until all pending wakeups have been handled. This is used in the
+        testsuite, to check the result of an API call. """
+    with cond:
+        while thread and (pending or busy):
+            cond.wait()
+
+
+def start():
+    global thread
+    global thread_stop
+
+    stop()
+    with cond:
+        thread_stop = threading.Event()
+        thread = threading.Thread(target=run, args=[thread_stop],
+                                  name="SchedulerThread", daemon=True)
+        thread.start()
+
+
+def stop():
+    """ Stop the thread after the current pass. Wait for it, unless this runs
+        inside the thread (e.g. from a monkeypatched bpo.repo.build() in the
+        testsuite). """
+    global thread
+    global pending
+    global pending_branches
+    global pending_update_status
+
+    with cond:
+        if not thread:
+            return
+        thread_stop.set()
+        pending = False
+        pending_branches = []
+        pending_update_status = False
+        cond.notify_all()
+        thread_old = thread
+        thread = None
+
+    if thread_old is not threading.current_thread():
+        thread_old.join()
@@ -0,0 +1,145 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Decide how many jobs bpo.repo._build() may start for each job type, arch
+    and branch. The overall limit is bpo.config.const.max_parallel_build_jobs,
+    on top of that the optional max_parallel_jobs_* limits apply. How free
+    slots get shared between branches is configured with
+    bpo.config.const.slots_policy.
+
+    Job types are "build_package" and "build_image". repo_bootstrap jobs count
+    as "build_package", as they build packages of the same arch/branch.
+
+    sign_index jobs don't use a slot: they are what publishes a complete WIP
+    repo, so they must never wait behind queued builds. """
+
+import logging
+
+import sqlalchemy
+
+import bpo.config.const
+import bpo.db
+
+# usage[branch] = amount of jobs started for the branch since bpo was
+# started. The "fair_share" policy uses this to break ties, so branches with
+# the same weight take turns when only one slot is free.
+usage = {}
+
+
+class Slots:
+    def __init__(self, session):
+        self.total = bpo.config.const.max_parallel_build_jobs
+        self.running = 0
+        self.running_type = {}
+        self.running_arch = {}
+        self.running_branch = {}
+        # quota[branch] = how many jobs the branch may run at once, or None
+        # for no quota (see set_fair_share())
+        self.quota = None
+        self.load(session)
+
+    def load(self, session):
+        """ Count the running jobs with one query per job type. """
+        tables = [("build_package", bpo.db.Package,
+                   bpo.db.PackageStatus.building),
+                  ("build_image", bpo.db.Image,
+                   bpo.db.ImageStatus.building),
+                  ("build_package", bpo.db.RepoBootstrap,
+                   bpo.db.RepoBootstrapStatus.building)]
+
+        for job_type, table, building in tables:
+            # Images are built for devices, not for a specific arch
+            arch = getattr(table, "arch", sqlalchemy.null())
+            result = session.query(table.branch, arch,
+                                   sqlalchemy.func.count())\
+                .filter(table.status == building)\
+                .group_by(table.branch, arch)
+            for branch, arch, count in result:
+                self.add_running(job_type, branch, arch, count)
+
+    def add_running(self, job_type, branch, arch=None, count=1):
+        self.running += count
+        self.running_type[job_type] = \
+            self.running_type.get(job_type, 0) + count
+        self.running_branch[branch] = \
+            self.running_branch.get(branch, 0) + count
+        if arch:
+            self.running_arch[arch] = self.running_arch.get(arch, 0) + count
+
+    def available(self, job_type, branch, arch=None):
+        """ :returns: how many jobs of job_type may be started for the branch
+                      (and arch) right now """
+        ret = self.total - self.running
+
+        limits = [(bpo.config.const.max_parallel_jobs_type, job_type,
+                   self.running_type),
+                  (bpo.config.const.max_parallel_jobs_branch, branch,
+                   self.running_branch),
+                  (bpo.config.const.max_parallel_jobs_arch, arch,
+                   self.running_arch)]
+        for limit, key, running in limits:
+            if key in limit:
+                ret = min(ret, limit[key] - running.get(key, 0))
+
+        if self.quota is not None:
+            ret = min(ret, self.quota.get(branch, 0) -
+                      self.running_branch.get(branch, 0))
+
+        return max(0, ret)
+
+    def take(self, job_type, branch, arch=None, count=1):
+        """ Mark count slots as used, after jobs have been started. """
+        if not count:
+            return
+        self.add_running(job_type, branch, arch, count)
+        usage[branch] = usage.get(branch, 0) + count
+
+    def set_fair_share(self, branches):
+        """ Give each branch a quota of the slots, proportional to the weight
+            in its config. Free slots are handed out one by one, to the branch
+            that has the least running jobs relative to its weight.
+
+            :param branches: dict of branch: branch_data, of the branches that
+                             have jobs to start """
+        quota = {}
+        for branch in branches:
+            quota[branch] = self.running_branch.get(branch, 0)
+
+        def weight(branch):
+            return branches[branch].get("weight", 1)
+
+        def share(branch):
+            return ((quota[branch] + 1) / weight(branch),
+                    usage.get(branch, 0) / weight(branch))
+
+        for i in range(self.total - self.running):
+            if not quota:
+                break
+            branch = min(quota, key=share)
+            quota[branch] += 1
+
+        logging.info(f"slots: fair share quota: {quota}")
+        self.quota = quota
+
+    def clear_quota(self):
+        self.quota = None
+
+
+def get_branches_pending(session, branches):
+    """ :param branches: dict of branch: branch_data to consider
+        :returns: dict of branch: branch_data, of the branches that have
+                  packages or images that are waiting to be built """
+    pending = set()
+    retry_count_max = bpo.config.const.retry_count_max
+
+    for table, status_enum in [(bpo.db.Package, bpo.db.PackageStatus),
+                               (bpo.db.Image, bpo.db.ImageStatus)]:
+        result = session.query(table.branch).distinct()\
+            .filter(sqlalchemy.or_(
+                table.status == status_enum.queued,
+                sqlalchemy.and_(table.status == status_enum.failed,
+                                table.retry_count < retry_count_max)))
+        for branch, in result:
+            pending.add(branch)
+
+    return {branch: branch_data for branch, branch_data in branches.items()
+            if branch in pending}
@@ -8,6 +8,7 @@ import shutil
 
 import bpo.config
 import bpo.db
+import bpo.helpers.apk_cache
 import bpo.repo.final
 import bpo.repo.wip
 import bpo.ui
@@ -114,7 +115,7 @@ def sync_with_orig_repo(branch_staging, arch, splitrepo):
         apk_full_path_staging = f"{path_repo_staging_wip}/{apk}"
         logging.info(f"[{fmt}] syncing {apk} (db + copy: {apk_full_path_staging})")
         os.makedirs(path_repo_staging_wip, exist_ok=True)
-        shutil.copy(apk_full_path, apk_full_path_staging)
+        bpo.helpers.apk_cache.copy(apk_full_path, apk_full_path_staging)
 
         # Mark as built in DB
         # job_id set to None together with status == built/published indicates
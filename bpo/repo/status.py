@@ -4,7 +4,7 @@ import os
 import logging
 
 import bpo.db
-import bpo.helpers.apk
+import bpo.helpers.apk_cache
 import bpo.helpers.job
 import bpo.repo
 
@@ -15,18 +15,26 @@ def is_apk_broken(metadata):
     return False
 
 
-def remove_broken_apk(session, pkgname, version, arch, branch, splitrepo, apk_path):
+def remove_broken_apk(session, pkgname, version, arch, branch, splitrepo, apk_path,
+                      batch=None):
+    """
+    :param batch: bpo.db.TransitionBatch of session to add the status changes
+                  to (default: commit them right away)
+    """
+    own_batch = batch is None
+    if own_batch:
+        batch = bpo.db.TransitionBatch(session)
+
     # Remove from disk
-    bpo.ui.log("remove_broken_apk", arch=arch, branch=branch, pkgname=pkgname,
-               splitrepo=splitrepo, version=version)
+    batch.log("remove_broken_apk", arch=arch, branch=branch, pkgname=pkgname,
+              splitrepo=splitrepo, version=version)
     os.unlink(apk_path)
 
     # Reset package status to queued
     queued = bpo.db.PackageStatus.queued
     package = bpo.db.get_package(session, pkgname, arch, branch, splitrepo)
     if package and package.version == version:
-        bpo.db.set_package_status(session, package, queued)
-        bpo.ui.log_package(package, "remove_broken_apk_reset_deleted")
+        batch.set_status(package, queued, "remove_broken_apk_reset_deleted")
 
     # Reset packages depending on the deleted apk from failed to queued
     failed = bpo.db.PackageStatus.failed
@@ -37,8 +45,11 @@ def remove_broken_apk(session, pkgname, version, arch, branch, splitrepo, apk_pa
         # this is not performance critical
         if package not in package_failed.depends:
             continue
-        bpo.db.set_package_status(session, package_failed, queued)
-        bpo.ui.log_package(package_failed, "remove_broken_apk_reset_failed")
+        batch.set_status(package_failed, queued,
+                         "remove_broken_apk_reset_failed")
+
+    if own_batch:
+        bpo.ui.commit_batch(batch)
 
 
 def fix_disk_vs_db(arch, branch, splitrepo, path, status, is_wip=False, job_id=None):
@@ -61,15 +72,16 @@ def fix_disk_vs_db(arch, branch, splitrepo, path, status, is_wip=False, job_id=N
     updated = 0
 
     session = bpo.db.session()
+    batch = bpo.db.TransitionBatch(session)
     apks = bpo.repo.get_apks(path)
     for apk in apks:
-        metadata = bpo.helpers.apk.get_metadata(path + "/" + apk)
+        metadata = bpo.helpers.apk_cache.get_metadata(path + "/" + apk)
         pkgname = metadata["origin"]
         version = metadata["pkgver"]  # metadata pkgver is really full version
 
         if is_apk_broken(metadata):
             remove_broken_apk(session, pkgname, version, arch, branch, splitrepo,
-                              path + "/" + apk)
+                              path + "/" + apk, batch)
             removed += 1
             continue
 
@@ -80,17 +92,18 @@ def fix_disk_vs_db(arch, branch, splitrepo, path, status, is_wip=False, job_id=N
                 removed += 1
                 logging.warning("Removing obsolete wip package: " + apk)
                 if package:
-                    bpo.ui.log_package(package, "obsolete_wip_package")
+                    batch.log_package(package, "obsolete_wip_package")
                 else:
-                    bpo.ui.log(action="obsolete_wip_package", arch=arch,
-                               branch=branch, pkgname=pkgname, version=version,
-                               splitrepo=splitrepo)
+                    batch.log("obsolete_wip_package", arch=arch,
+                              branch=branch, pkgname=pkgname, version=version,
+                              splitrepo=splitrepo)
             continue
         if package.status != status:
-            bpo.db.set_package_status(session, package, status, job_id)
-            bpo.ui.log_package(package, "package_" + status.name)
+            batch.set_status(package, status, "package_" + status.name,
+                             job_id)
             updated += 1
 
+    bpo.ui.commit_batch(batch)
     return (removed, updated)
 
 
@@ -102,6 +115,7 @@ def fix_db_vs_disk(arch, branch, splitrepo):
     :param branch: pmaports.git branch, e.g. "main"
     """
     session = bpo.db.session()
+    batch = bpo.db.TransitionBatch(session)
     packages = session.query(bpo.db.Package).filter_by(arch=arch,
                                                        branch=branch,
                                                        splitrepo=splitrepo)
@@ -114,17 +128,17 @@ def fix_db_vs_disk(arch, branch, splitrepo):
             not os.path.exists("{}/{}-{}.apk".format(path_final,
                                                      package.pkgname,
                                                      package.version))):
-            bpo.db.set_package_status(session, package,
-                                      bpo.db.PackageStatus.built)
-            bpo.ui.log_package(package, "missing_published_apk")
+            batch.set_status(package, bpo.db.PackageStatus.built,
+                             "missing_published_apk")
 
         # Missing built packages: change to "queued"
         if (package.status == bpo.db.PackageStatus.built and
             not os.path.exists("{}/{}-{}.apk".format(path_wip, package.pkgname,
                                                      package.version))):
-            bpo.db.set_package_status(session, package,
-                                      bpo.db.PackageStatus.queued)
-            bpo.ui.log_package(package, "missing_built_apk")
+            batch.set_status(package, bpo.db.PackageStatus.queued,
+                             "missing_built_apk")
+
+    bpo.ui.commit_batch(batch)
 
 
 def fix(limit_arch=None, limit_branch=None):
@@ -8,6 +8,7 @@ import shutil
 
 import bpo.config.args
 import bpo.db
+import bpo.repo.apkindex
 import bpo.repo.final
 import bpo.repo.wip
 
@@ -44,9 +45,13 @@ def find_apk(wip, final, package):
                        " repository: " + apk)
 
 
-def link_to_all_packages(arch, branch, splitrepo, force=False):
+def link_to_all_packages(arch, branch, splitrepo, force=False,
+                         clean_wip=True):
     """ Create symlinks to new packages from WIP repo and to up-to-date
-        packages from final repo. """
+        packages from final repo.
+
+        :param clean_wip: run bpo.repo.wip.clean() first (set to False if
+                          it ran already) """
     repo_symlink = get_path(arch, branch, splitrepo)
     repo_wip = bpo.repo.wip.get_path(arch, branch, splitrepo)
     repo_final = bpo.repo.final.get_path(arch, branch, splitrepo)
@@ -61,7 +66,8 @@ def link_to_all_packages(arch, branch, splitrepo, force=False):
             find_apk(repo_wip, repo_final, package)
 
     # Remove outdated packages in WIP repo
-    bpo.repo.wip.clean(arch, branch, splitrepo)
+    if clean_wip:
+        bpo.repo.wip.clean(arch, branch, splitrepo)
 
     # Link to everything in WIP repo
     os.makedirs(repo_symlink, exist_ok=True)
@@ -76,6 +82,89 @@ def link_to_all_packages(arch, branch, splitrepo, force=False):
             os.symlink(apk_final, repo_symlink + "/" + apk)
 
 
+def get_changes(arch, branch, splitrepo, force=False):
+    """ Compare the existing symlink repo with the WIP repo and the packages
+        in the database, without looking at the apks of the final repo.
+        Symlinks to apks that are not in the WIP repo point to the final repo
+        (see bpo.repo.final.copy_new_apks()), and their origin and version is
+        taken from the APKINDEX of the symlink repo. Run bpo.repo.wip.clean()
+        before calling this.
+
+        :returns: (add, remove) with lists of apk file names: all apks of the
+                  WIP repo (to be linked if they aren't yet, their APKINDEX
+                  entries may have changed) and apks to unlink. None if the
+                  symlink repo must be created from scratch, because it does
+                  not exist, is not consistent with its APKINDEX, has
+                  symlinks to apks that are not in the WIP repo anymore
+                  (e.g. created before copy_new_apks() updated the symlinks)
+                  or does not have all packages from the database. """
+    repo_symlink = get_path(arch, branch, splitrepo)
+    repo_wip = bpo.repo.wip.get_path(arch, branch, splitrepo)
+    repo_final = os.path.realpath(bpo.repo.final.get_path(arch, branch,
+                                                          splitrepo))
+    session = bpo.db.session()
+
+    try:
+        entries = bpo.repo.apkindex.parse(repo_symlink +
+                                          "/APKINDEX.tar.gz")[1]
+    except (OSError, RuntimeError, UnicodeDecodeError, ValueError):
+        return None
+    linked = {bpo.repo.apkindex.get_apk(entry): entry for entry in entries}
+    if set(linked) != set(bpo.repo.get_apks(repo_symlink)):
+        return None
+
+    versions = bpo.db.get_package_versions(session, arch, branch, splitrepo)
+    apks_wip = set(bpo.repo.get_apks(repo_wip))
+
+    # Packages that were removed from the database or got a new version
+    remove = []
+    for apk, entry in linked.items():
+        if apk in apks_wip:
+            continue
+        if os.readlink(repo_symlink + "/" + apk) != repo_final + "/" + apk:
+            return None
+        origin = bpo.repo.apkindex.get_value(entry, "o") or \
+            bpo.repo.apkindex.get_value(entry, "P")
+        if versions.get(origin) != bpo.repo.apkindex.get_value(entry, "V"):
+            remove += [apk]
+
+    if not force:
+        apks = (set(linked) - set(remove)) | apks_wip
+        for pkgname, version in versions.items():
+            if f"{pkgname}-{version}.apk" not in apks:
+                return None
+
+    return sorted(apks_wip), sorted(remove)
+
+
+def update(arch, branch, splitrepo, force=False):
+    """ Update the existing symlink repo and its APKINDEX with the changes
+        from get_changes(). Run bpo.repo.wip.clean() before calling this.
+
+        :returns: True on success, False if the symlink repo must be created
+                  from scratch """
+    repo_symlink = get_path(arch, branch, splitrepo)
+    repo_wip = bpo.repo.wip.get_path(arch, branch, splitrepo)
+
+    changes = get_changes(arch, branch, splitrepo, force)
+    if changes is None:
+        return False
+    add, remove = changes
+
+    for apk in remove:
+        os.unlink(repo_symlink + "/" + apk)
+    for apk in add:
+        if not os.path.lexists(repo_symlink + "/" + apk):
+            apk_wip = os.path.realpath(repo_wip + "/" + apk)
+            os.symlink(apk_wip, repo_symlink + "/" + apk)
+
+    fmt = bpo.repo.fmt(arch, branch, splitrepo)
+    logging.info(f"[{fmt}] updating symlink repo: {len(add)} WIP apks,"
+                 f" {len(remove)} removed")
+    bpo.repo.tools.index(arch, branch, "symlink", repo_symlink, add, remove)
+    return True
+
+
 def sign(arch, branch, splitrepo):
     # Copy index to wip repo (just because that makes it easy to download it)
     repo_wip_path = bpo.repo.wip.get_path(arch, branch, splitrepo)
@@ -96,8 +185,13 @@ def create(arch, branch, splitrepo, force=False):
         logging.debug(f"[{fmt}] empty WIP repo, skipping creation of symlink repo")
         return
 
-    logging.info(f"[{fmt}] creating symlink repo")
-    clean(arch, branch, splitrepo)
-    link_to_all_packages(arch, branch, splitrepo, force)
-    bpo.repo.tools.index(arch, branch, "symlink", get_path(arch, branch, splitrepo))
+    # Remove outdated packages in WIP repo
+    bpo.repo.wip.clean(arch, branch, splitrepo)
+
+    if not update(arch, branch, splitrepo, force):
+        logging.info(f"[{fmt}] creating symlink repo")
+        clean(arch, branch, splitrepo)
+        link_to_all_packages(arch, branch, splitrepo, force, False)
+        bpo.repo.tools.index(arch, branch, "symlink",
+                             get_path(arch, branch, splitrepo))
     sign(arch, branch, splitrepo)
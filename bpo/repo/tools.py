@@ -11,6 +11,7 @@ import datetime
 
 import bpo.config.const
 import bpo.repo
+import bpo.repo.apkindex
 
 
 def temp_path_prepare():
@@ -63,18 +64,26 @@ def run(arch, branch, repo_name, cwd, cmd):
     subprocess.run(cmd, cwd=cwd, env=env, check=True)
 
 
-def index(arch, branch, repo_name, cwd):
+def index(arch, branch, repo_name, cwd, add=None, remove=None):
     """
-    Sign a repository.
+    Index a repository with bpo.repo.apkindex (same output as "apk.static
+    index --rewrite-arch", but only new and changed apks get read).
 
-    :param cwd: path to the repository 
+    :param cwd: path to the repository
+    :param add: file names of apks that were added or replaced
+    :param remove: file names of apks that were removed
+
+    If add or remove is set, only the entries of these apks get updated in
+    the existing APKINDEX (bpo.repo.apkindex.update()).
     """
     # aports-turbo, hosted at pkgs.postmarketos.org, uses the description to
     # check if the APKINDEX was modified. Set it to the current date to make
     # that check work.
     description = str(datetime.datetime.now(datetime.UTC))
 
-    cmd = ["apk.static", "-q", "index", "--output", "APKINDEX.tar.gz",
-           "--rewrite-arch", arch,
-           "--description", description] + bpo.repo.get_apks(cwd)
-    bpo.repo.tools.run(arch, branch, repo_name, cwd, cmd)
+    logging.debug("{}/{}: indexing {} repo".format(branch, arch, repo_name))
+    if add is None and remove is None:
+        bpo.repo.apkindex.index(cwd, arch, description)
+    else:
+        bpo.repo.apkindex.update(cwd, arch, description, add or [],
+                                 remove or [])
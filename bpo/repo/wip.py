@@ -8,6 +8,7 @@ import subprocess
 import bpo.config.const
 import bpo.repo
 import bpo.repo.final
+import bpo.repo.indexer
 import bpo.repo.staging
 
 
@@ -61,12 +62,26 @@ def sign(arch, branch, splitrepo):
     bpo.repo.tools.run(arch, branch, "WIP", get_path(arch, branch, splitrepo), cmd)
 
 
-def update_apkindex(arch, branch, splitrepo):
+def update_apkindex(arch, branch, splitrepo, add=None, remove=None):
+    """ :param add: file names of apks that were added or replaced
+        :param remove: file names of apks that were removed
+
+        If add or remove is set, only their entries get updated. Otherwise
+        the whole repository gets indexed, which includes the changes that
+        are pending in bpo.repo.indexer. """
     path = get_path(arch, branch, splitrepo)
-    if os.path.exists(path):
-        fmt = bpo.repo.fmt(arch, branch, splitrepo)
-        logging.info(f"[{fmt}] update WIP APKINDEX")
-        bpo.repo.tools.index(arch, branch, "WIP", path)
+    if not os.path.exists(path):
+        return
+
+    fmt = bpo.repo.fmt(arch, branch, splitrepo)
+    with bpo.repo.indexer.lock:
+        if add is None and remove is None:
+            logging.info(f"[{fmt}] update WIP APKINDEX")
+            bpo.repo.indexer.discard(arch, branch, splitrepo)
+        else:
+            logging.info(f"[{fmt}] update WIP APKINDEX: {len(add or [])}"
+                         f" added, {len(remove or [])} removed")
+        bpo.repo.tools.index(arch, branch, "WIP", path, add, remove)
         sign(arch, branch, splitrepo)
 
 
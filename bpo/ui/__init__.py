@@ -2,41 +2,84 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
 import collections
+import gzip
+import hashlib
 import jinja2
 import os
 import logging
 import shutil
 import threading
 from datetime import datetime
-from sqlalchemy import func
+import sqlalchemy
 
 import bpo.config.const
 import bpo.config.args
 import bpo.db
+import bpo.ui.fragments
+import bpo.ui.renderer
+import bpo.ui.snapshot
 
 env = None
 ui_update_cond = threading.Condition()
 
+# {path: hash} of the content of the last written .gz files
+written_gz = {}
+
+
+def write_output(path, content, precompress=False):
+    """ Write a file in html_out atomically.
+
+        :param path: full path to the file
+        :param content: text to write
+        :param precompress: also write a gzip compressed copy to path + ".gz",
+                            so the web server can serve it without
+                            compressing it on every request (Caddy:
+                            file_server { precompressed gzip }). It only gets
+                            compressed again when the content changed. """
+    data = content.encode("utf-8")
+
+    if precompress:
+        path_gz = path + ".gz"
+        digest = hashlib.sha256(data).hexdigest()
+        if written_gz.get(path_gz) != digest or not os.path.exists(path_gz):
+            with open(path_gz + "_", "wb") as handle:
+                handle.write(gzip.compress(data, mtime=0))
+            os.rename(path_gz + "_", path_gz)
+            written_gz[path_gz] = digest
+
+    with open(path + "_", "wb") as handle:
+        handle.write(data)
+    os.rename(path + "_", path)
+
 
 def format_retry_count(retry_count):
     return f"try {retry_count + 1}/{bpo.config.const.retry_count_max + 1}"
 
 
-def update_monitoring_txt(session, pkgs, imgs, add_footer=True,
-                          list_count_max=10):
+def format_duration(seconds):
+    """ :returns: a short human readable string like "2h 5m" """
+    minutes = round(seconds / 60)
+    if minutes < 1:
+        return "<1m"
+    if minutes < 60:
+        return f"{minutes}m"
+    return f"{minutes // 60}h {minutes % 60}m"
+
+
+def update_monitoring_txt(snapshot, add_footer=True, list_count_max=10):
     """
     Update html_out/monitoring.txt. The postmarketOS infrastructure
     monitoring will parse this file and send a message into a matrix room
     when there are failures.
 
-    :param session: return value of bpo.db.session()
-    :param pkgs: return value of bpo.db.get_recent_packages_by_status()
-    :param imgs: return value of bpo.db.get_recent_images_by_status()
+    :param snapshot: bpo.ui.snapshot.StatusSnapshot
     :param add_footer: if NOK, add footer with links to related issues/MRs
     :param list_count_max: how many entries to display with log links
     """
+    pkgs = snapshot.pkgs
+    imgs = snapshot.imgs
     txt = ""
-    nok_count = len(pkgs["failed"]) + imgs["failed"].count()
+    nok_count = len(pkgs["failed"]) + len(imgs["failed"])
     if nok_count:
         txt = f"{nok_count} failure"
         if nok_count > 1:
@@ -80,25 +123,14 @@ def update_monitoring_txt(session, pkgs, imgs, add_footer=True,
     os.rename(output_temp, output)
 
 
-def update_badge(session, pkgs, imgs):
+def update_badge(snapshot):
     """
     Update html_out/badge.svg
 
-    :param session: return value of bpo.db.session()
-    :param pkgs: return value of bpo.db.get_recent_packages_by_status()
-    :param imgs: return value of bpo.db.get_recent_images_by_status()
+    :param snapshot: bpo.ui.snapshot.StatusSnapshot
     :returns: one of: "up-to-date", "failed", "building"
     """
-    # Get new name
-    new = "up-to-date"
-    if bpo.db.get_failed_packages_count_relevant(session) \
-            or imgs["failed"].count():
-        new = "failed"
-    elif len(pkgs["building"]) \
-            or imgs["building"].count() \
-            or len(pkgs["queued"]) \
-            or imgs["queued"].count():
-        new = "building"
+    new = snapshot.badge
 
     # Copy to output dir
     source = f"{bpo.config.const.top_dir}/data/static/badges/{new}.svg"
@@ -111,13 +143,17 @@ def update_badge(session, pkgs, imgs):
 
 
 def log_entries_by_day(session):
-    """ :returns: {"2019-01-01": [a, b, ...], "2019-01-02": [c, d, ...], ... } a, b, c, d: bpo.db.Log objects
+    """ :returns: {"2019-01-01": [a, b, ...], "2019-01-02": [c, d, ...], ... } a, b, c, d: bpo.db.LogRow
 
     """
-    entries = session.query(bpo.db.Log).order_by(bpo.db.Log.id.desc()
-                                                 ).limit(50)
+    Log = bpo.db.Log
+    stmt = sqlalchemy.select(*[getattr(Log, field)
+                               for field in bpo.db.LogRow._fields])\
+        .where(Log.date >= bpo.db.get_log_hot_window_start())\
+        .order_by(Log.id.desc()).limit(50)
     ret = collections.OrderedDict()
-    for entry in entries:
+    for entry in session.execute(stmt):
+        entry = bpo.db.LogRow(*entry)
         day = entry.date.strftime("%Y-%m-%d")
         if day not in ret:
             ret[day] = []
@@ -131,54 +167,53 @@ def commit_link(commit):
     return f"<a href='{url}' class='commit'>{short}</a>"
 
 
-def update_index(session, pkgs, imgs, badge_name):
+def update_index(snapshot):
     """
     Update html_out/index.html
 
-    :param session: return value of bpo.db.session()
-    :param pkgs: return value of bpo.db.get_recent_packages_by_status()
-    :param imgs: return value of bpo.db.get_recent_images_by_status()
-    :param badge_name: return value of update_badge()
+    :param snapshot: bpo.ui.snapshot.StatusSnapshot
     """
-    # Query information from DB
-    log_entries_days = log_entries_by_day(session)
-    pkgcount = session.query(func.count(bpo.db.Package.id)).scalar()
-    imgcount = session.query(func.count(bpo.db.Image.id)).scalar()
-
-    # Fill template
+    # Fill template, with the package lists from the cached fragments
     global env
     template = env.get_template("index.html")
+    fragments = bpo.ui.fragments.render_all(snapshot)
     year = datetime.now().date().strftime("%Y")
     html = template.render(bpo=bpo,
                            commit_link=commit_link,
-                           pkgcount=pkgcount,
-                           pkgs=pkgs,
-                           imgcount=imgcount,
-                           imgs=imgs,
+                           pkgcount=snapshot.pkgcount,
+                           pkgs=snapshot.pkgs,
+                           imgcount=snapshot.imgcount,
+                           imgs=snapshot.imgs,
                            len=len,
-                           log_entries_days=log_entries_days,
-                           badge_name=badge_name,
+                           log_entries_days=snapshot.log_entries_days,
+                           stuck=snapshot.stuck,
+                           eta=snapshot.eta,
+                           fragments=fragments,
+                           format_duration=format_duration,
+                           badge_name=snapshot.badge,
                            year=year)
 
     # Write to output dir
-    output = bpo.config.args.html_out + "/index.html"
-    output_temp = output + "_"
-    with open(output_temp, "w") as handle:
-        handle.write(html)
-    os.rename(output_temp, output)
+    write_output(bpo.config.args.html_out + "/index.html", html, True)
 
 
 def update(session):
-    """ Update everything in html_out """
+    """ Update everything in html_out. This only marks the output as dirty
+        while the renderer thread is running, see bpo/ui/renderer.py. """
+    bpo.ui.renderer.request(session)
+
+
+def render(session):
+    """ Render everything in html_out now, from one StatusSnapshot """
     global ui_update_cond
 
-    pkgs = bpo.db.get_recent_packages_by_status(session)
-    imgs = bpo.db.get_recent_images_by_status(session)
+    snapshot = bpo.ui.snapshot.get(session)
 
     with ui_update_cond:
-        badge_name = update_badge(session, pkgs, imgs)
-        update_index(session, pkgs, imgs, badge_name)
-        update_monitoring_txt(session, pkgs, imgs)
+        update_badge(snapshot)
+        update_index(snapshot)
+        update_monitoring_txt(snapshot)
+        bpo.ui.snapshot.publish(snapshot)
 
 
 def copy_static():
@@ -206,6 +241,10 @@ def init():
     loader = jinja2.FileSystemLoader(templates_dir)
     autoescape = jinja2.select_autoescape(["html", "xml"])
     env = jinja2.Environment(loader=loader, autoescape=autoescape)
+    bpo.ui.fragments.reset()
+    bpo.ui.snapshot.latest = None
+    bpo.ui.snapshot.latest_json = None
+    written_gz.clear()
 
     os.makedirs(bpo.config.args.html_out, exist_ok=True)
     copy_static()
@@ -216,11 +255,20 @@ def log(*args, **kwargs):
         meaningful changes to the database, e.g. after a job callback was
         executed. See bpo.db.Log.__init__() for the list of parameters.
 
-        NOTE: Make sure that you have committed all changes to any open
-              sessions (run session.commit() after doing changes), otherwise
-              you will get a "database is locked" error.
+        Inside a scope (bpo.db.scope_begin()), this commits the changes of
+        the scope's session together with the log message. Outside of a
+        scope, make sure that you have committed all changes to any open
+        sessions (run session.commit() after doing changes), otherwise you
+        will get a "database is locked" error.
+
+        Don't call this inside of bpo.db.unit_of_work(), the commit would
+        end the unit of work early.
 
         """
+    if bpo.db.in_unit_of_work():
+        raise RuntimeError("bpo.ui.log() must not be called inside of"
+                           " bpo.db.unit_of_work(), it would commit the"
+                           " changes of the unit of work")
     msg = bpo.db.Log(*args, **kwargs)
     session = bpo.db.session()
     session.add(msg)
@@ -228,6 +276,13 @@ def log(*args, **kwargs):
     update(session)
 
 
+def commit_batch(batch):
+    """ Commit a bpo.db.TransitionBatch and update the output once, if it
+        had any log entries. """
+    if batch.commit():
+        update(batch.session)
+
+
 def log_package(package, action, depend_pkgname=None, commit=None):
     """
     Convenience wrapper
@@ -0,0 +1,79 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Render the package lists of index.html in fragments, one per status and
+    branch/arch/splitrepo. Each fragment is cached with a hash of its rows
+    (bpo.db.PackageRow tuples) and only gets rendered again when the hash
+    changes, so when one package of one arch changes, the lists of all other
+    arches don't get rendered again. """
+
+import collections
+import hashlib
+
+import bpo.config.const
+import bpo.helpers.job
+import bpo.ui
+
+# Statuses with package lists in bpo.ui.snapshot.StatusSnapshot.pkgs
+statuses = ["building", "failed", "queued"]
+
+# {(status, branch, arch, splitrepo): (hash, html)}
+cache = {}
+
+# Amount of rendered fragments, for the tests
+count_renders = 0
+
+
+def get_hash(rows):
+    """ :param rows: list of bpo.db.PackageRow
+        :returns: hash of the content of rows """
+    return hashlib.sha256(repr(rows).encode("utf-8")).hexdigest()
+
+
+def group(packages):
+    """ :param packages: list of bpo.db.PackageRow
+        :returns: {(branch, arch, splitrepo): [package, ...], ...} sorted by
+                  the keys, the packages keep their order """
+    ret = collections.OrderedDict()
+    for package in packages:
+        key = (package.branch, package.arch, package.splitrepo or "")
+        ret.setdefault(key, []).append(package)
+    return collections.OrderedDict(sorted(ret.items()))
+
+
+def render(status, packages):
+    """ :param status: one of statuses
+        :param packages: list of bpo.db.PackageRow with status
+        :returns: html of the list entries for all packages """
+    global count_renders
+
+    ret = ""
+    keys = set()
+    for (branch, arch, splitrepo), rows in group(packages).items():
+        key = (status, branch, arch, splitrepo)
+        keys.add(key)
+        digest = get_hash(rows)
+        if key not in cache or cache[key][0] != digest:
+            template = bpo.ui.env.get_template("fragments/packages.html")
+            html = template.render(bpo=bpo, status=status, packages=rows)
+            cache[key] = (digest, html)
+            count_renders += 1
+        ret += cache[key][1]
+
+    # Drop fragments of branches/arches that have no packages left
+    for key in list(cache.keys()):
+        if key[0] == status and key not in keys:
+            del cache[key]
+
+    return ret
+
+
+def render_all(snapshot):
+    """ :param snapshot: bpo.ui.snapshot.StatusSnapshot
+        :returns: {"building": html, "failed": html, "queued": html} """
+    return {status: render(status, snapshot.pkgs[status])
+            for status in statuses}
+
+
+def reset():
+    """ Drop all cached fragments, e.g. after the templates changed. """
+    cache.clear()
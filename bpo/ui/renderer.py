@@ -0,0 +1,154 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Render html_out in a dedicated thread, so a burst of log messages (e.g.
+    from many API callbacks in a row) doesn't render everything again for
+    each message.
+
+    bpo.ui.update() calls request(), which only marks the output as dirty and
+    returns. The thread renders at most once per ui_render_interval, all
+    requests that arrived in the meantime get collapsed into that render. As
+    long as the thread is not running (e.g. before bpo.main() started it, and
+    in most tests), request() renders directly instead. """
+
+import logging
+import threading
+import time
+
+import bpo.config.const
+import bpo.db
+import bpo.ui
+
+thread = None
+thread_stop = None  # threading.Event of the running thread
+cond = threading.Condition()
+
+# The output needs to be rendered again
+dirty = False
+
+# A render is running right now (in the thread or in flush())
+busy = False
+
+# time.monotonic() of the last render
+last_render = 0
+
+# Amount of request() calls and of renders that ran for them, for the tests
+# and for seeing how well requests get collapsed in the log
+count_requests = 0
+count_renders = 0
+
+
+def render(session=None):
+    """ Render everything in html_out now. """
+    global count_renders
+
+    count_renders += 1
+    logging.debug(f"renderer: render {count_renders} (requests:"
+                  f" {count_requests})")
+    if session:
+        bpo.ui.render(session)
+        return
+    with bpo.db.scope("ui render"):
+        bpo.ui.render(bpo.db.session())
+
+
+def request(session):
+    """ Request rendering html_out.
+
+        :param session: used for rendering directly, if the thread is not
+                        running """
+    global count_requests
+    global dirty
+
+    with cond:
+        count_requests += 1
+        if thread:
+            dirty = True
+            cond.notify_all()
+            return
+
+    render(session)
+
+
+def render_pending(session=None):
+    """ Render if dirty, unless a render is running already. Must be called
+        with cond held, releases it while rendering.
+
+        :returns: True if it rendered """
+    global busy
+    global dirty
+    global last_render
+
+    if busy or not dirty:
+        return False
+
+    dirty = False
+    busy = True
+    cond.release()
+    try:
+        render(session)
+    except Exception:
+        logging.exception("renderer: render failed")
+    finally:
+        cond.acquire()
+        busy = False
+        last_render = time.monotonic()
+        cond.notify_all()
+    return True
+
+
+def run(stop_event):
+    """ Main loop of the renderer thread. """
+    while True:
+        with cond:
+            while not dirty and not stop_event.is_set():
+                cond.wait()
+            if stop_event.is_set():
+                return
+
+        # Collect more requests until the interval has passed
+        wait = last_render + bpo.config.const.ui_render_interval - \
+            time.monotonic()
+        if wait > 0 and stop_event.wait(wait):
+            return
+
+        with cond:
+            render_pending()
+
+
+def flush(session=None):
+    """ Render pending changes right now (or wait for the running render, if
+        it was started after the last request) and return afterwards. This is
+        used in the testsuite and when shutting down. """
+    with cond:
+        while busy:
+            cond.wait()
+        render_pending(session)
+
+
+def start():
+    global thread
+    global thread_stop
+
+    stop()
+    with cond:
+        thread_stop = threading.Event()
+        thread = threading.Thread(target=run, args=[thread_stop],
+                                  name="RendererThread", daemon=True)
+        thread.start()
+
+
+def stop():
+    """ Stop the thread and render the pending changes. """
+    global thread
+
+    with cond:
+        if not thread:
+            return
+        thread_stop.set()
+        cond.notify_all()
+        thread_old = thread
+        thread = None
+
+    if thread_old is not threading.current_thread():
+        thread_old.join()
+    flush()
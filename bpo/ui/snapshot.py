@@ -0,0 +1,178 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Collect everything that the status page, the badge and monitoring.txt
+    show in one immutable StatusSnapshot, with a fixed small number of
+    queries. The renderers in bpo/ui/__init__.py only read from the snapshot,
+    and the same snapshot gets written to html_out/status.json for machine
+    consumers. """
+
+import collections
+import hashlib
+import json
+import types
+
+import sqlalchemy
+
+import bpo.config.args
+import bpo.config.const
+import bpo.db
+import bpo.repo.depgraph
+import bpo.repo.eta
+import bpo.ui
+
+StatusSnapshot = collections.namedtuple("StatusSnapshot", [
+    "date",  # UTC, when the snapshot was taken
+    "pkgs",  # bpo.db.get_recent_packages_by_status()
+    "imgs",  # {"failed": (bpo.db.ImageRow, ...), "building": ..., ...}
+    "pkgcount",  # all packages (all time)
+    "imgcount",  # all images (all time)
+    "failed_relevant",  # failed packages in branches without ignore_errors
+    "log_entries_days",  # {"2019-01-01": (bpo.db.LogRow, ...), ...}
+    "stuck",  # bpo.repo.depgraph.get_stuck_all()
+    "eta",  # bpo.repo.eta.get_all()
+    "badge",  # "up-to-date", "failed" or "building"
+])
+
+# The snapshot serialized as json, with the metadata for HTTP caching
+JsonExport = collections.namedtuple("JsonExport", [
+    "data",  # json string
+    "etag",  # hash of the content, without the date
+    "date",  # UTC, when the content last changed
+])
+
+# Snapshot of the last render and its JsonExport, see publish(). The API
+# serves latest_json from memory, without touching the database.
+latest = None
+latest_json = None
+
+
+def freeze(value):
+    """ :returns: read-only copy of nested dicts and lists """
+    if isinstance(value, dict):
+        return types.MappingProxyType({key: freeze(item)
+                                       for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def get_failed_relevant(pkgs):
+    """ :returns: count of failed packages, without the branches where
+                  ignore_errors is set (it's always set for staging branches,
+                  and usually for branches we build for the first time as we
+                  prepare a new release) """
+    relevant = [branch for branch, branch_data
+                in bpo.config.const.branches.items()
+                if not branch_data.get("ignore_errors")]
+    return len([package for package in pkgs["failed"]
+                if package.branch in relevant
+                and package.pkgname != "[repo_bootstrap]"])
+
+
+def get_badge(pkgs, imgs, failed_relevant):
+    """ :returns: one of: "up-to-date", "failed", "building" """
+    if failed_relevant or imgs["failed"]:
+        return "failed"
+    if pkgs["building"] or imgs["building"] or pkgs["queued"] \
+            or imgs["queued"]:
+        return "building"
+    return "up-to-date"
+
+
+def get(session):
+    """ :returns: StatusSnapshot of the current state """
+    func = sqlalchemy.func
+    pkgs = bpo.db.get_recent_packages_by_status(session)
+    imgs = bpo.db.get_recent_images_by_status(session)
+    failed_relevant = get_failed_relevant(pkgs)
+
+    return StatusSnapshot(
+        date=bpo.db.utcnow(),
+        pkgs=freeze(pkgs),
+        imgs=freeze(imgs),
+        pkgcount=session.query(func.count(bpo.db.Package.id)).scalar(),
+        imgcount=session.query(func.count(bpo.db.Image.id)).scalar(),
+        failed_relevant=failed_relevant,
+        log_entries_days=freeze(bpo.ui.log_entries_by_day(session)),
+        stuck=freeze(bpo.repo.depgraph.get_stuck_all()),
+        eta=freeze(bpo.repo.eta.get_all(session)),
+        badge=get_badge(pkgs, imgs, failed_relevant))
+
+
+def get_repos(pkgs):
+    """ :param pkgs: StatusSnapshot.pkgs
+        :returns: list of package counts for each branch/arch/splitrepo, that
+                  has building, failed or queued packages """
+    counts = {}
+    statuses = ["building", "failed", "queued"]
+    for status in statuses:
+        for package in pkgs[status]:
+            key = (package.branch, package.arch, package.splitrepo)
+            if key not in counts:
+                counts[key] = {status: 0 for status in statuses}
+            counts[key][status] += 1
+
+    return [dict(branch=branch, arch=arch, splitrepo=splitrepo, **count)
+            for (branch, arch, splitrepo), count
+            in sorted(counts.items(), key=lambda item: (item[0][0],
+                                                        item[0][1],
+                                                        item[0][2] or ""))]
+
+
+def to_dict(snapshot):
+    """ :returns: the snapshot as dict that can be serialized as json (without
+                  the date, see publish()) """
+    def entries(value):
+        return [{key: item.isoformat() if key == "date" else item
+                 for key, item in entry._asdict().items()}
+                for entry in value]
+
+    pkgs = {}
+    for status, value in snapshot.pkgs.items():
+        if isinstance(value, tuple):
+            value = entries(value)
+        elif isinstance(value, types.MappingProxyType):
+            value = {branch: dict(arches) for branch, arches in value.items()}
+        pkgs[status] = value
+
+    return {"badge": snapshot.badge,
+            "failed_relevant": snapshot.failed_relevant,
+            "pkgcount": snapshot.pkgcount,
+            "imgcount": snapshot.imgcount,
+            "repos": get_repos(snapshot.pkgs),
+            "pkgs": pkgs,
+            "imgs": {status: entries(value)
+                     for status, value in snapshot.imgs.items()},
+            "stuck": [{"arch": arch, "branch": branch, "splitrepo": splitrepo,
+                       "roots": list(roots)}
+                      for arch, branch, splitrepo, roots in snapshot.stuck],
+            "eta": [{"branch": branch, "arch": arch, "seconds": seconds}
+                    for (branch, arch), seconds in snapshot.eta.items()]}
+
+
+def get_json_export(snapshot):
+    """ :returns: JsonExport of snapshot. The date is only taken from the
+                  snapshot if the content changed since latest_json. """
+    content = to_dict(snapshot)
+    etag = hashlib.sha256(json.dumps(content, sort_keys=True)
+                          .encode("utf-8")).hexdigest()[:32]
+
+    date = snapshot.date
+    if latest_json and latest_json.etag == etag:
+        date = latest_json.date
+
+    content["date"] = date.isoformat()
+    return JsonExport(json.dumps(content, separators=(",", ":")), etag, date)
+
+
+def publish(snapshot):
+    """ Write html_out/status.json (and status.json.gz) and make the snapshot
+        available as latest and latest_json. """
+    global latest
+    global latest_json
+
+    export = get_json_export(snapshot)
+    bpo.ui.write_output(bpo.config.args.html_out + "/status.json",
+                        export.data, True)
+    latest = snapshot
+    latest_json = export
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Replay a get-depends payload through the bpo scheduler with simulated
+    jobs, and print makespan, slot utilisation and the cost of the
+    scheduling passes (see bpo/job_services/sim.py). Run it before and after
+    changing the scheduler to compare the numbers. """
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+
+# Add topdir to import path
+topdir = os.path.realpath(os.path.join(os.path.dirname(__file__) + "/.."))
+sys.path.insert(0, topdir)
+
+# Use "noqa" to ignore "E402 module level import not at top of file"
+import bpo  # noqa
+import bpo.config.args  # noqa
+import bpo.config.const  # noqa
+import bpo.config.tokens  # noqa
+import bpo.db  # noqa
+import bpo.job_services.sim  # noqa
+import bpo.repo.wip  # noqa
+import bpo.ui  # noqa
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    payload = parser.add_mutually_exclusive_group()
+    payload.add_argument("-p", "--payload", help="get-depends payload to"
+                         " replay (default: test/testdata/depends.x86_64.json)",
+                         default=f"{topdir}/test/testdata/depends.x86_64.json")
+    payload.add_argument("-g", "--generate", type=int, metavar="COUNT",
+                         help="replay a generated payload with COUNT packages"
+                         " instead")
+    parser.add_argument("-a", "--arches", default="x86_64",
+                        help="comma separated list of arches, that all get the"
+                        " same payload (default: x86_64)")
+    parser.add_argument("-d", "--durations", help="take build durations from a"
+                        " bpo database (build_stats table) or from a json file"
+                        " with pkgname: seconds (default: synthetic)")
+    parser.add_argument("-j", "--slots", type=int,
+                        default=bpo.config.const.max_parallel_build_jobs,
+                        help="max_parallel_build_jobs (default: %(default)s)")
+    parser.add_argument("-o", "--build-order",
+                        default=bpo.config.const.build_order,
+                        choices=["critical_path", "database"],
+                        help="default: %(default)s")
+    parser.add_argument("-s", "--seed", type=int, default=0,
+                        help="for generated payloads and synthetic durations")
+    parser.add_argument("-m", "--median", type=int, default=300,
+                        help="median of the synthetic durations in seconds"
+                        " (default: %(default)s)")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser.parse_args()
+
+
+def get_durations(path):
+    if not path:
+        return {}
+    if path.endswith(".json"):
+        with open(path) as handle:
+            return json.load(handle)
+
+    conn = sqlite3.connect(path)
+    result = conn.execute("SELECT name, duration_avg FROM build_stats"
+                          " WHERE job_name = 'build_package'")
+    return {name: duration for name, duration in result}
+
+
+def init(temp_dir):
+    """ Initialize bpo with all paths in temp_dir, so the simulation does not
+        touch the data of a local bpo instance. The test tokens are used, as
+        the callbacks are sent from inside this process. """
+    sys.argv = ["bpo.py",
+                "-t", f"{topdir}/test/test_tokens.cfg",
+                "-d", f"{temp_dir}/bpo.db",
+                "-i", f"{temp_dir}/images",
+                "-o", f"{temp_dir}/html_out",
+                "-r", f"{temp_dir}/repo_final",
+                "-w", f"{temp_dir}/repo_wip",
+                "--temp-path", f"{temp_dir}/temp",
+                "--mirror", "",
+                "local"]
+    bpo.config.args.init()
+    bpo.config.tokens.init()
+    bpo.db.init()
+    bpo.repo.wip.do_keygen()
+    bpo.ui.init()
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else
+                        logging.WARNING, stream=sys.stdout,
+                        format="%(message)s")
+
+    if args.generate:
+        payload = bpo.job_services.sim.generate_payload(args.generate,
+                                                        args.seed)
+    else:
+        with open(args.payload) as handle:
+            payload = json.load(handle)
+    payloads = {arch: payload for arch in args.arches.split(",")}
+
+    bpo.config.const.max_parallel_build_jobs = args.slots
+    bpo.config.const.build_order = args.build_order
+
+    with tempfile.TemporaryDirectory(prefix="bpo_sim_") as temp_dir:
+        init(temp_dir)
+        js = bpo.job_services.sim.SimJobService(get_durations(args.durations),
+                                                args.seed, args.median)
+        report = bpo.job_services.sim.Simulation(payloads, "main", js).run()
+
+    print(bpo.job_services.sim.format_report(report), end="")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
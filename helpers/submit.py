@@ -62,8 +62,10 @@ headers = {"X-BPO-Arch": os.environ["BPO_ARCH"],
            "X-BPO-Ui": os.environ["BPO_UI"],
            "X-BPO-Version": os.environ["BPO_VERSION"]}
 
-# The server may take long to answer (#49). Hack for the testsuite until this
-# is resolved: set a timeout and ignore the ReadTimeout exception
+# The server used to take long to answer (#49), API callbacks now only wake up
+# the scheduler thread (bpo/repo/scheduler.py). The testsuite still sets a
+# timeout and ignores the ReadTimeout exception, so a slow callback can't block
+# the local job service.
 timeout_connect = float(os.environ.get("BPO_TIMEOUT_CONNECT", 0)) or None
 timeout_read = float(os.environ.get("BPO_TIMEOUT_READ", 0)) or None
 timeout = (timeout_connect, timeout_read)
@@ -1,12 +1,15 @@
 # Copyright 2022 Oliver Smith
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
+import gzip
+import io
 import logging
 import os
 import queue
 import shutil
 import subprocess
 import sys
+import tarfile
 import threading
 import traceback
 import werkzeug.serving
@@ -54,6 +57,7 @@ def reset():
 
     paths = [bpo.config.const.args.db_path,
              bpo.config.const.args.html_out,
+             bpo.config.const.args.apk_cache_path,
              bpo.config.const.args.images_path,
              bpo.config.const.args.temp_path,
              bpo.config.const.args.repo_final_path,
@@ -249,6 +253,54 @@ def is_same_file(path_a, path_b):
     with open(path_a, "rb") as f1, open(path_b, "rb") as f2:
         return f1.read() == f2.read()
 
+
+def tar_segment(files, cut=True):
+    """ :param files: dict of name: content
+        :param cut: leave out the end of archive blocks (abuild-tar --cut)
+        :returns: gzip compressed tar archive """
+    ret = io.BytesIO()
+    for name, content in files.items():
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        ret.write(info.tobuf(format=tarfile.GNU_FORMAT))
+        ret.write(content + bytes(-len(content) % 512))
+    if not cut:
+        ret.write(bytes(1024))
+    return gzip.compress(ret.getvalue(), compresslevel=1)
+
+
+def fake_apk(path, i):
+    """ Write an unsigned apk with various .PKGINFO fields, depending on i """
+    pkginfo = ("# Generated by abuild 3.9.0-r0\n"
+               f"pkgname = test{i}\n"
+               f"pkgver = 1.{i}-r0\n"
+               f"pkgdesc = Test package {i}\n"
+               "url = https://postmarketos.org\n"
+               f"builddate = {1600000000 + i}\n"
+               f"size = {i * 4096}\n"
+               "arch = x86_64\n"
+               f"origin = test{i % 7}\n"
+               f"commit = {'' if i % 5 == 0 else 'f' * 40}\n"
+               "maintainer = Test <test@postmarketos.org>\n"
+               "license = MIT\n")
+    if i % 3 == 0:
+        pkginfo += (f"provides = cmd:test{i}=1.{i}-r0\n"
+                    f"provides = so:libtest{i}.so.1=1\n")
+    if i % 4 == 0:
+        pkginfo += ("depend = so:libc.musl-x86_64.so.1\n"
+                    "depend = !conflict\n"
+                    "depend = hello-world>=1\n")
+    if i % 9 == 0:
+        pkginfo += ("install_if = test1 test2=1.2-r0\n"
+                    "provider_priority = 10\n")
+
+    apk = f"{path}/test{i}-1.{i}-r0.apk"
+    with open(apk, "wb") as handle:
+        handle.write(tar_segment({".PKGINFO": pkginfo.encode("utf-8")}))
+        handle.write(tar_segment({"usr/bin/test": os.urandom(100)}, False))
+    return apk
+
+
 def init_components():
     """Initialize the config, logging, etc. - use this when you get errors like
        "AttributeError: module 'bpo.config.args' has no attribute 'repo_wip_path'"
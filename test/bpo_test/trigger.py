@@ -2,7 +2,10 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
 import bpo.config.const
+import bpo.repo.indexer
+import bpo.repo.scheduler
 import bpo.repo.staging
+import bpo.ui.renderer
 import bpo_test
 
 import json
@@ -52,6 +55,12 @@ def api_request(path, headers={}, payload=None, files=None, background=False):
     if not ret.ok:
         bpo_test.stop_server_nok()
 
+    # Let the test check the result of the scheduling pass, that the request
+    # may have triggered, and the html output
+    bpo.repo.scheduler.wait_idle()
+    bpo.repo.indexer.flush()
+    bpo.ui.renderer.flush()
+
 
 def push_hook_gitlab(branch="main", background=False, after="deadbeef"):
     token = bpo.config.const.test_tokens["push_hook_gitlab"]
@@ -2,12 +2,22 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 """ Testing bpo/db/__init__.py """
 import datetime
+import flask
+import logging
 import pytest
+import sqlalchemy
 import sys
+import time
+import tracemalloc
 
 import bpo_test
 import bpo_test.trigger
+import bpo.api
+import bpo.api.job_callback.get_depends
+import bpo.job_services.sim
+import bpo.jobs.get_depends
 import bpo.repo
+import bpo.ui
 
 
 def test_validate_job_id(monkeypatch):
@@ -82,6 +92,125 @@ def test_get_recent_packages_by_status(monkeypatch):
     assert q[2].branch == "v23.06"
 
 
+def test_get_recent_packages_by_status_counts(monkeypatch):
+    """ Built and published packages only get counted, without loading them
+        as Package objects. """
+    monkeypatch.setattr(bpo.config.const, "branches", {"main": {}})
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+
+    session = bpo.db.session()
+    statuses = {"published": 5000, "built": 30, "failed": 2, "queued": 3}
+    for status, count in statuses.items():
+        for i in range(count):
+            arch = "x86_64" if i % 2 else "aarch64"
+            package = bpo.db.Package(arch, "main", f"{status}-{i}", "1-r0")
+            package.status = bpo.db.PackageStatus[status]
+            package.job_id = 1337 if i % 3 == 0 else None
+            session.add(package)
+    session.commit()
+
+    loaded = []
+
+    def on_load(target, context):
+        loaded.append(target.status)
+
+    sqlalchemy.event.listen(bpo.db.Package, "load", on_load)
+    try:
+        ret = bpo.db.get_recent_packages_by_status(bpo.db.session())
+    finally:
+        sqlalchemy.event.remove(bpo.db.Package, "load", on_load)
+
+    # No Package objects at all, the lists are bpo.db.PackageRow
+    assert loaded == []
+    assert [len(ret["queued"]), len(ret["failed"]), len(ret["building"])] \
+        == [3, 2, 0]
+    assert ret["published"] == 5000
+    assert ret["built"] == 30
+    assert ret["built_by_bpo"] == {"main": {"aarch64": 5, "x86_64": 5}}
+    assert ret["built_synced"] == {"main": {"aarch64": 10, "x86_64": 10}}
+    assert sum(ret["published_by_bpo"]["main"].values()) == 1667
+    assert sum(ret["published_synced"]["main"].values()) == 3333
+
+
+def test_get_recent_packages_by_status_benchmark(monkeypatch):
+    """ Compare memory and SQL statements of get_recent_packages_by_status()
+        with the ORM path it replaced (Package objects, missing depends
+        through the lazy loaded Package.depends relationship). The durations
+        only get logged, they depend too much on the machine. """
+    monkeypatch.setattr(bpo.config.const, "branches", {"main": {}})
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+
+    session = bpo.db.session()
+    payload = bpo.job_services.sim.generate_payload(3000)
+    func = bpo.api.job_callback.get_depends
+    func.update_or_insert_packages(session, payload, "x86_64", "main")
+    func.update_package_depends(session, payload, "x86_64", "main")
+    session.commit()
+
+    def orm_path(session):
+        ret = {}
+        for status in ["queued", "building", "failed"]:
+            ret[status] = session.query(bpo.db.Package)\
+                .filter_by(status=bpo.db.PackageStatus[status])\
+                .order_by(bpo.db.Package.branch, bpo.db.Package.arch,
+                          bpo.db.Package.pkgname).all()
+        rows = {}
+        for status, packages in ret.items():
+            rows[status] = [(package.pkgname, package.version,
+                             tuple(depend.pkgname for depend
+                                   in package.depends_missing_list()))
+                            for package in packages]
+        return rows
+
+    def rows_path(session):
+        ret = bpo.db.get_recent_packages_by_status(session)
+        return {status: [(package.pkgname, package.version,
+                          tuple(package.depends_missing))
+                         for package in ret[status]]
+                for status in ["queued", "building", "failed"]}
+
+    statements = []
+
+    def count(*args, **kwargs):
+        statements.append(True)
+
+    def measure(func):
+        session = bpo.db.session()
+        statements.clear()
+        sqlalchemy.event.listen(bpo.db.engine, "before_cursor_execute", count)
+        tracemalloc.start()
+        start = time.perf_counter()
+        ret = func(session)
+        duration = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        sqlalchemy.event.remove(bpo.db.engine, "before_cursor_execute", count)
+        session.close()
+        return ret, duration, peak, len(statements)
+
+    ret_orm, duration_orm, peak_orm, statements_orm = measure(orm_path)
+    ret, duration, peak, statements_rows = measure(rows_path)
+    logging.info(f"benchmark: {len(payload)} queued packages:"
+                 f" ORM {duration_orm:.2f}s, {peak_orm / 1024:.0f} KiB,"
+                 f" {statements_orm} SQL statements;"
+                 f" rows {duration:.2f}s, {peak / 1024:.0f} KiB,"
+                 f" {statements_rows} SQL statements")
+
+    assert len(ret["queued"]) == len(payload)
+    assert ret == ret_orm
+    assert peak < peak_orm / 2
+
+    # No lazy loads: the amount of statements doesn't grow with the packages
+    assert statements_orm > len(payload)
+    assert statements_rows <= 10
+
+
 def test_get_recent_images_by_status(monkeypatch):
     monkeypatch.setattr(bpo.config.const, "branches",
                         {"v22.12": {},
@@ -110,7 +239,151 @@ def test_get_recent_images_by_status(monkeypatch):
     q = bpo.db.get_recent_images_by_status(session)["queued"]
 
     # Verify that old images (by date, and the v22.06 image) don't get returned
-    assert q.count() == 3
+    assert len(q) == 3
     assert q[0].branch == "main"
     assert q[1].branch == "v22.12"
     assert q[2].branch == "v23.06"
+
+
+def test_build_attempt(monkeypatch):
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+    monkeypatch.setattr(bpo.config.const, "build_stats_factor", 0.5)
+    session = bpo.db.session()
+    start = bpo.db.build_attempt_start
+    finish = bpo.db.build_attempt_finish
+    success = bpo.db.BuildAttemptOutcome.success
+    failed = bpo.db.BuildAttemptOutcome.failed
+    utcnow = datetime.datetime(2026, 1, 1)
+    monkeypatch.setattr(bpo.db, "utcnow", lambda: utcnow)
+
+    # Failed attempt, then a retry that gets superseded, then success
+    attempt = start(session, "build_package", 1, "x86_64", "main",
+                    pkgname="hello-world", version="1-r0")
+    assert attempt.retry_count == 0
+    assert finish(session, "build_package", failed, 1).outcome == failed
+    assert not bpo.db.get_build_durations(session, "build_package", "x86_64")
+
+    start(session, "build_package", 2, "x86_64", "main",
+          pkgname="hello-world", version="1-r0")
+    attempt = start(session, "build_package", 3, "x86_64", "main",
+                    pkgname="hello-world", version="1-r0")
+    assert attempt.retry_count == 2
+    assert session.query(bpo.db.BuildAttempt).filter_by(job_id=2).one()\
+        .outcome == failed
+
+    utcnow += datetime.timedelta(seconds=100)
+    attempt = finish(session, "build_package", success, 3, 1234)
+    assert attempt.duration == 100
+    assert attempt.size == 1234
+
+    # Finishing again (e.g. from update_status) does nothing
+    assert finish(session, "build_package", failed, 3) is None
+
+    # Rolling average
+    attempt = start(session, "build_package", 4, "x86_64", "main",
+                    pkgname="hello-world", version="1-r1")
+    assert attempt.retry_count == 0
+    utcnow += datetime.timedelta(seconds=300)
+    finish(session, "build_package", success, 4)
+    stats = session.query(bpo.db.BuildStats).one()
+    assert stats.count == 2
+    assert stats.duration_last == 300
+    assert stats.duration_avg == 200
+    assert bpo.db.get_build_durations(session, "build_package", "x86_64") \
+        == {"hello-world": 200}
+
+    # sign_index jobs are found by arch/branch/splitrepo
+    start(session, "sign_index", 5, "x86_64", "main", "systemd")
+    attempt = finish(session, "sign_index", success, size=10, arch="x86_64",
+                     branch="main", splitrepo="systemd")
+    assert attempt.job_id == 5
+    assert attempt.stats_name() == "systemd"
+
+
+def test_scope(monkeypatch):
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+
+    # Outside of a scope: new session for each call
+    assert bpo.db.session() is not bpo.db.session()
+
+    # Inside of a scope (also nested): always the same session
+    count_sessions = bpo.db.count_sessions
+    count_commits = bpo.db.count_commits
+    with bpo.db.scope("test"):
+        session = bpo.db.session()
+        with bpo.db.scope("nested"):
+            assert bpo.db.session() is session
+        assert bpo.db.session() is session
+
+        with bpo.db.unit_of_work() as uow_session:
+            assert uow_session is session
+            session.add(bpo.db.Log("test_scope"))
+
+        # bpo.ui.log() would commit in the middle of the unit of work
+        with pytest.raises(RuntimeError, match="unit_of_work"):
+            with bpo.db.unit_of_work():
+                bpo.ui.log("test_scope_log")
+
+        # Roll back on exceptions
+        with pytest.raises(RuntimeError):
+            with bpo.db.unit_of_work() as uow_session:
+                session.add(bpo.db.Log("test_scope_rollback"))
+                raise RuntimeError("oops")
+    assert bpo.db.count_sessions == count_sessions + 1
+    assert bpo.db.count_commits == count_commits + 1
+
+    # Outside of the scope again
+    session_new = bpo.db.session()
+    assert session_new is not session
+    assert session_new.query(bpo.db.Log).filter_by(action="test_scope")\
+        .count() == 1
+    assert session_new.query(bpo.db.Log)\
+        .filter_by(action="test_scope_rollback").count() == 0
+
+
+def test_scope_request(monkeypatch):
+    """ One API request uses one session, and only commits once for writing
+        the log entry and once for resetting all failed packages. """
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+    monkeypatch.setattr(bpo.jobs.get_depends, "run", bpo_test.nop)
+
+    session = bpo.db.session()
+    for pkgname in ["hello-world", "hello-world-wrapper", "other"]:
+        package = bpo.db.Package("x86_64", "main", pkgname, "1-r0")
+        package.status = bpo.db.PackageStatus.failed
+        session.add(package)
+    hello_world_wrapper = session.query(bpo.db.Package)\
+        .filter_by(pkgname="hello-world-wrapper").one()
+    hello_world_wrapper.depends = [session.query(bpo.db.Package)
+                                   .filter_by(pkgname="hello-world").one()]
+    session.commit()
+
+    app = flask.Flask(__name__)
+    app.register_blueprint(bpo.api.blueprint)
+    count_sessions = bpo.db.count_sessions
+    count_commits = bpo.db.count_commits
+
+    token = bpo.config.const.test_tokens["push_hook_gitlab"]
+    payload = {"object_kind": "push",
+               "after": "deadbeef",
+               "ref": "refs/heads/main",
+               "commits": [{"id": "5e9e102", "added": [], "removed": [],
+                            "modified": ["main/hello-world/APKBUILD"]}]}
+    result = app.test_client().post("/api/push-hook/gitlab", json=payload,
+                                    headers={"X-Gitlab-Token": token})
+    assert result.status_code == 200
+
+    assert bpo.db.count_sessions == count_sessions + 1
+    assert bpo.db.count_commits == count_commits + 2
+    bpo_test.assert_package("hello-world", status="queued")
+    bpo_test.assert_package("hello-world-wrapper", status="queued")
+    bpo_test.assert_package("other", status="failed")
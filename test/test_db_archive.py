@@ -0,0 +1,114 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/db/archive.py and the log payload encoding """
+import datetime
+import json
+import os
+import sys
+
+import bpo_test
+import bpo.config.args
+import bpo.config.const
+import bpo.db
+import bpo.db.archive
+import bpo.helpers.job
+import bpo.ui
+
+
+def init(monkeypatch, tmp_path):
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "--log-archive-path",
+                                      str(tmp_path), "local"])
+    bpo.init_components()
+
+
+def test_payload_encoding(monkeypatch):
+    monkeypatch.setattr(bpo.config.const, "log_payload_compress_min", 100)
+
+    # Small payloads: compact json
+    small = {"a": [1, 2]}
+    log = bpo.db.Log("test", payload=small)
+    assert log.payload == '{"a":[1,2]}'
+    assert log.get_payload() == small
+
+    # Large payloads: compressed
+    large = {"packages": [{"pkgname": f"pkg-{i}", "version": "1.0-r0"}
+                          for i in range(100)]}
+    log = bpo.db.Log("test", payload=large)
+    assert log.payload.startswith(bpo.db.payload_prefix_zlib)
+    assert len(log.payload) < len(json.dumps(large)) / 4
+    assert log.get_payload() == large
+
+    # Old entries, stored with indent=4
+    log.payload = json.dumps(large, indent=4)
+    assert log.get_payload() == large
+
+    assert bpo.db.Log("test").get_payload() is None
+
+
+def test_archive(monkeypatch, tmp_path):
+    init(monkeypatch, tmp_path)
+    monkeypatch.setattr(bpo.config.const, "log_retention_days", 30)
+    monkeypatch.setattr(bpo.config.const, "log_retention_max", 1000)
+    monkeypatch.setattr(bpo.db.archive, "batch_size", 7)
+    session = bpo.db.session()
+    session.query(bpo.db.Log).delete()
+
+    # 20 entries per month in Jan and Feb 2020, 10 recent ones
+    for month in [1, 2]:
+        for day in range(1, 21):
+            log = bpo.db.Log("old", payload={"day": day}, pkgname="hello")
+            log.date = datetime.datetime(2020, month, day, 12)
+            session.add(log)
+    for i in range(10):
+        session.add(bpo.db.Log("new", pkgname=f"new-{i}"))
+    session.commit()
+
+    assert bpo.db.archive.run() == 40
+    assert session.query(bpo.db.Log).filter_by(action="old").count() == 0
+    assert session.query(bpo.db.Log).filter_by(action="new").count() == 10
+
+    assert sorted(os.listdir(tmp_path)) == ["log-2020-01.jsonl.gz",
+                                            "log-2020-02.jsonl.gz"]
+    entries = bpo.db.archive.read(tmp_path / "log-2020-01.jsonl.gz")
+    assert [entry["payload"]["day"] for entry in entries] == \
+        list(range(1, 21))
+    assert entries[0]["pkgname"] == "hello"
+    assert entries[0]["date"].startswith("2020-01-01T12:00:00")
+
+    # Nothing left to archive
+    assert bpo.db.archive.run() == 0
+
+    # Limit by amount of entries: archive the 4 oldest of the new entries
+    monkeypatch.setattr(bpo.config.const, "log_retention_max", 6)
+    assert bpo.db.archive.run() == 4
+    result = session.query(bpo.db.Log).order_by(bpo.db.Log.id).all()
+    assert [log.pkgname for log in result] == \
+        [f"new-{i}" for i in range(4, 10)]
+    assert len(os.listdir(tmp_path)) == 3
+
+
+def test_hot_window(monkeypatch, tmp_path):
+    init(monkeypatch, tmp_path)
+    session = bpo.db.session()
+    args = ["job_build_package", "x86_64", "main", None, "hello-world",
+            "1-r0", None, None, None]
+
+    # Same job 10x, but yesterday: not counted by the rate limit
+    yesterday = bpo.db.utcnow() - datetime.timedelta(days=1)
+    for i in range(10):
+        log = bpo.db.Log(args[0], arch=args[1], branch=args[2],
+                         pkgname=args[4], version=args[5])
+        log.date = yesterday
+        session.add(log)
+    session.commit()
+    bpo.helpers.job.job_check_rate_limit(*args)
+
+    # Entries outside of the hot window are not shown in the UI
+    old = bpo.db.Log("old")
+    old.date = bpo.db.get_log_hot_window_start() - datetime.timedelta(days=1)
+    session.add(old)
+    session.commit()
+    for entries in bpo.ui.log_entries_by_day(session).values():
+        assert old.id not in [entry.id for entry in entries]
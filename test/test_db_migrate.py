@@ -2,22 +2,101 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 """ Testing bpo/db/migrate.py """
 import bpo_test  # noqa
+import bpo.config.args
 import bpo.config.const
+import bpo.db
+import bpo.db.migrate
 import bpo.jobs.build_package
 
+import pytest
 import shutil
+import sqlalchemy
+import sqlite3
+import sys
+
+db0_orig = bpo.config.const.top_dir + "/test/testdata/bpo.layout0.db"
+version_latest = 12
+
+
+def init_args(monkeypatch, db_url):
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "--db-url", db_url, "local"])
+    bpo.config.args.init()
+
+
+def get_version():
+    with bpo.db.engine.connect() as conn:
+        return bpo.db.migrate.version_get(conn)
+
+
+def get_indexes(table):
+    inspector = sqlalchemy.inspect(bpo.db.engine)
+    return [index["name"] for index in inspector.get_indexes(table)]
+
+
+def check_latest():
+    assert get_version() == version_latest
+    assert "branch-arch-splitrepo-pkgname" in get_indexes("package")
+    assert "log:date" in get_indexes("log")
+
+    session = bpo.db.session()
+    session.add(bpo.db.Log("test", retry_count=1, splitrepo="systemd"))
+    session.commit()
+
+
+@pytest.fixture
+def db0_memory():
+    """ Load bpo.layout0.db into a shared in-memory database, that stays
+        alive as long as the connection in this fixture is open. """
+    name = "bpo_layout0"
+    keep = sqlite3.connect(f"file:{name}?mode=memory&cache=shared", uri=True)
+    db0 = sqlite3.connect(db0_orig)
+    db0.backup(keep)
+    db0.close()
+    yield f"sqlite:///file:{name}?mode=memory&cache=shared&uri=true"
+    keep.close()
 
 
 def test_upgrade_twice_from_v0(tmpdir, monkeypatch):
     # Copy bpo.layout0.db to tmpdir
     db0_temp = str(tmpdir) + "/bpo.db"
-    db0_orig = (bpo.config.const.top_dir + "/test/testdata/bpo.layout0.db")
     shutil.copy(db0_orig, db0_temp)
-    monkeypatch.setattr(bpo.config.args, "db_path", db0_temp)
-    assert bpo.config.args.db_path == db0_temp
+    init_args(monkeypatch, "sqlite:///" + db0_temp)
 
     # Verify upgrading to latest
     bpo.db.init()
+    check_latest()
 
     # Verify upgrading again (crashes if missing version_set())
     bpo.db.init()
+    check_latest()
+
+
+def test_upgrade_twice_from_v0_memory(db0_memory, monkeypatch):
+    init_args(monkeypatch, db0_memory)
+    bpo.db.init()
+    check_latest()
+    bpo.db.init()
+    check_latest()
+
+
+def test_new_db_memory(monkeypatch):
+    # Plain in-memory database, created from scratch
+    init_args(monkeypatch, "sqlite://")
+    bpo.db.init()
+    check_latest()
+
+
+def test_version_from_user_version(tmpdir, monkeypatch):
+    """ Databases migrated before the schema_version table existed only have
+        their version in PRAGMA user_version. """
+    db_path = str(tmpdir) + "/bpo.db"
+    init_args(monkeypatch, "sqlite:///" + db_path)
+    bpo.db.init()
+    with bpo.db.engine.begin() as conn:
+        conn.execute(bpo.db.SchemaVersion.__table__.delete())
+        conn.exec_driver_sql(f"PRAGMA user_version={version_latest}")
+    assert get_version() == version_latest
+
+    # Does not try to run the migrations again
+    bpo.db.init()
+    check_latest()
@@ -0,0 +1,134 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Make sure that the main queries on the package and log tables use
+    indexes instead of scanning the whole table, by running them against a
+    database with 100k packages and checking EXPLAIN QUERY PLAN. """
+import datetime
+import re
+import sys
+
+import sqlalchemy.event
+
+import bpo_test
+import bpo.config.const
+import bpo.db
+import bpo.helpers.job
+import bpo.repo
+import bpo.repo.depgraph
+import bpo.repo.eta
+import bpo.repo.slots
+import bpo.ui
+
+arches = ["x86_64", "aarch64", "armv7", "armhf", "x86", "riscv64", "ppc64le",
+          "loongarch64"]
+branches = ["main", "v25.12"]
+pkgs_per_arch = 6250  # 100k packages in total
+
+
+def fill_db():
+    engine = bpo.db.engine
+    statuses = list(bpo.db.PackageStatus)
+    packages = []
+    depends = []
+    for branch in branches:
+        for arch in arches:
+            for i in range(pkgs_per_arch):
+                packages.append({"arch": arch,
+                                 "branch": branch,
+                                 "splitrepo": "systemd" if i % 10 == 0
+                                 else None,
+                                 "pkgname": f"pkg-{i}",
+                                 "version": "1-r0",
+                                 "status": statuses[i % len(statuses)]})
+                if i:
+                    depends.append({"package_id": len(packages),
+                                    "dependency_id": len(packages) - 1})
+    assoc = bpo.db.base.metadata.tables["package_dependency"]
+    with engine.begin() as conn:
+        conn.execute(bpo.db.Package.__table__.insert(), packages)
+        conn.execute(assoc.insert(), depends)
+
+    date = datetime.datetime(2026, 1, 1)
+    logs = [{"action": "job_build_package",
+             "date": date + datetime.timedelta(minutes=i),
+             "arch": "x86_64",
+             "branch": "main",
+             "pkgname": f"pkg-{i % pkgs_per_arch}"} for i in range(100000)]
+    with engine.begin() as conn:
+        conn.execute(bpo.db.Log.__table__.insert(), logs)
+
+
+def is_table_scan(detail, statement):
+    """ :returns: True if the query plan detail is a full scan of a table
+                  that grows with the amount of packages """
+    match = re.match(r"SCAN (package_dependency|package|log)\b", detail)
+    if not match:
+        return False
+
+    # Newest log entries: reads only up to LIMIT rows in rowid order
+    if detail == "SCAN log" and "ORDER BY log.id DESC" in statement and \
+            "LIMIT" in statement:
+        return False
+
+    return True
+
+
+def test_query_plan(monkeypatch):
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+    monkeypatch.setattr(bpo.config.const, "branches",
+                        {branch: {"arches": arches} for branch in branches})
+    fill_db()
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    session = bpo.db.session()
+    sqlalchemy.event.listen(bpo.db.engine, "before_cursor_execute", capture)
+    try:
+        for pkgname, splitrepo in [("pkg-11", None), ("pkg-10", "systemd")]:
+            assert bpo.db.get_package(session, pkgname, "aarch64", "main",
+                                      splitrepo)
+            bpo.db.package_has_version(session, pkgname, "aarch64", "main",
+                                       splitrepo, "1-r0")
+            bpo.repo.has_unfinished_builds(session, "aarch64", "main",
+                                           splitrepo)
+            bpo.repo.count_unpublished_packages(session, "main", "aarch64",
+                                                splitrepo)
+        bpo.db.get_recent_packages_by_status(session)
+        bpo.repo.slots.Slots(session)
+        bpo.repo.slots.get_branches_pending(session,
+                                            bpo.config.const.branches)
+        bpo.repo.depgraph.invalidate()
+        bpo.repo.depgraph.get(session, "aarch64", "main")
+        bpo.repo.eta.get_all(session)
+        bpo.ui.log_entries_by_day(session)
+        bpo.helpers.job.job_check_rate_limit("job_build_package", "x86_64",
+                                             "main", None, "pkg-1", None,
+                                             None, None, None)
+    finally:
+        sqlalchemy.event.remove(bpo.db.engine, "before_cursor_execute",
+                                capture)
+
+    assert len(statements) > 10
+
+    scans = []
+    conn = bpo.db.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        for statement, parameters in statements:
+            if not statement.lstrip().upper().startswith("SELECT"):
+                continue
+            cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            for row in cursor.fetchall():
+                detail = row[-1]
+                if is_table_scan(detail, statement):
+                    scans.append(f"{detail}: {statement}")
+    finally:
+        conn.close()
+
+    assert scans == []
@@ -2,6 +2,13 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 """ Testing bpo/helpers/apk.py """
 import collections
+import glob
+import gzip
+import io
+import logging
+import os
+import tarfile
+import time
 import pytest
 
 import bpo_test  # noqa
@@ -41,3 +48,83 @@ def test_apk_get_metadata():
     expected["origin"] = "hello-world-wrapper"
 
     assert bpo.helpers.apk.get_metadata(apk) == expected
+
+
+def tar_segment(files, cut=True):
+    """ :param files: dict of name: content
+        :param cut: leave out the end of archive blocks (abuild-tar --cut)
+        :returns: gzip compressed tar archive """
+    ret = io.BytesIO()
+    for name, content in files.items():
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        ret.write(info.tobuf(format=tarfile.GNU_FORMAT))
+        ret.write(content + bytes(-len(content) % 512))
+    if not cut:
+        ret.write(bytes(1024))
+    return gzip.compress(ret.getvalue(), compresslevel=1)
+
+
+def test_apk_read_pkginfo(tmp_path):
+    # Same result as reading it with tarfile
+    for apk in glob.glob(f"{bpo.config.const.top_dir}/test/testdata/*.apk"):
+        with tarfile.open(apk, "r:gz") as tar:
+            with tar.extractfile(".PKGINFO") as handle:
+                expected = handle.read()
+        assert bpo.helpers.apk.read_pkginfo(apk) == expected
+
+    # Unsigned apk, long name in the signature segment
+    pkginfo = b"# Generated by abuild 3.4.0-r1\npkgname = test\n"
+    apk = tmp_path / "unsigned.apk"
+    apk.write_bytes(tar_segment({".PKGINFO": pkginfo}) +
+                    tar_segment({"usr/bin/test": b"test"}, False))
+    assert bpo.helpers.apk.read_pkginfo(str(apk)) == pkginfo
+
+    apk = tmp_path / "long.apk"
+    apk.write_bytes(tar_segment({".SIGN.RSA." + "x" * 120: b"sig"}) +
+                    tar_segment({".PKGINFO": pkginfo}) +
+                    tar_segment({"usr/bin/test": b"test"}, False))
+    assert bpo.helpers.apk.read_pkginfo(str(apk)) == pkginfo
+
+    # No .PKGINFO in the control segment: don't look into the data segment
+    apk = tmp_path / "missing.apk"
+    apk.write_bytes(tar_segment({".SIGN.RSA.test.rsa.pub": b"sig"}) +
+                    tar_segment({".pre-install": b"#!/bin/sh"}) +
+                    tar_segment({".PKGINFO": pkginfo}, False))
+    with pytest.raises(RuntimeError) as e:
+        bpo.helpers.apk.read_pkginfo(str(apk))
+    assert "No .PKGINFO found" in str(e.value)
+
+    apk = tmp_path / "plain.apk"
+    apk.write_bytes(gzip.compress(b"not a tar archive" * 100))
+    with pytest.raises(RuntimeError) as e:
+        bpo.helpers.apk.read_pkginfo(str(apk))
+    assert "not a valid tar archive" in str(e.value)
+
+
+def test_apk_read_pkginfo_benchmark(tmp_path):
+    """ Compare read_pkginfo() with reading .PKGINFO through tarfile, for an
+        apk with a big data segment. """
+    pkginfo = b"# Generated by abuild 3.4.0-r1\npkgname = linux-test\n"
+    apk = str(tmp_path / "linux-test-1-r0.apk")
+    with open(apk, "wb") as handle:
+        handle.write(tar_segment({".SIGN.RSA.test.rsa.pub": os.urandom(256)}))
+        handle.write(tar_segment({".PKGINFO": pkginfo}))
+        handle.write(tar_segment({"boot/vmlinuz": os.urandom(16 * 1024 * 1024),
+                                  "lib/firmware/blob": bytes(8 * 1024 * 1024)},
+                                 False))
+
+    start = time.perf_counter()
+    with tarfile.open(apk, "r:gz") as tar:
+        with tar.extractfile(".PKGINFO") as handle:
+            assert handle.read() == pkginfo
+    duration_tarfile = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assert bpo.helpers.apk.read_pkginfo(apk) == pkginfo
+    duration = time.perf_counter() - start
+
+    logging.info(f"benchmark: .PKGINFO of {os.path.getsize(apk)} bytes apk:"
+                 f" tarfile {duration_tarfile * 1000:.1f}ms,"
+                 f" read_pkginfo {duration * 1000:.1f}ms")
+    assert duration < duration_tarfile / 10
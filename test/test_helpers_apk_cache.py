@@ -0,0 +1,62 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/helpers/apk_cache.py """
+import os
+import shutil
+import sys
+
+import bpo_test
+import bpo.config.const
+import bpo.helpers.apk
+import bpo.helpers.apk_cache
+
+
+def test_apk_cache(monkeypatch, tmp_path):
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "--apk-cache-path",
+                                      str(tmp_path / "apk_cache.db"),
+                                      "local"])
+    bpo.init_components()
+    func = bpo.helpers.apk_cache.get_metadata
+
+    apk = str(tmp_path / "hello-world-wrapper-subpkg-1-r2.apk")
+    shutil.copy(bpo.config.const.top_dir +
+                "/test/testdata/hello-world-wrapper-subpkg-1-r2.apk", apk)
+    expected = bpo.helpers.apk.get_metadata(apk)
+
+    def assert_metadata(path, hits, misses):
+        """ Get the metadata twice, compare cache hits and misses """
+        hits += bpo.helpers.apk_cache.count_hits
+        misses += bpo.helpers.apk_cache.count_misses
+        assert func(path) == expected
+        assert list(func(path).keys()) == list(expected.keys())
+        assert bpo.helpers.apk_cache.count_hits == hits
+        assert bpo.helpers.apk_cache.count_misses == misses
+
+    # Read once, then from the cache
+    assert_metadata(apk, 1, 1)
+    assert_metadata(apk, 2, 0)
+
+    # Still cached after reopening the cache file
+    bpo.helpers.apk_cache.init()
+    assert_metadata(apk, 2, 0)
+
+    # Changed mtime: read again
+    os.utime(apk, ns=(0, 0))
+    assert_metadata(apk, 1, 1)
+
+    # Copy gets cached without reading it
+    apk_copy = str(tmp_path / "copy.apk")
+    bpo.helpers.apk_cache.copy(apk, apk_copy)
+    assert_metadata(apk_copy, 2, 0)
+
+    # Replaced file with the same path: read again
+    os.unlink(apk_copy)
+    shutil.copy(apk, apk_copy)
+    assert_metadata(apk_copy, 1, 1)
+
+    # Entries of removed files get pruned
+    os.unlink(apk_copy)
+    assert bpo.helpers.apk_cache.prune() == 1
+    assert bpo.helpers.apk_cache.prune() == 0
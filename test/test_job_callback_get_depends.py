@@ -3,14 +3,19 @@
 import logging
 import os
 import shutil
+import sys
+import time
 import pytest
+import sqlalchemy.event
 
 import bpo_test
 import bpo_test.trigger
 import bpo.config.const
 import bpo.repo.final
 import bpo.jobs
+import bpo.job_services.sim
 import bpo.repo
+import bpo.api.job_callback.get_depends
 
 
 def test_callback_depends_remove_deleted_packages_db(monkeypatch):
@@ -133,3 +138,101 @@ def test_get_payload_splitrepo_pmbv3_ok(monkeypatch):
         bpo_test.assert_package("hello-world", splitrepo=None)
         bpo_test.assert_package("hello-world", splitrepo="systemd")
         bpo_test.assert_package("hello-world-wrapper", splitrepo="systemd")
+
+
+def test_update_packages_bulk_benchmark(monkeypatch):
+    """ Insert and update a synthetic payload of 5k packages for 8 arches, and
+        make sure the amount of SQL statements does not grow with the amount
+        of packages. """
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+    func = bpo.api.job_callback.get_depends
+    arches = ["x86_64", "aarch64", "armv7", "armhf", "x86", "riscv64",
+              "ppc64le", "loongarch64"]
+    branch = "main"
+    payload = bpo.job_services.sim.generate_payload(5000)
+    depends_count = sum(len(package["depends"]) for package in payload)
+
+    statements = []
+
+    def count(*args, **kwargs):
+        statements.append(True)
+
+    def ingest(payload):
+        session = bpo.db.session()
+        statements.clear()
+        sqlalchemy.event.listen(bpo.db.engine, "before_cursor_execute", count)
+        start = time.perf_counter()
+        for arch in arches:
+            func.update_or_insert_packages(session, payload, arch, branch)
+            func.update_package_depends(session, payload, arch, branch)
+            session.commit()
+        duration = time.perf_counter() - start
+        sqlalchemy.event.remove(bpo.db.engine, "before_cursor_execute", count)
+        logging.info(f"benchmark: {len(payload)} packages x {len(arches)}"
+                     f" arches: {duration:.2f}s, {len(statements)} SQL"
+                     " statements")
+        return session
+
+    # Insert everything
+    session = ingest(payload)
+    assert len(statements) <= 10 * len(arches)
+    assert session.query(bpo.db.Package).count() == 5000 * len(arches)
+    assoc = bpo.db.base.metadata.tables["package_dependency"]
+    assert session.query(assoc).count() == depends_count * len(arches)
+
+    # Same payload again: nothing to write
+    ingest(payload)
+    assert len(statements) <= 4 * len(arches)
+
+    # New version and changed depends for one package
+    payload[100]["version"] = "2-r0"
+    payload[100]["depends"] = ["sim-00000"]
+    session = ingest(payload)
+    package = bpo.db.get_package(session, "sim-00100", "x86_64", branch, None)
+    assert package.version == "2-r0"
+    assert package.status == bpo.db.PackageStatus.queued
+    assert [depend.pkgname for depend in package.depends] == ["sim-00000"]
+
+
+def test_callback_depends_rollback(monkeypatch):
+    """ Packages and repo_bootstrap entries don't get written without the
+        depends of the packages """
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+    func = bpo.api.job_callback.get_depends
+    branch_data = {"arches": ["x86_64"], "pmb_branch": "main"}
+    monkeypatch.setattr(bpo.config.const, "branches", {"main": branch_data})
+    monkeypatch.setattr(bpo.config.const, "repo_bootstrap_dirs", ["systemd"])
+    payload = bpo.job_services.sim.generate_payload(5)
+    payload[0]["repo"] = "systemd"
+    sim = bpo.job_services.sim.Simulation({"x86_64": payload})
+
+    def update_package_depends_fail(*args):
+        raise RuntimeError("test")
+    monkeypatch.setattr(func, "update_package_depends",
+                        update_package_depends_fail)
+
+    with pytest.raises(RuntimeError, match="test"):
+        sim.get_depends()
+    session = bpo.db.session()
+    assert session.query(bpo.db.Package).count() == 0
+    assert session.query(bpo.db.RepoBootstrap).count() == 0
+    assert session.query(bpo.db.Log)\
+        .filter_by(action="repo_bootstrap_add").count() == 0
+
+    # Without the error: the entry gets added and logged
+    monkeypatch.undo()
+    monkeypatch.setattr(bpo.config.const, "branches", {"main": branch_data})
+    monkeypatch.setattr(bpo.config.const, "repo_bootstrap_dirs", ["systemd"])
+    monkeypatch.setattr(bpo.repo, "build", bpo_test.nop)
+    sim.get_depends()
+    session = bpo.db.session()
+    assert session.query(bpo.db.Package).count() == 5
+    assert session.query(bpo.db.RepoBootstrap).count() == 1
+    assert session.query(bpo.db.Log)\
+        .filter_by(action="repo_bootstrap_add").count() == 1
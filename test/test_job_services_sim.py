@@ -0,0 +1,49 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/job_services/sim.py """
+import json
+import sys
+
+import bpo_test
+import bpo.config.const
+import bpo.job_services.sim
+
+
+def simulate(monkeypatch, payload, build_order="critical_path", durations={}):
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+    monkeypatch.setattr(bpo.config.const, "max_parallel_build_jobs", 2)
+    monkeypatch.setattr(bpo.config.const, "build_order", build_order)
+
+    js = bpo.job_services.sim.SimJobService(durations)
+    sim = bpo.job_services.sim.Simulation({"x86_64": payload}, "main", js)
+    return sim.run()
+
+
+def test_sim_depends_json(monkeypatch):
+    path = f"{bpo.config.const.top_dir}/test/testdata/depends.x86_64.json"
+    with open(path) as handle:
+        payload = json.load(handle)
+
+    durations = {"hello-world": 100, "hello-world-wrapper": 50}
+    report = simulate(monkeypatch, payload, durations=durations)
+    assert report["jobs"] == {"build_package": 2, "sign_index": 1}
+    assert report["not_published"] == 0
+    # hello-world-wrapper depends on hello-world, then the index gets signed
+    assert report["makespan"] == 100 + 50 + bpo.job_services.sim.duration_other
+    assert report["passes"] > 0
+    assert report["pass_sql_total"] > 0
+    assert "makespan:" in bpo.job_services.sim.format_report(report)
+
+
+def test_sim_generated(monkeypatch):
+    payload = bpo.job_services.sim.generate_payload(30, seed=1)
+
+    report = simulate(monkeypatch, payload)
+    assert report["not_published"] == 0
+    assert report["jobs"]["build_package"] == 30
+
+    # Deterministic
+    assert simulate(monkeypatch, payload)["makespan"] == report["makespan"]
@@ -0,0 +1,86 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/api/public/status.py """
+import sys
+
+import flask
+import sqlalchemy
+
+import bpo
+import bpo_test
+import bpo.api
+import bpo.db
+import bpo.ui
+
+
+def test_public_status(monkeypatch):
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+    session = bpo.db.session()
+    app = flask.Flask(__name__)
+    app.register_blueprint(bpo.api.blueprint)
+    client = app.test_client()
+
+    # Not rendered yet
+    result = client.get("/api/public/status")
+    assert result.status_code == 503
+
+    for arch in ["x86_64", "aarch64"]:
+        session.add(bpo.db.Package(arch, "main", "hello-world", "1-r0"))
+    session.commit()
+    bpo.ui.log("test_public_status")
+
+    result = client.get("/api/public/status")
+    assert result.status_code == 200
+    status = result.get_json()
+    assert status["badge"] == "building"
+    assert status["repos"] == [
+        {"branch": "main", "arch": "aarch64", "splitrepo": None,
+         "building": 0, "failed": 0, "queued": 1},
+        {"branch": "main", "arch": "x86_64", "splitrepo": None,
+         "building": 0, "failed": 0, "queued": 1}]
+    etag = result.headers["ETag"]
+    last_modified = result.headers["Last-Modified"]
+
+    # Conditional requests don't touch the database
+    statements = []
+
+    def count(*args, **kwargs):
+        statements.append(True)
+
+    count_sessions = bpo.db.count_sessions
+    sqlalchemy.event.listen(bpo.db.engine, "before_cursor_execute", count)
+    try:
+        result = client.get("/api/public/status",
+                            headers={"If-None-Match": etag})
+        assert result.status_code == 304
+        result = client.get("/api/public/status",
+                            headers={"If-Modified-Since": last_modified})
+        assert result.status_code == 304
+    finally:
+        sqlalchemy.event.remove(bpo.db.engine, "before_cursor_execute", count)
+    assert statements == []
+    assert bpo.db.count_sessions == count_sessions
+
+    # Rendering again without changes keeps the ETag and Last-Modified
+    bpo.ui.log("test_public_status_unchanged")
+    result = client.get("/api/public/status")
+    assert result.headers["ETag"] == etag
+    assert result.headers["Last-Modified"] == last_modified
+
+    # Package failed: new ETag
+    package = bpo.db.get_package(session, "hello-world", "x86_64", "main",
+                                 None)
+    bpo.db.set_package_status(session, package, bpo.db.PackageStatus.failed,
+                              1)
+    bpo.ui.log("test_public_status_failed")
+    result = client.get("/api/public/status",
+                        headers={"If-None-Match": etag})
+    assert result.status_code == 200
+    assert result.headers["ETag"] != etag
+    status = result.get_json()
+    assert status["badge"] == "failed"
+    assert [package["pkgname"] for package in status["pkgs"]["failed"]] == \
+        ["hello-world"]
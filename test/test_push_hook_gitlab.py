@@ -1,5 +1,10 @@
 # Copyright 2022 Oliver Smith
 # SPDX-License-Identifier: AGPL-3.0-or-later
+import sys
+
+import sqlalchemy
+import sqlalchemy.orm
+
 import bpo_test
 import bpo_test.trigger
 import bpo.db
@@ -78,3 +83,52 @@ def test_push_hook_gitlab_reset_to_queued(monkeypatch):
     bpo_test.assert_package("hello-world", status="queued", retry_count=0)
     bpo_test.assert_package("hello-world-wrapper", status="queued",
                             retry_count=0)
+
+
+def test_push_hook_gitlab_reset_batch(monkeypatch):
+    """ Resetting many failed packages must be done in one transaction, with
+        one update of the html output. """
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+    session = bpo.db.session()
+
+    pkgnames_commits = {}
+    for i in range(300):
+        pkgname = f"pkg-{i}"
+        package = bpo.db.Package("x86_64", "main", pkgname, "1-r0")
+        package.status = bpo.db.PackageStatus.failed
+        package.retry_count = 2
+        session.add(package)
+        pkgnames_commits[pkgname] = "1337f00"
+    session.commit()
+    count_logs = session.query(bpo.db.Log).count()
+
+    commits = []
+    renders = []
+
+    def after_commit(session):
+        commits.append(session)
+
+    monkeypatch.setattr(bpo.ui, "update", lambda session: renders.append(1))
+    sqlalchemy.event.listen(sqlalchemy.orm.Session, "after_commit",
+                            after_commit)
+    try:
+        bpo.api.push_hook.gitlab.reset_failed_packages(pkgnames_commits,
+                                                       "main")
+    finally:
+        sqlalchemy.event.remove(sqlalchemy.orm.Session, "after_commit",
+                                after_commit)
+
+    assert len(commits) == 1
+    assert len(renders) == 1
+
+    session = bpo.db.session()
+    queued = session.query(bpo.db.Package)\
+        .filter_by(status=bpo.db.PackageStatus.queued, retry_count=0)
+    assert queued.count() == 300
+    logs = session.query(bpo.db.Log).filter_by(action="api_push_reset_failed")
+    assert logs.count() == 300
+    assert session.query(bpo.db.Log).count() == count_logs + 300
+    bpo_test.assert_package("pkg-42", status="queued", retry_count=0)
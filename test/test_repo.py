@@ -240,68 +240,233 @@ def test_repo_next_package_to_build(monkeypatch):
 
 
 def test_build_foreign_arch(monkeypatch):
-    global expected_arches
+    # Start with empty database
+    with bpo_test.BPOServer():
+        bpo_test.stop_server()
+    session = bpo.db.session()
+    branch = "main"
+    splitrepo = None
+
+    # x86_64: hello-world, unrelated
+    # aarch64: hello-world-wrapper depends on hello-world, unrelated
+    packages = {}
+    for arch, pkgname in [("x86_64", "hello-world"),
+                          ("x86_64", "unrelated"),
+                          ("aarch64", "hello-world"),
+                          ("aarch64", "hello-world-wrapper"),
+                          ("aarch64", "unrelated")]:
+        package = bpo.db.Package(arch, branch, pkgname, "1-r0")
+        session.add(package)
+        packages[(arch, pkgname)] = package
+    packages[("aarch64", "hello-world-wrapper")].depends = \
+        [packages[("aarch64", "hello-world")]]
+    packages[("aarch64", "hello-world")].status = \
+        bpo.db.PackageStatus.published
+    session.commit()
+
+    # Override branches config
+    branches = collections.OrderedDict()
+    branches["main"] = {"arches": ["x86_64", "aarch64"]}
+    monkeypatch.setattr(bpo.config.const, "branches", branches)
+    monkeypatch.setattr(bpo.config.const, "max_parallel_build_jobs", 10)
+
+    # Pretend to start the build jobs
+    started = []
 
+    def fake_build_package_run(arch, pkgname, branch, splitrepo):
+        package = bpo.db.get_package(session, pkgname, arch, branch,
+                                     splitrepo)
+        bpo.db.set_package_status(session, package,
+                                  bpo.db.PackageStatus.building)
+        started.append(f"{arch}/{pkgname}")
+        return True
+
+    monkeypatch.setattr(bpo.jobs.build_package, "run", fake_build_package_run)
+
+    logging.info("--- x86_64 pkgs are queued -> build the foreign packages"
+                 " that don't depend on them")
+    func = bpo.repo._build
+    func()
+    assert started == ["x86_64/hello-world",
+                       "x86_64/unrelated",
+                       "aarch64/unrelated"]
+    blocked = bpo.repo.depgraph.blocked_by_native(session, "aarch64", branch,
+                                                  splitrepo)
+    assert blocked == {"hello-world-wrapper": "hello-world"}
+
+    logging.info("--- x86_64 hello-world is built -> NO attempt to build"
+                 " aarch64 hello-world-wrapper")
+    native = packages[("x86_64", "hello-world")]
+    bpo.db.set_package_status(session, native, bpo.db.PackageStatus.built)
+    started.clear()
+    func()
+    assert started == []
+
+    logging.info("--- x86_64 hello-world is published -> DO attempt to build"
+                 " aarch64 hello-world-wrapper")
+    bpo.db.set_package_status(session, native, bpo.db.PackageStatus.published)
+    func()
+    assert started == ["aarch64/hello-world-wrapper"]
+
+
+def test_build_foreign_arch_cross(monkeypatch):
+    """ Foreign packages wait for the cross compilers of their arch """
     # Start with empty database
     with bpo_test.BPOServer():
         bpo_test.stop_server()
     session = bpo.db.session()
+    branch = "main"
+    splitrepo = None
 
-    # Create hello-world x86_64 and aarch64 pkgs in DB
-    arch = "x86_64"
+    for arch, pkgname in [("x86_64", "gcc-aarch64"),
+                          ("x86_64", "gcc-armv7"),
+                          ("aarch64", "hello-world"),
+                          ("armv7", "hello-world")]:
+        session.add(bpo.db.Package(arch, branch, pkgname, "1-r0"))
+    session.commit()
+
+    func = bpo.repo.depgraph.next_package
+    assert func(session, "aarch64", branch, splitrepo) is None
+    assert func(session, "armv7", branch, splitrepo) is None
+
+    gcc = bpo.db.get_package(session, "gcc-aarch64", "x86_64", branch,
+                             splitrepo)
+    bpo.db.set_package_status(session, gcc, bpo.db.PackageStatus.published)
+    assert func(session, "aarch64", branch, splitrepo) == "hello-world"
+    assert func(session, "armv7", branch, splitrepo) is None
+
+
+def test_build_foreign_arch_native_failed(monkeypatch):
+    """ Foreign packages don't wait for native packages that failed without
+        retries left (or depend on such packages), the repo is stuck """
+    monkeypatch.setattr(bpo.config.const, "retry_count_max", 0)
+    monkeypatch.setattr(bpo.jobs.build_package, "run",
+                        bpo_test.raise_exception)
+
+    # Start with empty database
+    with bpo_test.BPOServer():
+        bpo_test.stop_server()
+    session = bpo.db.session()
     branch = "main"
-    pkgname = "hello-world"
-    version = "999-r0"
     splitrepo = None
-    pkg = bpo.db.Package(arch, branch, pkgname, version)
-    session.merge(pkg)
-    arch = "aarch64"
-    pkg = bpo.db.Package(arch, branch, pkgname, version)
-    session.merge(pkg)
+
+    # gcc-aarch64 failed, gcc-armv7 depends on failed binutils-armv7
+    packages = {}
+    for arch, pkgname in [("x86_64", "gcc-aarch64"),
+                          ("x86_64", "gcc-armv7"),
+                          ("x86_64", "binutils-armv7"),
+                          ("aarch64", "hello-world"),
+                          ("armv7", "hello-world")]:
+        package = bpo.db.Package(arch, branch, pkgname, "1-r0")
+        session.add(package)
+        packages[(arch, pkgname)] = package
+    packages[("x86_64", "gcc-aarch64")].status = bpo.db.PackageStatus.failed
+    packages[("x86_64", "binutils-armv7")].status = \
+        bpo.db.PackageStatus.failed
+    packages[("x86_64", "gcc-armv7")].depends = \
+        [packages[("x86_64", "binutils-armv7")]]
     session.commit()
-    pkg = bpo.db.get_package(session, pkgname, "x86_64", branch, splitrepo)
 
-    # Override bpo.repo.build_arch_branch
-    def fake_build_arch_branch(session, slots_available, arch, branch, splitrepo,
-                               force_repo_update, no_repo_update):
-        global expected_arches
+    for arch, roots in [("aarch64", ["x86_64/gcc-aarch64"]),
+                        ("armv7", ["x86_64/binutils-armv7"])]:
+        assert bpo.repo.depgraph.next_package(session, arch, branch,
+                                              splitrepo) is None
+        assert bpo.repo.depgraph.blocked_by_native(session, arch, branch,
+                                                   splitrepo) == {}
+        assert bpo.repo.build_arch_branch(session, 1, arch, branch,
+                                          splitrepo) == 0
+        assert bpo.repo.depgraph.get_stuck(session, arch, branch,
+                                           splitrepo) == roots
+
+    # Retrying the native package makes aarch64 wait for it instead
+    gcc = packages[("x86_64", "gcc-aarch64")]
+    bpo.db.set_package_status(session, gcc, bpo.db.PackageStatus.queued)
+    assert bpo.repo.depgraph.get_stuck(session, "aarch64", branch,
+                                       splitrepo) is None
+    assert bpo.repo.depgraph.blocked_by_native(session, "aarch64", branch,
+                                               splitrepo) == \
+        {"hello-world": "gcc-aarch64"}
+
+
+def test_build_splitrepo(monkeypatch):
+    """ Splitrepo packages start once their main repo depends are built, but
+        get published after the main repo """
+    # Start with empty database
+    with bpo_test.BPOServer():
+        bpo_test.stop_server()
+    session = bpo.db.session()
+    arch = "x86_64"
+    branch = "main"
 
-        logging.info(f"expected_arches={expected_arches}")
-        logging.info(f"fake_build_arch_branch: slots_available={slots_available},"
-                     f" arch={arch}, branch={branch}, splitrepo={splitrepo}")
+    main = bpo.db.Package(arch, branch, "hello-world", "1-r0")
+    other = bpo.db.Package(arch, branch, "other", "1-r0")
+    systemd = bpo.db.Package(arch, branch, "hello-world-wrapper", "1-r0",
+                             splitrepo="systemd")
+    systemd.depends = [main]
+    session.add_all([main, other, systemd])
+    session.commit()
 
-        # In this dummy function, we only have packages to build in the regular
-        # repository (splitrepo is None), not any of the splitrepos.
-        if splitrepo:
-            return 0
+    func = bpo.repo.next_package_to_build
+    assert func(session, arch, branch, "systemd") is None
 
-        assert arch == expected_arches.pop(0)
-        assert branch == "main"
+    bpo.db.set_package_status(session, main, bpo.db.PackageStatus.built)
+    assert func(session, arch, branch, "systemd") == "hello-world-wrapper"
 
-        return 1
+    # systemd WIP repo is complete, main repo is not published yet
+    bpo.db.set_package_status(session, systemd, bpo.db.PackageStatus.built)
+    monkeypatch.setattr(bpo.repo.symlink, "create", bpo_test.raise_exception)
+    assert bpo.repo.build_arch_branch(session, 1, arch, branch, "systemd") == 0
 
-    monkeypatch.setattr(bpo.repo, "build_arch_branch", fake_build_arch_branch)
 
-    # Override branches config
-    branches = collections.OrderedDict()
-    branches["main"] = {"arches": ["x86_64", "aarch64"]}
-    monkeypatch.setattr(bpo.config.const, "branches", branches)
+def test_build_arch_branch_stuck_cache(monkeypatch):
+    """ Stuck repos are skipped until a package status changes """
+    monkeypatch.setattr(bpo.config.const, "retry_count_max", 0)
 
-    logging.info("--- x86_64 pkg is queued -> attempt to build x86_64 pkg")
-    func = bpo.repo._build
-    expected_arches = ["x86_64"]
-    func()
-    assert expected_arches == []
+    # Start with empty database
+    with bpo_test.BPOServer():
+        bpo_test.stop_server()
+    session = bpo.db.session()
+    arch = "x86_64"
+    branch = "main"
+    splitrepo = None
 
-    logging.info("--- x86_64 pkg is built -> NO attempt to build aarch64 pkg")
-    bpo.db.set_package_status(session, pkg, bpo.db.PackageStatus.built)
-    expected_arches = ["x86_64"]
-    func()
-    assert expected_arches == []
+    # hello-world failed, hello-world-wrapper depends on it
+    hello = bpo.db.Package(arch, branch, "hello-world", "1-r0")
+    hello.status = bpo.db.PackageStatus.failed
+    wrapper = bpo.db.Package(arch, branch, "hello-world-wrapper", "1-r0")
+    wrapper.depends = [hello]
+    session.add_all([hello, wrapper])
+    session.commit()
 
-    logging.info("--- x86_64 pkg is published -> DO attempt to build aarch64 pkg")
-    bpo.db.set_package_status(session, pkg, bpo.db.PackageStatus.published)
-    func = bpo.repo._build
-    expected_arches = ["x86_64", "aarch64"]
-    func()
-    assert expected_arches == []
+    calls = []
+
+    def has_unfinished_builds(*args, **kwargs):
+        calls.append("has_unfinished_builds")
+        return True
+
+    monkeypatch.setattr(bpo.repo, "has_unfinished_builds",
+                        has_unfinished_builds)
+    monkeypatch.setattr(bpo.repo, "set_stuck",
+                        lambda arch, branch: calls.append("set_stuck"))
+
+    func = bpo.repo.build_arch_branch
+    assert func(session, 1, arch, branch, splitrepo) == 0
+    assert calls == ["has_unfinished_builds", "set_stuck"]
+    assert bpo.repo.depgraph.get_stuck_all() == [(arch, branch, splitrepo,
+                                                  ["hello-world"])]
+
+    # Root cause is in the UI
+    bpo.ui.update(session)
+    with open(bpo.config.args.html_out + "/index.html") as handle:
+        html = handle.read()
+    assert "blocked by failed <span class=\"pkgname\">hello-world" in html
+
+    # Skipped without checking again
+    assert func(session, 1, arch, branch, splitrepo) == 0
+    assert calls == ["has_unfinished_builds", "set_stuck"]
+
+    # Status change: checked again
+    bpo.db.set_package_status(session, hello, bpo.db.PackageStatus.queued)
+    monkeypatch.setattr(bpo.jobs.build_package, "run", bpo_test.true)
+    assert func(session, 1, arch, branch, splitrepo) == 1
+    assert bpo.repo.depgraph.get_stuck_all() == []
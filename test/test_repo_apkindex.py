@@ -0,0 +1,102 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/repo/apkindex.py """
+import glob
+import gzip
+import os
+import shutil
+import sys
+import tarfile
+
+import bpo_test
+import bpo.config.const
+import bpo.helpers.apk_cache
+import bpo.repo
+import bpo.repo.apkindex
+import bpo.repo.tools
+import bpo.repo.wip
+
+
+def init(monkeypatch):
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+
+
+def test_apkindex_apk_static(monkeypatch, tmp_path):
+    """ Compare the output with apk.static index """
+    init(monkeypatch)
+    path = str(tmp_path)
+    for apk in glob.glob(bpo.config.const.top_dir + "/test/testdata/*.apk"):
+        shutil.copy(apk, path)
+    for i in range(60):
+        bpo_test.fake_apk(path, i)
+    apks = bpo.repo.get_apks(path)
+
+    description = "2026-10-18 12:00:00.000000+00:00"
+    cmd = ["apk.static", "-q", "index", "--output", "expected.tar.gz",
+           "--rewrite-arch", "x86_64", "--description", description] + apks
+    bpo.repo.tools.run("x86_64", "main", "test", path, cmd)
+    with tarfile.open(path + "/expected.tar.gz") as tar:
+        mtime = tar.getmember("APKINDEX").mtime
+
+    entries = [bpo.repo.apkindex.read_entry(path + "/" + apk) for apk in apks]
+    bpo.repo.apkindex.write(path + "/APKINDEX.tar.gz",
+                            bpo.repo.apkindex.sort(entries), description,
+                            "x86_64", mtime)
+
+    # Same gzip header and tar archive. The compressed data is usually the
+    # same too, but that depends on the zlib implementation.
+    with open(path + "/expected.tar.gz", "rb") as handle:
+        expected = handle.read()
+    with open(path + "/APKINDEX.tar.gz", "rb") as handle:
+        data = handle.read()
+    assert data[:10] == expected[:10]
+    assert gzip.decompress(data) == gzip.decompress(expected)
+
+    # Parse it again after signing
+    bpo.repo.wip.do_keygen()
+    cmd = ["abuild-sign.noinclude", "-k",
+           bpo.config.const.repo_wip_keys + "/wip.rsa", "APKINDEX.tar.gz"]
+    bpo.repo.tools.run("x86_64", "main", "test", path, cmd)
+    description_parsed, entries_parsed = \
+        bpo.repo.apkindex.parse(path + "/APKINDEX.tar.gz")
+    assert description_parsed == description
+    assert [bpo.repo.apkindex.format_entry(entry) for entry in entries_parsed] \
+        == [bpo.repo.apkindex.format_entry(entry, "x86_64")
+            for entry in bpo.repo.apkindex.sort(entries)]
+
+
+def test_apkindex_index(monkeypatch, tmp_path):
+    """ Only new and modified apks get read """
+    init(monkeypatch)
+    path = str(tmp_path)
+    for i in range(5):
+        bpo_test.fake_apk(path, i)
+
+    def index(expected_misses):
+        misses = bpo.helpers.apk_cache.count_index_misses
+        bpo.repo.tools.index("x86_64", "main", "test", path)
+        assert bpo.helpers.apk_cache.count_index_misses - misses == \
+            expected_misses
+        entries = bpo.repo.apkindex.parse(path + "/APKINDEX.tar.gz")[1]
+        assert sorted(bpo.repo.apkindex.get_apk(entry)
+                      for entry in entries) == bpo.repo.get_apks(path)
+
+    index(5)
+
+    # New apk
+    apk = bpo_test.fake_apk(path, 5)
+    index(1)
+
+    # Apk got replaced, the old entry must not be reused
+    os.unlink(apk)
+    bpo_test.fake_apk(path, 5)
+    index(1)
+
+    # Removed apk, old index can't be parsed
+    os.unlink(apk)
+    with open(path + "/APKINDEX.tar.gz", "wb") as handle:
+        handle.write(b"invalid")
+    index(0)
@@ -0,0 +1,159 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/repo/depgraph.py """
+import datetime
+import sys
+
+import bpo_test
+import bpo.config.const
+import bpo.db
+import bpo.repo.depgraph
+
+
+def init_db(monkeypatch):
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+
+    # a <- b <- c, d without depends
+    session = bpo.db.session()
+    pkgs = {}
+    for pkgname in ["a", "b", "c", "d"]:
+        pkgs[pkgname] = bpo.db.Package("x86_64", "main", pkgname, "1-r0")
+        session.add(pkgs[pkgname])
+    pkgs["b"].depends = [pkgs["a"]]
+    pkgs["c"].depends = [pkgs["b"]]
+    session.commit()
+    return session
+
+
+def test_depgraph_incremental(monkeypatch):
+    monkeypatch.setattr(bpo.config.const, "retry_count_max", 1)
+    monkeypatch.setattr(bpo.config.const, "build_order", "database")
+    session = init_db(monkeypatch)
+    func = bpo.repo.depgraph.next_package
+    arch = "x86_64"
+    branch = "main"
+    splitrepo = None
+
+    assert func(session, arch, branch, splitrepo) == "a"
+    graph = bpo.repo.depgraph.graphs[(arch, branch)]
+    assert graph.nodes[3].missing == 1
+
+    # Status changes get applied to the cached graph without reloading it
+    a = bpo.db.get_package(session, "a", arch, branch, splitrepo)
+    bpo.db.set_package_status(session, a, bpo.db.PackageStatus.building)
+    assert func(session, arch, branch, splitrepo) == "d"
+    assert bpo.repo.depgraph.graphs[(arch, branch)] is graph
+
+    bpo.db.set_package_status(session, a, bpo.db.PackageStatus.built)
+    assert func(session, arch, branch, splitrepo) == "b"
+
+    # Failed packages with retries left come first
+    d = bpo.db.get_package(session, "d", arch, branch, splitrepo)
+    bpo.db.set_package_status(session, d, bpo.db.PackageStatus.failed)
+    assert func(session, arch, branch, splitrepo) == "d"
+
+    # No more retries left
+    d.retry_count = 1
+    session.commit()
+    assert func(session, arch, branch, splitrepo) == "b"
+    assert bpo.repo.depgraph.graphs[(arch, branch)] is graph
+
+    # Uncommitted changes are not applied
+    b = bpo.db.get_package(session, "b", arch, branch, splitrepo)
+    b.status = bpo.db.PackageStatus.building
+    session.flush()
+    session.rollback()
+    assert func(session, arch, branch, splitrepo) == "b"
+
+    # Changing the depends drops the cached graph
+    c = bpo.db.get_package(session, "c", arch, branch, splitrepo)
+    c.depends = []
+    session.commit()
+    assert (arch, branch) not in bpo.repo.depgraph.graphs
+    assert func(session, arch, branch, splitrepo) == "b"
+    assert bpo.repo.depgraph.graphs[(arch, branch)] is not graph
+
+    # Adding a package drops the cached graph
+    session.add(bpo.db.Package(arch, branch, "e", "1-r0"))
+    session.commit()
+    assert (arch, branch) not in bpo.repo.depgraph.graphs
+
+
+def test_depgraph_critical_path(monkeypatch):
+    monkeypatch.setattr(bpo.config.const, "build_order", "critical_path")
+    session = init_db(monkeypatch)
+    arch = "x86_64"
+    branch = "main"
+    splitrepo = None
+
+    # e <- f (shorter chain than a <- b <- c, and added later)
+    e = bpo.db.Package(arch, branch, "e", "1-r0")
+    f = bpo.db.Package(arch, branch, "f", "1-r0")
+    f.depends = [e]
+    session.add_all([e, f])
+    session.commit()
+
+    graph = bpo.repo.depgraph.get(session, arch, branch)
+    weights = {node.pkgname: node.weight for node in graph.nodes.values()}
+    assert weights == {"a": 3, "b": 2, "c": 1, "d": 1, "e": 2, "f": 1}
+
+    # Longest chain first, then shorter chains, then leaf packages
+    order = []
+    while True:
+        pkgname = bpo.repo.depgraph.next_package(session, arch, branch,
+                                                 splitrepo)
+        if not pkgname:
+            break
+        order += [pkgname]
+        package = bpo.db.get_package(session, pkgname, arch, branch, splitrepo)
+        bpo.db.set_package_status(session, package,
+                                  bpo.db.PackageStatus.built)
+    assert order == ["a", "b", "e", "c", "d", "f"]
+
+    # Built packages don't add to the weight after reloading the graph
+    bpo.repo.depgraph.invalidate()
+    graph = bpo.repo.depgraph.get(session, arch, branch)
+    assert [node.weight for node in graph.nodes.values()] == [1] * 6
+
+
+def test_depgraph_critical_path_durations(monkeypatch):
+    """ The weights change when a new build duration gets recorded """
+    monkeypatch.setattr(bpo.config.const, "build_order", "critical_path")
+    session = init_db(monkeypatch)
+    arch = "x86_64"
+    branch = "main"
+    splitrepo = None
+    utcnow = datetime.datetime(2026, 1, 1)
+    monkeypatch.setattr(bpo.db, "utcnow", lambda: utcnow)
+
+    graph = bpo.repo.depgraph.get(session, arch, branch)
+    assert bpo.repo.depgraph.next_package(session, arch, branch,
+                                          splitrepo) == "a"
+
+    # d was built before and took long (e.g. built for another branch)
+    bpo.db.build_attempt_start(session, "build_package", 1, arch, "v25.12",
+                               pkgname="d", version="1-r0")
+    utcnow += datetime.timedelta(seconds=100)
+    bpo.db.build_attempt_finish(session, "build_package",
+                                bpo.db.BuildAttemptOutcome.success, 1)
+
+    assert bpo.repo.depgraph.graphs[(arch, branch)] is graph
+    weights = {node.pkgname: node.weight for node in graph.nodes.values()}
+    assert weights == {"a": 3, "b": 2, "c": 1, "d": 100}
+    assert bpo.repo.depgraph.next_package(session, arch, branch,
+                                          splitrepo) == "d"
+
+    # Rolled back changes and durations of other jobs are ignored
+    stats = session.query(bpo.db.BuildStats).filter_by(name="d").one()
+    stats.duration_avg = 1
+    session.flush()
+    session.rollback()
+    stats = bpo.db.BuildStats("build_image", arch, "a")
+    stats.duration_avg = 1000
+    session.add(stats)
+    session.commit()
+    assert graph.nodes[4].weight == 100
+    assert graph.nodes[1].weight == 3
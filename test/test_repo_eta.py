@@ -0,0 +1,65 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/repo/eta.py """
+import datetime
+import sys
+
+import bpo_test
+import bpo.config.const
+import bpo.db
+import bpo.repo.depgraph
+import bpo.repo.eta
+
+
+def test_eta(monkeypatch):
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+    monkeypatch.setattr(bpo.config.const, "max_parallel_build_jobs", 2)
+    session = bpo.db.session()
+    arch = "x86_64"
+    branch = "main"
+
+    # a <- b, c, d <- e (d failed without retries left)
+    pkgs = {}
+    for pkgname in ["a", "b", "c", "d", "e"]:
+        pkgs[pkgname] = bpo.db.Package(arch, branch, pkgname, "1-r0")
+        session.add(pkgs[pkgname])
+    pkgs["b"].depends = [pkgs["a"]]
+    pkgs["e"].depends = [pkgs["d"]]
+    pkgs["d"].status = bpo.db.PackageStatus.failed
+    pkgs["d"].retry_count = bpo.config.const.retry_count_max
+    for pkgname, duration in [("a", 600), ("b", 300), ("c", 60)]:
+        stats = bpo.db.BuildStats("build_package", arch, pkgname)
+        stats.count = 1
+        stats.duration_avg = duration
+        session.add(stats)
+    session.commit()
+
+    # Critical path a <- b is longer than all packages on 2 slots
+    assert bpo.repo.eta.get_all(session) == {(branch, arch): 900}
+
+    # Building for 200 seconds already
+    now = datetime.datetime(2026, 1, 1)
+    attempt = bpo.db.BuildAttempt("build_package", 1, arch, branch,
+                                  pkgname="a", version="1-r0")
+    attempt.started = now - datetime.timedelta(seconds=200)
+    session.add(attempt)
+    pkgs["a"].status = bpo.db.PackageStatus.building
+    session.commit()
+    assert bpo.repo.eta.get(session, arch, branch, now) == 700
+
+    # One slot: total of all packages
+    monkeypatch.setattr(bpo.config.const, "max_parallel_jobs_arch", {arch: 1})
+    assert bpo.repo.eta.get(session, arch, branch, now) == 760
+
+    # Durations are also used for the critical path weights
+    graph = bpo.repo.depgraph.get(session, arch, branch)
+    assert graph.nodes[pkgs["a"].id].weight == 900
+
+    # Nothing left to build
+    for pkgname in ["a", "b", "c"]:
+        pkgs[pkgname].status = bpo.db.PackageStatus.built
+    session.commit()
+    assert bpo.repo.eta.get_all(session) == {}
@@ -0,0 +1,171 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/repo/indexer.py """
+import os
+import sys
+import tarfile
+import time
+
+import bpo_test
+import bpo.config.const
+import bpo.helpers.job
+import bpo.job_services.sim
+import bpo.repo
+import bpo.repo.apkindex
+import bpo.repo.indexer
+import bpo.repo.scheduler
+import bpo.repo.tools
+import bpo.repo.wip
+
+
+def init(monkeypatch):
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+
+    path = bpo.repo.wip.get_path("x86_64", "main", None)
+    os.makedirs(path)
+    for i in range(3):
+        bpo_test.fake_apk(path, i)
+    bpo.repo.wip.update_apkindex("x86_64", "main", None)
+    return path
+
+
+def get_apks_indexed(path):
+    entries = bpo.repo.apkindex.parse(path + "/APKINDEX.tar.gz")[1]
+    return sorted(bpo.repo.apkindex.get_apk(entry) for entry in entries)
+
+
+def test_indexer(monkeypatch):
+    path = init(monkeypatch)
+    monkeypatch.setattr(bpo.config.const, "wip_index_delay", 0.5)
+    writes = bpo.repo.indexer.count_writes
+
+    bpo.repo.indexer.start()
+    try:
+        # Multiple packages finish and one apk gets removed
+        for i in range(3, 8):
+            apk = os.path.basename(bpo_test.fake_apk(path, i))
+            bpo.repo.indexer.request("x86_64", "main", None, add=[apk])
+        os.unlink(path + "/test0-1.0-r0.apk")
+        bpo.repo.indexer.request("x86_64", "main", None,
+                                 remove=["test0-1.0-r0.apk"])
+        assert bpo.repo.indexer.count_writes == writes
+
+        # All changes get written at once
+        deadline = time.monotonic() + 10
+        while bpo.repo.indexer.count_writes == writes and \
+                time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert bpo.repo.indexer.count_writes == writes + 1
+        assert bpo.repo.indexer.pending == {}
+    finally:
+        bpo.repo.indexer.stop()
+
+    assert get_apks_indexed(path) == bpo.repo.get_apks(path)
+    with tarfile.open(path + "/APKINDEX.tar.gz") as tar:
+        assert tar.getnames()[0] == ".SIGN.RSA.wip.rsa.pub"
+
+    # Same entries and order as when indexing the whole repository
+    incremental = bpo.repo.apkindex.parse(path + "/APKINDEX.tar.gz")[1]
+    os.unlink(path + "/APKINDEX.tar.gz")
+    bpo.repo.wip.update_apkindex("x86_64", "main", None)
+    assert bpo.repo.apkindex.parse(path + "/APKINDEX.tar.gz")[1] == \
+        incremental
+
+
+def test_indexer_full_update(monkeypatch):
+    """ Updating the whole WIP repo includes the pending changes """
+    path = init(monkeypatch)
+    monkeypatch.setattr(bpo.config.const, "wip_index_delay", 60)
+    writes = bpo.repo.indexer.count_writes
+
+    bpo.repo.indexer.start()
+    try:
+        apk = os.path.basename(bpo_test.fake_apk(path, 3))
+        bpo.repo.indexer.request("x86_64", "main", None, add=[apk])
+        assert list(bpo.repo.indexer.pending.keys()) == \
+            [("x86_64", "main", None)]
+
+        bpo.repo.wip.update_apkindex("x86_64", "main", None)
+        assert bpo.repo.indexer.pending == {}
+        assert get_apks_indexed(path) == bpo.repo.get_apks(path)
+    finally:
+        bpo.repo.indexer.stop()
+    assert bpo.repo.indexer.count_writes == writes
+
+
+def test_indexer_flush_scheduler_pass(monkeypatch):
+    """ Jobs must see the apks of the pending changes, and packages that
+        finished before a scheduler pass result in one write """
+    bpo_test.init_components()
+    monkeypatch.setattr(bpo.config.const, "max_parallel_build_jobs", 4)
+    monkeypatch.setattr(bpo.config.const, "wip_index_delay", 60)
+    monkeypatch.setattr(bpo.repo.wip, "sign", bpo_test.nop)
+
+    payload = bpo.job_services.sim.generate_payload(8, depends_max=0)
+    sim = bpo.job_services.sim.Simulation({"x86_64": payload})
+    branch_data = {"arches": ["x86_64"], "pmb_branch": "main"}
+    monkeypatch.setattr(bpo.config.const, "branches", {"main": branch_data})
+    monkeypatch.setattr(bpo.helpers.job, "jobservice", sim.js)
+    monkeypatch.setattr(bpo.repo.tools, "index", sim.index)
+
+    # Start building the first 4 packages
+    sim.get_depends()
+    assert len(sim.js.running) == 4
+
+    bpo.repo.indexer.start()
+    try:
+        # 3 packages finish before the next scheduler pass, and another repo
+        # has pending changes
+        writes = bpo.repo.indexer.count_writes
+        with monkeypatch.context() as m:
+            m.setattr(bpo.repo.scheduler, "wakeup", bpo_test.nop)
+            for i in range(3):
+                sim.callback(*sim.js.pop_finished())
+        bpo.repo.indexer.request("x86_64", "main", "systemd",
+                                 add=["test-1-r0.apk"])
+        assert bpo.repo.indexer.count_writes == writes
+        add = bpo.repo.indexer.pending[("x86_64", "main", None)][0]
+        assert len(add) == 3
+
+        # The pass writes the APKINDEX of the repo once, before starting jobs
+        bpo.repo.build()
+        assert len(sim.js.running) == 4
+        assert bpo.repo.indexer.count_writes == writes + 1
+        assert list(bpo.repo.indexer.pending.keys()) == \
+            [("x86_64", "main", "systemd")]
+    finally:
+        bpo.repo.indexer.discard("x86_64", "main", "systemd")
+        bpo.repo.indexer.stop()
+
+
+def test_indexer_flush_error(monkeypatch):
+    """ Changes stay pending if writing the APKINDEX fails """
+    path = init(monkeypatch)
+    monkeypatch.setattr(bpo.config.const, "wip_index_delay", 60)
+
+    bpo.repo.indexer.start()
+    try:
+        apk = os.path.basename(bpo_test.fake_apk(path, 3))
+        bpo.repo.indexer.request("x86_64", "main", None, add=[apk])
+
+        def write_fail(*args):
+            # Another package finishes while writing
+            bpo.repo.indexer.request("x86_64", "main", None,
+                                     remove=["test0-1.0-r0.apk"])
+            raise RuntimeError("test")
+
+        with monkeypatch.context() as m:
+            m.setattr(bpo.repo.wip, "update_apkindex", write_fail)
+            bpo.repo.indexer.flush()
+        assert bpo.repo.indexer.pending == {
+            ("x86_64", "main", None): ({apk}, {"test0-1.0-r0.apk"})}
+
+        os.unlink(path + "/test0-1.0-r0.apk")
+        bpo.repo.indexer.flush()
+        assert bpo.repo.indexer.pending == {}
+        assert get_apks_indexed(path) == bpo.repo.get_apks(path)
+    finally:
+        bpo.repo.indexer.stop()
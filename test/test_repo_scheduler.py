@@ -0,0 +1,52 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/repo/scheduler.py """
+import threading
+
+import bpo_test  # noqa
+import bpo.helpers.job
+import bpo.repo
+import bpo.repo.scheduler
+
+
+def test_scheduler_coalesce(monkeypatch):
+    passes = []
+    running = threading.Event()
+    release = threading.Event()
+
+    def build_fake(force_repo_update_branch=None, no_repo_update=False):
+        passes.append(force_repo_update_branch)
+        running.set()
+        release.wait()
+
+    monkeypatch.setattr(bpo.repo, "build", build_fake)
+    monkeypatch.setattr(bpo.helpers.job, "update_status", bpo_test.nop)
+
+    # Without the thread, wakeup() runs the pass directly
+    release.set()
+    bpo.repo.scheduler.wakeup()
+    assert passes == [None]
+    passes.clear()
+    release.clear()
+    running.clear()
+
+    bpo.repo.scheduler.start()
+    try:
+        # First wakeup starts a pass, which blocks until released
+        bpo.repo.scheduler.wakeup()
+        assert running.wait(5)
+
+        # Wakeups while the pass is running collapse into one pass per branch
+        # that needs a forced repo update
+        for i in range(10):
+            bpo.repo.scheduler.wakeup()
+        bpo.repo.scheduler.wakeup("main")
+        bpo.repo.scheduler.wakeup("main", update_status=True)
+        bpo.repo.scheduler.wakeup("v25.12")
+
+        release.set()
+        bpo.repo.scheduler.wait_idle()
+        assert passes == [None, "main", "v25.12"]
+    finally:
+        bpo.repo.scheduler.stop()
+    assert bpo.repo.scheduler.thread is None
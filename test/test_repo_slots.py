@@ -0,0 +1,119 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/repo/slots.py """
+import collections
+import sys
+
+import bpo_test
+import bpo.config.const
+import bpo.db
+import bpo.repo
+import bpo.repo.slots
+
+
+def init_db(monkeypatch):
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+
+    branches = collections.OrderedDict()
+    branches["main"] = {"arches": ["x86_64", "aarch64"]}
+    branches["v25.12"] = {"arches": ["x86_64"]}
+    monkeypatch.setattr(bpo.config.const, "branches", branches)
+    monkeypatch.setattr(bpo.repo.slots, "usage", {})
+    return bpo.db.session()
+
+
+def add_packages(session, arch, branch, count, status):
+    for i in range(count):
+        package = bpo.db.Package(arch, branch, f"{branch}-{arch}-{i}", "1-r0")
+        package.status = status
+        session.add(package)
+    session.commit()
+
+
+def test_slots_available(monkeypatch):
+    session = init_db(monkeypatch)
+    monkeypatch.setattr(bpo.config.const, "max_parallel_build_jobs", 5)
+    monkeypatch.setattr(bpo.config.const, "max_parallel_jobs_type",
+                        {"build_image": 1})
+    monkeypatch.setattr(bpo.config.const, "max_parallel_jobs_arch",
+                        {"aarch64": 1})
+    monkeypatch.setattr(bpo.config.const, "max_parallel_jobs_branch",
+                        {"v25.12": 2})
+
+    building = bpo.db.PackageStatus.building
+    add_packages(session, "x86_64", "main", 2, building)
+    add_packages(session, "aarch64", "main", 1, building)
+
+    slots = bpo.repo.slots.Slots(session)
+    assert slots.running == 3
+    assert slots.running_arch == {"x86_64": 2, "aarch64": 1}
+    assert slots.available("build_package", "main", "x86_64") == 2
+    assert slots.available("build_package", "main", "aarch64") == 0
+    assert slots.available("build_package", "v25.12", "x86_64") == 2
+    assert slots.available("build_image", "main") == 1
+
+    slots.take("build_package", "v25.12", "x86_64")
+    assert slots.available("build_package", "v25.12", "x86_64") == 1
+    assert slots.available("build_package", "main", "x86_64") == 1
+    assert bpo.repo.slots.usage == {"v25.12": 1}
+
+
+def fair_share_build(monkeypatch, count_main, count_v25_12, weight=1):
+    """ :returns: sorted list of branches for which build jobs were started """
+    session = init_db(monkeypatch)
+    monkeypatch.setattr(bpo.config.const, "max_parallel_build_jobs", 4)
+    monkeypatch.setattr(bpo.config.const, "slots_policy", "fair_share")
+    bpo.config.const.branches["v25.12"]["weight"] = weight
+
+    queued = bpo.db.PackageStatus.queued
+    add_packages(session, "x86_64", "main", count_main, queued)
+    add_packages(session, "x86_64", "v25.12", count_v25_12, queued)
+
+    started = []
+
+    def fake_build_package_run(arch, pkgname, branch, splitrepo):
+        package = bpo.db.get_package(session, pkgname, arch, branch,
+                                     splitrepo)
+        bpo.db.set_package_status(session, package,
+                                  bpo.db.PackageStatus.building)
+        started.append(branch)
+        return True
+
+    monkeypatch.setattr(bpo.jobs.build_package, "run", fake_build_package_run)
+    bpo.repo._build()
+    return sorted(started)
+
+
+def test_slots_fair_share(monkeypatch):
+    # Same weight ("ordered" would give all slots to main)
+    assert fair_share_build(monkeypatch, 10, 10) == ["main", "main",
+                                                     "v25.12", "v25.12"]
+
+    # Higher weight for v25.12
+    assert fair_share_build(monkeypatch, 10, 10, 3) == ["main", "v25.12",
+                                                        "v25.12", "v25.12"]
+
+    # A branch that can't use its share leaves the slots to other branches
+    assert fair_share_build(monkeypatch, 10, 1) == ["main", "main", "main",
+                                                    "v25.12"]
+
+
+def test_slots_fair_share_take_turns(monkeypatch):
+    """ With one slot, branches with the same weight take turns """
+    session = init_db(monkeypatch)
+    slots = bpo.repo.slots.Slots(session)
+    branches = bpo.config.const.branches
+
+    order = []
+    for i in range(4):
+        slots.set_fair_share(branches)
+        branch = [b for b in branches if slots.available("build_package", b)]
+        assert len(branch) == 1
+        order += branch
+        slots.take("build_package", branch[0], "x86_64")
+        slots.running = 0
+        slots.running_branch = {}
+    assert order == ["main", "v25.12", "main", "v25.12"]
@@ -8,7 +8,12 @@ import shutil
 import bpo_test
 import bpo_test.trigger
 import bpo.db
+import bpo.helpers.apk_cache
+import bpo.repo.apkindex
+import bpo.repo.final
 import bpo.repo.symlink
+import bpo.repo.tools
+import bpo.repo.wip
 
 
 def test_repo_symlink_link_to_all_packages(monkeypatch):
@@ -70,3 +75,157 @@ def test_repo_symlink_link_to_all_packages(monkeypatch):
     shutil.copy(apk_hello_wrapper_subpkg, final_path)
     func(arch, branch, splitrepo)
     assert bpo.repo.get_apks(symlink_path) == expected_symlinks
+
+
+def test_repo_symlink_update(monkeypatch):
+    bpo_test.init_components()
+    arch = "x86_64"
+    branch = "main"
+    splitrepo = None
+    wip_path = bpo.repo.wip.get_path(arch, branch, splitrepo)
+    final_path = bpo.repo.final.get_path(arch, branch, splitrepo)
+    symlink_path = bpo.repo.symlink.get_path(arch, branch, splitrepo)
+    func = bpo.repo.symlink.update
+
+    path = bpo.config.const.top_dir + "/test/testdata/"
+    apks = ["hello-world-1-r4.apk",
+            "hello-world-wrapper-1-r2.apk",
+            "hello-world-wrapper-subpkg-1-r2.apk"]
+
+    # Skip updating apkindex at the end of bpo.repo.clean()
+    monkeypatch.setattr(bpo.repo.wip, "update_apkindex", bpo_test.nop)
+
+    # Fill the db with "hello-world", "hello-world-wrapper"
+    with bpo_test.BPOServer():
+        monkeypatch.setattr(bpo.repo, "build", bpo_test.stop_server)
+        bpo_test.trigger.job_callback_get_depends("main")
+
+    def get_indexed():
+        entries = bpo.repo.apkindex.parse(symlink_path +
+                                          "/APKINDEX.tar.gz")[1]
+        return sorted(bpo.repo.apkindex.get_apk(entry) for entry in entries)
+
+    def get_targets():
+        return {apk: os.path.dirname(os.readlink(symlink_path + "/" + apk))
+                for apk in bpo.repo.get_apks(symlink_path)}
+
+    # 1. Symlink repo does not exist yet
+    os.makedirs(wip_path)
+    for apk in apks:
+        shutil.copy(path + apk, wip_path)
+    assert not func(arch, branch, splitrepo)
+
+    # 2. Create it from scratch and publish it (like create() and the
+    # sign_index callback, without the job)
+    bpo.repo.symlink.clean(arch, branch, splitrepo)
+    bpo.repo.symlink.link_to_all_packages(arch, branch, splitrepo)
+    bpo.repo.tools.index(arch, branch, "symlink", symlink_path)
+    os.makedirs(final_path)
+    bpo.repo.final.update_from_symlink_repo(arch, branch, splitrepo)
+    bpo.repo.wip.clean(arch, branch, splitrepo)
+    assert bpo.repo.get_apks(wip_path) == []
+    assert get_targets() == {apk: final_path for apk in apks}
+
+    # 3. Nothing changed: no apk gets read
+    misses = bpo.helpers.apk_cache.count_index_misses
+    metadata = bpo.helpers.apk_cache.count_hits + \
+        bpo.helpers.apk_cache.count_misses
+    assert func(arch, branch, splitrepo)
+    assert get_indexed() == apks
+    assert bpo.helpers.apk_cache.count_index_misses == misses
+    assert bpo.helpers.apk_cache.count_hits + \
+        bpo.helpers.apk_cache.count_misses == metadata
+
+    # 4. New version of hello-world in WIP repo
+    session = bpo.db.session()
+    package = bpo.db.get_package(session, "hello-world", arch, branch,
+                                 splitrepo)
+    package.version = "1-r3"
+    session.commit()
+    shutil.copy(path + "hello-world-1-r3.apk", wip_path)
+    assert bpo.repo.symlink.get_changes(arch, branch, splitrepo) == \
+        (["hello-world-1-r3.apk"], ["hello-world-1-r4.apk"])
+    assert func(arch, branch, splitrepo)
+    expected = ["hello-world-1-r3.apk"] + apks[1:]
+    assert get_indexed() == expected
+    assert get_targets() == {"hello-world-1-r3.apk": wip_path,
+                             apks[1]: final_path,
+                             apks[2]: final_path}
+    assert bpo.helpers.apk_cache.count_index_misses == misses + 1
+
+    # 5. Package missing in WIP and final repo: create from scratch, which
+    # fails in the sanity check
+    session.add(bpo.db.Package(arch, branch, "hello-world-new", "1-r0"))
+    session.commit()
+    assert bpo.repo.symlink.get_changes(arch, branch, splitrepo) is None
+    assert bpo.repo.symlink.get_changes(arch, branch, splitrepo, True) == \
+        (["hello-world-1-r3.apk"], [])
+
+    # 6. Package removed from db (with its subpackage)
+    for pkgname in ["hello-world-new", "hello-world-wrapper"]:
+        session.delete(bpo.db.get_package(session, pkgname, arch, branch,
+                                          splitrepo))
+    session.commit()
+    assert func(arch, branch, splitrepo)
+    assert get_indexed() == ["hello-world-1-r3.apk"]
+    assert bpo.repo.get_apks(symlink_path) == ["hello-world-1-r3.apk"]
+
+
+def test_repo_symlink_update_old_layout(monkeypatch):
+    """ Symlink repo from before copy_new_apks() updated the symlinks: after
+        publishing, the symlinks still point to the WIP repo, where the apks
+        got deleted. It must get created from scratch. """
+    bpo_test.init_components()
+    arch = "x86_64"
+    branch = "main"
+    splitrepo = None
+    wip_path = bpo.repo.wip.get_path(arch, branch, splitrepo)
+    final_path = bpo.repo.final.get_path(arch, branch, splitrepo)
+    symlink_path = bpo.repo.symlink.get_path(arch, branch, splitrepo)
+
+    path = bpo.config.const.top_dir + "/test/testdata/"
+    apks = ["hello-world-1-r4.apk",
+            "hello-world-wrapper-1-r2.apk",
+            "hello-world-wrapper-subpkg-1-r2.apk"]
+
+    # Skip updating apkindex at the end of bpo.repo.clean()
+    monkeypatch.setattr(bpo.repo.wip, "update_apkindex", bpo_test.nop)
+
+    # Fill the db with "hello-world", "hello-world-wrapper"
+    with bpo_test.BPOServer():
+        monkeypatch.setattr(bpo.repo, "build", bpo_test.stop_server)
+        bpo_test.trigger.job_callback_get_depends("main")
+
+    # Create from scratch and publish like the old copy_new_apks()
+    os.makedirs(wip_path)
+    for apk in apks:
+        shutil.copy(path + apk, wip_path)
+    bpo.repo.symlink.clean(arch, branch, splitrepo)
+    bpo.repo.symlink.link_to_all_packages(arch, branch, splitrepo)
+    bpo.repo.tools.index(arch, branch, "symlink", symlink_path)
+    os.makedirs(final_path)
+    for apk in apks:
+        shutil.copy(wip_path + "/" + apk, final_path)
+    bpo.repo.wip.clean(arch, branch, splitrepo)
+    assert bpo.repo.get_apks(wip_path) == []
+
+    # New version of hello-world
+    session = bpo.db.session()
+    package = bpo.db.get_package(session, "hello-world", arch, branch,
+                                 splitrepo)
+    package.version = "1-r3"
+    session.commit()
+    shutil.copy(path + "hello-world-1-r3.apk", wip_path)
+
+    # Dangling symlinks to the WIP repo: don't update
+    assert bpo.repo.symlink.get_changes(arch, branch, splitrepo) is None
+    assert not bpo.repo.symlink.update(arch, branch, splitrepo)
+
+    # Symlinks of the new symlink repo point to existing files
+    monkeypatch.setattr(bpo.repo.symlink, "sign", bpo_test.nop)
+    bpo.repo.symlink.create(arch, branch, splitrepo)
+    expected = ["hello-world-1-r3.apk"] + apks[1:]
+    assert bpo.repo.get_apks(symlink_path) == expected
+    for apk in expected:
+        assert os.path.exists(symlink_path + "/" + apk)
+    bpo.repo.final.copy_new_apks(arch, branch, splitrepo)
@@ -2,13 +2,21 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 """ Testing bpo/ui/__init__.py """
 import collections
+import gzip
+import json
+import sys
+
+import sqlalchemy
 
 import bpo_test
 import bpo_test.trigger
+import bpo.config.args
 import bpo.config.const
 import bpo.db
 import bpo.repo
 import bpo.ui
+import bpo.ui.fragments
+import bpo.ui.snapshot
 
 
 def test_update_badge(monkeypatch):
@@ -26,21 +34,22 @@ def test_update_badge(monkeypatch):
         bpo_test.trigger.job_callback_get_depends("main")
 
     session = bpo.db.session()
-    func = bpo.ui.update_badge
-    func_pkgs = bpo.db.get_recent_packages_by_status
-    func_imgs = bpo.db.get_recent_images_by_status
+
+    def func():
+        return bpo.ui.update_badge(bpo.ui.snapshot.get(session))
+
     arch = "x86_64"
     branch = "main"
     splitrepo = None
 
     # Building
-    badge = func(session, func_pkgs(session), func_imgs(session))
+    badge = func()
     assert badge == "building"
 
     # Failed
     pkg_hello = bpo.db.get_package(session, "hello-world", arch, branch, splitrepo)
     bpo.db.set_package_status(session, pkg_hello, bpo.db.PackageStatus.failed)
-    badge = func(session, func_pkgs(session), func_imgs(session))
+    badge = func()
     assert badge == "failed"
 
     # Up-to-date
@@ -48,7 +57,7 @@ def test_update_badge(monkeypatch):
                                      branch, splitrepo)
     bpo.db.set_package_status(session, pkg_hello, bpo.db.PackageStatus.built)
     bpo.db.set_package_status(session, pkg_wrapper, bpo.db.PackageStatus.built)
-    badge = func(session, func_pkgs(session), func_imgs(session))
+    badge = func()
     assert badge == "up-to-date"
 
     # hello-world-wrapper: change branch, set to failed
@@ -58,17 +67,17 @@ def test_update_badge(monkeypatch):
     session.commit()
 
     # Branch is not in config: still up-to-date
-    badge = func(session, func_pkgs(session), func_imgs(session))
+    badge = func()
     assert badge == "up-to-date"
 
     # Branch is in config: failed
     branches["v20.05"] = {"arches": ["x86_64"]}
-    badge = func(session, func_pkgs(session), func_imgs(session))
+    badge = func()
     assert badge == "failed"
 
     # Branch is ignored: up-to-date
     branches["v20.05"]["ignore_errors"] = True
-    badge = func(session, func_pkgs(session), func_imgs(session))
+    badge = func()
     assert badge == "up-to-date"
 
 
@@ -100,10 +109,7 @@ def test_update_monitoring_txt(monkeypatch):
     monkeypatch.setattr(bpo.jobs.build_image, "run", bpo_test.nop)
 
     def assert_txt_content(content_expected, list_count_max=5):
-        func_pkgs = bpo.db.get_recent_packages_by_status
-        func_imgs = bpo.db.get_recent_images_by_status
-        bpo.ui.update_monitoring_txt(session, func_pkgs(session),
-                                     func_imgs(session),
+        bpo.ui.update_monitoring_txt(bpo.ui.snapshot.get(session),
                                      add_footer=False,
                                      list_count_max=list_count_max)
 
@@ -161,3 +167,117 @@ def test_update_monitoring_txt(monkeypatch):
                        "* 📦 [main/x86_64/hello-world](http://localhost/1) (try 1/3)\n"
                        "* ...\n",
                        list_count_max=1)
+
+
+def test_snapshot(monkeypatch):
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+    session = bpo.db.session()
+    arch = "x86_64"
+    branch = "main"
+
+    statements = []
+
+    def count(*args, **kwargs):
+        statements.append(True)
+
+    def get_snapshot():
+        statements.clear()
+        sqlalchemy.event.listen(bpo.db.engine, "before_cursor_execute", count)
+        try:
+            return bpo.ui.snapshot.get(session)
+        finally:
+            sqlalchemy.event.remove(bpo.db.engine, "before_cursor_execute",
+                                    count)
+
+    def add_packages(prefix, amount):
+        depend = bpo.db.Package(arch, branch, f"{prefix}-lib", "1-r0")
+        session.add(depend)
+        for i in range(amount):
+            package = bpo.db.Package(arch, branch, f"{prefix}-{i}", "1-r0")
+            package.depends = [depend]
+            session.add(package)
+        session.commit()
+
+    # Same amount of queries, no matter how many packages are queued
+    add_packages("small", 2)
+    get_snapshot()
+    statements_small = len(statements)
+    add_packages("large", 200)
+    snapshot = get_snapshot()
+    assert len(statements) == statements_small
+
+    assert snapshot.badge == "building"
+    assert len(snapshot.pkgs["queued"]) == 204
+    entry = [package for package in snapshot.pkgs["queued"]
+             if package.pkgname == "large-0"][0]
+    assert entry.depends_missing == ("large-lib",)
+
+    # Snapshot is read-only
+    try:
+        snapshot.pkgs["queued"] = ()
+        assert False, "snapshot.pkgs is writable"
+    except TypeError:
+        pass
+
+    # Same data in status.json
+    bpo.ui.render(session)
+    assert bpo.ui.snapshot.latest.pkgcount == 204
+    with open(bpo.config.args.html_out + "/status.json") as handle:
+        status = json.load(handle)
+    assert status["badge"] == "building"
+    assert status["pkgcount"] == 204
+    assert len(status["pkgs"]["queued"]) == 204
+    assert status["pkgs"]["published"] == 0
+
+
+def test_fragments(monkeypatch):
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+    session = bpo.db.session()
+    branch = "main"
+    index = bpo.config.args.html_out + "/index.html"
+
+    for arch in ["x86_64", "aarch64", "armv7"]:
+        for i in range(3):
+            session.add(bpo.db.Package(arch, branch, f"pkg-{i}", "1-r0"))
+    session.commit()
+
+    def render():
+        count_before = bpo.ui.fragments.count_renders
+        bpo.ui.render(session)
+        with open(index) as handle:
+            html = handle.read()
+        return bpo.ui.fragments.count_renders - count_before, html
+
+    # First render: one fragment per arch with queued packages
+    count, html = render()
+    assert count == 3
+    queued = html[html.index('name="queued-pkgs"'):]
+    assert queued.index("aarch64") < queued.index("armv7") < \
+        queued.index("x86_64")
+
+    # Nothing changed: all fragments from the cache
+    assert render()[0] == 0
+
+    # One package failed: render its fragment in the failed list, and the
+    # queued fragment of its arch
+    package = bpo.db.get_package(session, "pkg-1", "armv7", branch, None)
+    bpo.db.set_package_status(session, package, bpo.db.PackageStatus.failed,
+                              1)
+    count, html = render()
+    assert count == 2
+    assert html.count("pkg-1") == 3
+    assert "(try 1/3)" in html
+
+    # Precompressed copies have the same content
+    for name in ["index.html", "status.json"]:
+        path = f"{bpo.config.args.html_out}/{name}"
+        with open(path, "rb") as handle:
+            content = handle.read()
+        with gzip.open(path + ".gz", "rb") as handle:
+            assert handle.read() == content
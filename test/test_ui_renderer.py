@@ -0,0 +1,70 @@
+# Copyright 2026 Oliver Smith
+# SPDX-License-Identifier: AGPL-3.0-or-later
+""" Testing bpo/ui/renderer.py """
+import os
+import sys
+import threading
+
+import bpo_test
+import bpo.config.args
+import bpo.config.const
+import bpo.ui
+import bpo.ui.renderer
+
+
+def test_renderer_coalesce(monkeypatch):
+    bpo_test.reset()
+    monkeypatch.setattr(sys, "argv", ["bpo.py", "-t", "test/test_tokens.cfg",
+                                      "--mirror", "", "local"])
+    bpo.init_components()
+    index = bpo.config.args.html_out + "/index.html"
+
+    renders = []
+    render_orig = bpo.ui.render
+
+    def render_fake(session):
+        renders.append(threading.current_thread().name)
+        render_orig(session)
+
+    monkeypatch.setattr(bpo.ui, "render", render_fake)
+
+    # Without the thread, every log message renders directly
+    for i in range(3):
+        bpo.ui.log("test_renderer_sync")
+    assert len(renders) == 3
+    renders.clear()
+
+    # With the thread, a burst of log messages gets rendered once
+    monkeypatch.setattr(bpo.config.const, "ui_render_interval", 3600)
+    bpo.ui.renderer.last_render = 0
+    bpo.ui.renderer.start()
+    try:
+        # First render happens right away, as the interval has passed
+        bpo.ui.log("test_renderer_first")
+        bpo.ui.renderer.flush()
+        assert len(renders) == 1
+
+        # The next ones are delayed by the interval
+        os.unlink(index)
+        for i in range(50):
+            bpo.ui.log("test_renderer_burst")
+        assert len(renders) == 1
+        assert not os.path.exists(index)
+
+        # Explicit flush renders once
+        bpo.ui.renderer.flush()
+        assert len(renders) == 2
+        assert renders[1] == "MainThread"
+        with open(index) as handle:
+            assert "test_renderer_burst" in handle.read()
+
+        # Nothing left to render
+        bpo.ui.renderer.flush()
+        assert len(renders) == 2
+
+        # Stopping renders pending changes
+        bpo.ui.log("test_renderer_stop")
+    finally:
+        bpo.ui.renderer.stop()
+    assert bpo.ui.renderer.thread is None
+    assert len(renders) == 3